@@ -0,0 +1,419 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import shapely
+from scipy.spatial import cKDTree
+import conversions
+from find_euler_path import annotate_circuit, eulerize_graph, order_circuit
+
+NETWORKS = ('grid', 'perturbed_grid', 'suburb')
+
+# stages that grow too fast to run on large networks are skipped above these segment counts
+STAGE_LIMITS = {
+    'eulerize_built_in': 1000,
+    'order_trotter': 20000,
+}
+
+
+def grid_network(n_segments, odd_fraction=None, perturbation=0.0, seed=0, spacing=0.001,
+                 origin=(-84.2, 34.1)):
+    """
+    Generates a square street grid with about n_segments road segments.
+
+    Rows are named "Row i St" and columns "Col j Ave". Every fifth row is a Boulevard and every seventh column a
+    Parkway, so weighted_by_road_type style multipliers apply with formatted_road_type='RoadPosTyp'.
+
+    Parameters:
+    - n_segments (int): Approximate number of road segments.
+    - odd_fraction (float, optional): Fraction of intersections that should have odd degree, see
+      set_odd_fraction(). None keeps the grid as generated.
+    - perturbation (float): How far each intersection is moved at random, as a fraction of the spacing.
+    - seed (int): Random seed.
+    - spacing (float): Distance between neighbouring intersections in degrees.
+    - origin (tuple): (longitude, latitude) of the first intersection.
+
+    Returns:
+    - geopandas.GeoDataFrame: One LineString feature per segment, with 'FullStName' and 'RoadPosTyp' columns.
+    """
+    rng = np.random.default_rng(seed)
+    # a grid of side s has 2 * s * (s - 1) segments
+    side = max(2, int(round((1 + np.sqrt(1 + 2 * n_segments)) / 2)))
+    index = np.arange(side * side).reshape(side, side)
+    rows, columns = np.divmod(np.arange(side * side), side)
+    coordinates = np.column_stack([origin[0] + columns * spacing, origin[1] + rows * spacing]).astype(float)
+    if perturbation:
+        coordinates += rng.uniform(-perturbation, perturbation, coordinates.shape) * spacing
+
+    horizontal = np.column_stack([index[:, :-1].ravel(), index[:, 1:].ravel()])
+    vertical = np.column_stack([index[:-1, :].ravel(), index[1:, :].ravel()])
+    edges = np.concatenate([horizontal, vertical])
+    edge_rows = rows[edges[:, 0]]
+    edge_columns = columns[edges[:, 0]]
+    is_vertical = np.arange(len(edges)) >= len(horizontal)
+    names = np.where(is_vertical, np.char.add(np.char.add('Col ', edge_columns.astype(str)), ' Ave'),
+                     np.char.add(np.char.add('Row ', edge_rows.astype(str)), ' St')).astype(object)
+    types = np.where(is_vertical, np.where(edge_columns % 7 == 0, 'Parkway', 'Road'),
+                     np.where(edge_rows % 5 == 0, 'Boulevard', 'Road')).astype(object)
+    # every row and the first column form a spanning tree, so the other columns' segments can go
+    removable = is_vertical & (edge_columns > 0)
+    return road_network_frame(coordinates, edges, names, types, removable, odd_fraction, rng)
+
+
+def suburb_network(n_segments, odd_fraction=None, seed=0, spacing=0.0005, continue_probability=0.8,
+                   origin=(-84.2, 34.1)):
+    """
+    Generates a tree-like suburb of about n_segments road segments: streets wind on from their last segment
+    and now and then a new street branches off a random earlier point, ending in cul-de-sacs.
+
+    Parameters:
+    - n_segments (int): Approximate number of road segments.
+    - odd_fraction (float, optional): Fraction of intersections that should have odd degree, see
+      set_odd_fraction(). A tree can only lose odd nodes, by joining nearby dead ends into loops.
+    - seed (int): Random seed.
+    - spacing (float): Segment length in degrees.
+    - continue_probability (float): Chance that the next segment carries on the street just built.
+    - origin (tuple): (longitude, latitude) of the first node.
+
+    Returns:
+    - geopandas.GeoDataFrame: One LineString feature per segment, with 'FullStName' and 'RoadPosTyp' columns.
+    """
+    rng = np.random.default_rng(seed)
+    n_nodes = max(2, n_segments + 1)
+    coordinates = np.empty((n_nodes, 2))
+    coordinates[0] = origin
+    headings = np.zeros(n_nodes)
+    streets = np.zeros(n_nodes, dtype=np.int64)
+    parents = np.zeros(n_nodes, dtype=np.int64)
+    street_count = 1
+    continues = rng.random(n_nodes) < continue_probability
+    turns = rng.normal(0, 0.2, n_nodes)
+    for node in range(1, n_nodes):
+        if continues[node]:
+            parent = node - 1
+            heading = headings[parent] + turns[node]
+            streets[node] = streets[parent]
+        else:
+            parent = int(rng.integers(node))
+            heading = headings[parent] + rng.choice([-np.pi / 2, np.pi / 2]) + turns[node]
+            streets[node] = street_count
+            street_count += 1
+        parents[node] = parent
+        headings[node] = heading
+        coordinates[node] = coordinates[parent] + spacing * np.array([np.cos(heading), np.sin(heading)])
+
+    edges = np.column_stack([parents[1:], np.arange(1, n_nodes)])
+    street_ids = streets[1:]
+    names = np.char.add(np.char.add('Street ', street_ids.astype(str)), ' Dr').astype(object)
+    types = np.where(street_ids == 0, 'Parkway', np.where(street_ids % 3 == 0, 'Circle', 'Drive')).astype(object)
+    return road_network_frame(coordinates, edges, names, types, np.zeros(len(edges), dtype=bool), odd_fraction,
+                              rng)
+
+
+def road_network_frame(coordinates, edges, names, types, removable, odd_fraction=None, rng=None):
+    """
+    Turns generated intersections and segments into the GeoDataFrame convert_to_graph_road_edges() reads,
+    after adjusting the share of odd-degree intersections.
+
+    Parameters:
+    - coordinates (numpy.ndarray): (longitude, latitude) of each intersection.
+    - edges (numpy.ndarray): (n, 2) intersection indices of each segment.
+    - names (numpy.ndarray): Road name of each segment.
+    - types (numpy.ndarray): Road type of each segment.
+    - removable (numpy.ndarray): Segments that can go without disconnecting the network.
+    - odd_fraction (float, optional): Wanted fraction of odd-degree intersections.
+    - rng (numpy.random.Generator, optional): Random generator.
+
+    Returns:
+    - geopandas.GeoDataFrame: The road features.
+    """
+    if odd_fraction is not None:
+        keep, joins = set_odd_fraction(coordinates, edges, removable, odd_fraction, rng)
+        edges = np.concatenate([edges[keep], joins])
+        names = np.concatenate([names[keep], [f"Loop {i} Ct" for i in range(len(joins))]]).astype(object)
+        types = np.concatenate([types[keep], ['Court'] * len(joins)]).astype(object)
+    return gpd.GeoDataFrame({'FullStName': names, 'RoadPosTyp': types},
+                            geometry=shapely.linestrings(coordinates[edges]), crs='EPSG:4326')
+
+
+def set_odd_fraction(coordinates, edges, removable, odd_fraction, rng=None):
+    """
+    Brings the share of odd-degree intersections close to odd_fraction. Removing a segment or adding one
+    flips the parity of both its ends, so segments between two even intersections are removed to add odd
+    ones, and segments between two odd ones are removed, or nearby odd intersections joined by new
+    segments, to take odd ones away. Only removable segments are removed, so the network stays connected.
+
+    Parameters:
+    - coordinates (numpy.ndarray): (longitude, latitude) of each intersection.
+    - edges (numpy.ndarray): (n, 2) intersection indices of each segment.
+    - removable (numpy.ndarray): Segments that can go without disconnecting the network.
+    - odd_fraction (float): Wanted fraction of odd-degree intersections.
+    - rng (numpy.random.Generator, optional): Random generator.
+
+    Returns:
+    - tuple: A mask of the segments to keep and an (m, 2) array of new segments.
+    """
+    rng = rng or np.random.default_rng()
+    odd = np.bincount(edges.ravel(), minlength=len(coordinates)) % 2 == 1
+    count = int(odd.sum())
+    target = int(round(odd_fraction * len(coordinates) / 2)) * 2
+    keep = np.ones(len(edges), dtype=bool)
+    joins = []
+    for edge in rng.permutation(np.flatnonzero(removable)):
+        if count == target:
+            break
+        u, v = edges[edge]
+        if u != v and odd[u] == odd[v] == (count > target):
+            keep[edge] = False
+            odd[u] = odd[v] = not odd[u]
+            count += -2 if count > target else 2
+    if count > target:
+        odd_nodes = np.flatnonzero(odd)
+        neighbours = cKDTree(coordinates[odd_nodes]).query(coordinates[odd_nodes],
+                                                           k=min(8, len(odd_nodes)))[1]
+        joined = np.zeros(len(odd_nodes), dtype=bool)
+        existing = {frozenset(edge) for edge in edges.tolist()}
+        for i in rng.permutation(len(odd_nodes)):
+            if count <= target:
+                break
+            if joined[i]:
+                continue
+            for j in neighbours[i][1:]:
+                pair = frozenset((odd_nodes[i], odd_nodes[j]))
+                if not joined[j] and pair not in existing:
+                    joins.append((odd_nodes[i], odd_nodes[j]))
+                    joined[i] = joined[j] = True
+                    count -= 2
+                    break
+    return keep, np.array(joins, dtype=edges.dtype).reshape(-1, 2)
+
+
+def make_network(network, n_segments, odd_fraction=None, seed=0):
+    """
+    Generates one of the NETWORKS by name.
+
+    Parameters:
+    - network (str): "grid", "perturbed_grid" or "suburb".
+    - n_segments (int): Approximate number of road segments.
+    - odd_fraction (float, optional): Wanted fraction of odd-degree intersections.
+    - seed (int): Random seed.
+
+    Returns:
+    - geopandas.GeoDataFrame: The road features.
+    """
+    if network == 'grid':
+        return grid_network(n_segments, odd_fraction, seed=seed)
+    if network == 'perturbed_grid':
+        return grid_network(n_segments, odd_fraction, perturbation=0.3, seed=seed)
+    if network == 'suburb':
+        return suburb_network(n_segments, odd_fraction, seed=seed)
+    raise ValueError(f"Unknown network {network!r}, expected one of {NETWORKS}")
+
+
+def measure(stage, profile_memory=True):
+    """
+    Runs a benchmark stage, timing it and optionally tracing its peak memory with tracemalloc.
+
+    Parameters:
+    - stage (function): The stage, called without arguments.
+    - profile_memory (bool): Trace peak memory. Tracing slows the stage down.
+
+    Returns:
+    - tuple: (result, wall time in seconds, peak memory in MiB or None).
+    """
+    if profile_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = stage()
+    finally:
+        wall_time = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1] / 2 ** 20 if profile_memory else None
+        if profile_memory:
+            tracemalloc.stop()
+    return result, wall_time, peak_memory
+
+
+def benchmark_pipeline(geojson_file, work_dir, n_segments, stage_limits=None, profile_memory=True):
+    """
+    Times every stage of the pipeline in main_driver.py on one road network: conversion to GraphML, each
+    eulerization method, each ordering method, annotating the circuit and conversion back to GeoJSON.
+
+    Parameters:
+    - geojson_file (str): The road network.
+    - work_dir (str): Directory for the intermediate files.
+    - n_segments (int): Size of the network, compared against stage_limits.
+    - stage_limits (dict, optional): Largest network each stage runs on, defaults to STAGE_LIMITS.
+    - profile_memory (bool): Trace each stage's peak memory.
+
+    Returns:
+    - list: One dict per stage with 'stage', 'wall_time_s', 'peak_memory_mb' and 'status'.
+    """
+    stage_limits = STAGE_LIMITS if stage_limits is None else stage_limits
+    graphml_file = os.path.join(work_dir, 'graph.graphml')
+    circuit_file = os.path.join(work_dir, 'circuit.graphml')
+    state = {}
+    stages = [
+        ('convert_to_graph_road_edges', lambda: conversions.convert_to_graph_road_edges(
+            geojson_file, dest=graphml_file, formatted_road_name='FullStName', formatted_road_type='RoadPosTyp',
+            length_unit='miles')),
+        ('read_graphml', lambda: state.update(G=nx.read_graphml(graphml_file, force_multigraph=True))),
+    ]
+    # the greedy eulerizers run in their bounded odd-node mode, the all-pairs one does not scale at all
+    bounded = {'odd_nodes_only': True, 'k_nearest': 10}
+    for method, options in [('built_in', {}), ('built_in_weighted', {}), ('min_weights', bounded),
+                            ('dijkstra', bounded)]:
+        stages.append(('eulerize_' + method,
+                       lambda method=method, options=options: state.setdefault('eulerized', {}).update(
+                           {method: eulerize_graph(state['G'], method, options)})))
+    for method in ['built_in', 'trotter', 'hierholzer']:
+        stages.append(('order_' + method, lambda method=method: state.setdefault('circuits', {}).update(
+            {method: order_circuit(euler_graph(state), method)})))
+    stages += [
+        ('annotate_circuit', lambda: nx.write_graphml(annotate_circuit(
+            euler_graph(state), state['circuits']['hierholzer'], 'miles')[0], circuit_file)),
+        ('convert_to_geojson', lambda: conversions.convert_to_geojson(
+            circuit_file, dest=os.path.join(work_dir, 'circuit.geojson'))),
+    ]
+
+    rows = []
+    for name, stage in stages:
+        row = {'stage': name, 'wall_time_s': None, 'peak_memory_mb': None, 'status': 'ok'}
+        if n_segments > stage_limits.get(name, float('inf')):
+            row['status'] = 'skipped'
+        else:
+            try:
+                _, row['wall_time_s'], row['peak_memory_mb'] = measure(stage, profile_memory)
+            except Exception as error:
+                row['status'] = f"error: {type(error).__name__}: {error}"
+        rows.append(row)
+    return rows
+
+
+def euler_graph(state):
+    """
+    Picks the eulerized graph the ordering stages work on, preferring the road-length weighted one.
+    """
+    eulerized = state.get('eulerized', {})
+    for method in ['built_in_weighted', 'dijkstra', 'min_weights', 'built_in']:
+        if method in eulerized:
+            return eulerized[method]
+    raise RuntimeError("No eulerization stage succeeded")
+
+
+def run_benchmarks(sizes=(500, 2000, 10000), networks=NETWORKS, odd_fractions=(0.1, 0.3), seed=0,
+                   output_dir='benchmark_results', label=None, stage_limits=None, profile_memory=True):
+    """
+    Generates every combination of network, size and odd-node fraction, benchmarks the pipeline on each and
+    saves the results to output_dir/<label>.json for compare_benchmarks().
+
+    Parameters:
+    - sizes (iterable): Approximate numbers of road segments.
+    - networks (iterable): Names from NETWORKS.
+    - odd_fractions (iterable): Wanted fractions of odd-degree intersections.
+    - seed (int): Random seed for the generated networks.
+    - output_dir (str): Directory for the results and the generated networks.
+    - label (str, optional): Name of the results file, defaults to the current time.
+    - stage_limits (dict, optional): Largest network each stage runs on, defaults to STAGE_LIMITS.
+    - profile_memory (bool): Trace each stage's peak memory.
+
+    Returns:
+    - str: Path of the saved results.
+    """
+    label = label or time.strftime('%Y%m%d-%H%M%S')
+    results = {
+        'label': label,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'networkx': nx.__version__,
+        'numpy': np.__version__,
+        'profile_memory': profile_memory,
+        'results': [],
+    }
+    for network in networks:
+        for n_segments in sizes:
+            for odd_fraction in odd_fractions:
+                name = f"{network}_{n_segments}_{odd_fraction}"
+                work_dir = os.path.join(output_dir, 'networks', name)
+                os.makedirs(work_dir, exist_ok=True)
+                geojson_file = os.path.join(work_dir, 'roads.geojson')
+                gdf = make_network(network, n_segments, odd_fraction, seed)
+                gdf.to_file(geojson_file, driver='GeoJSON')
+                for row in benchmark_pipeline(geojson_file, work_dir, n_segments, stage_limits, profile_memory):
+                    results['results'].append({'network': network, 'segments': n_segments,
+                                               'actual_segments': len(gdf), 'odd_fraction': odd_fraction,
+                                               'seed': seed, **row})
+                    print(json.dumps(results['results'][-1]))
+    path = os.path.join(output_dir, label + '.json')
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def compare_benchmarks(baseline_file, current_file, time_tolerance=0.25, memory_tolerance=0.25, min_time=0.05):
+    """
+    Finds stages that got slower or used more memory between two run_benchmarks() results.
+
+    Parameters:
+    - baseline_file (str): Results of the earlier version.
+    - current_file (str): Results of the version under test.
+    - time_tolerance (float): Allowed relative increase in wall time.
+    - memory_tolerance (float): Allowed relative increase in peak memory.
+    - min_time (float): Stages faster than this many seconds in both runs are too noisy to compare on time.
+
+    Returns:
+    - list: One dict per regression, with the stage, the measure and both values.
+    """
+    def load(path):
+        with open(path) as f:
+            return {(row['network'], row['segments'], row['odd_fraction'], row['stage']): row
+                    for row in json.load(f)['results']}
+
+    baseline, current = load(baseline_file), load(current_file)
+    regressions = []
+    for key, row in current.items():
+        before = baseline.get(key)
+        if before is None:
+            continue
+        if before['status'] == 'ok' and row['status'] != 'ok' and row['status'] != 'skipped':
+            regressions.append({'key': key, 'measure': 'status', 'baseline': before['status'],
+                                'current': row['status']})
+            continue
+        for measure_name, tolerance in [('wall_time_s', time_tolerance), ('peak_memory_mb', memory_tolerance)]:
+            old, new = before.get(measure_name), row.get(measure_name)
+            if old is None or new is None:
+                continue
+            if measure_name == 'wall_time_s' and max(old, new) < min_time:
+                continue
+            if new > old * (1 + tolerance):
+                regressions.append({'key': key, 'measure': measure_name, 'baseline': old, 'current': new})
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic road networks.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 2000, 10000])
+    parser.add_argument('--networks', nargs='+', default=list(NETWORKS), choices=NETWORKS)
+    parser.add_argument('--odd-fractions', type=float, nargs='+', default=[0.1, 0.3])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output-dir', default='benchmark_results')
+    parser.add_argument('--label')
+    parser.add_argument('--no-memory', action='store_true', help="skip tracemalloc for cleaner timings")
+    parser.add_argument('--baseline', help="earlier results to check for regressions")
+    args = parser.parse_args()
+
+    results_file = run_benchmarks(args.sizes, args.networks, args.odd_fractions, args.seed, args.output_dir,
+                                  args.label, profile_memory=not args.no_memory)
+    print("saved", results_file)
+    if args.baseline:
+        found = compare_benchmarks(args.baseline, results_file)
+        for regression in found:
+            print("regression:", json.dumps(regression, default=str))
+        sys.exit(1 if found else 0)
@@ -0,0 +1,311 @@
+import json
+import numpy as np
+from find_euler_path import circuit_edges, edge_segments, parse_node
+
+
+class CircuitIndex:
+    """
+    Position index over an ordered Euler circuit, for dispatch questions such as where a unit driving the
+    circuit is after a given distance or time, when it next drives a given road segment, and how to cut the
+    circuit into shift-length legs.
+
+    Contracted edges are expanded back into their original segments, so every row of the index is one road
+    segment in the order it is driven. Prefix sums of segment length (and travel time, if speeds are given)
+    let every query run as a binary search instead of a walk along the circuit. The circuit is treated as a
+    loop: distances and times past its end carry on into the next lap.
+
+    Attributes:
+    - sources, targets (numpy.ndarray): float64 (n, 2) start and end coordinates of every segment.
+    - lengths (numpy.ndarray): float64 length of every segment.
+    - distances (numpy.ndarray): float64 prefix sums of lengths, distances[i] being the distance driven when
+      segment i starts and distances[-1] the length of the circuit.
+    - times (numpy.ndarray or None): float64 prefix sums of travel time, laid out like distances.
+    - edge_ids (numpy.ndarray): int32 position in the circuit of the edge each segment was expanded from.
+    - name_index, type_codes (numpy.ndarray): int32 indexes into names and types of each segment's road.
+    - names, types (list): The distinct road names and road types.
+    - points (numpy.ndarray): float64 (m, 2) distinct segment end points, sorted.
+    - visit_keys (numpy.ndarray): int64 sorted codes of the distinct segments, ignoring direction.
+    - visit_indptr, visits (numpy.ndarray): CSR lists of the positions at which each distinct segment is
+      driven, in circuit order. The visits of visit_keys[k] are visits[visit_indptr[k]:visit_indptr[k + 1]].
+    """
+
+    def __init__(self, sources, targets, lengths, edge_ids, name_index, type_codes, names=(), types=(),
+                 times=None, visit_arrays=None):
+        self.sources = np.asarray(sources, dtype=np.float64).reshape(-1, 2)
+        self.targets = np.asarray(targets, dtype=np.float64).reshape(-1, 2)
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        self.edge_ids = np.asarray(edge_ids, dtype=np.int32)
+        self.name_index = np.asarray(name_index, dtype=np.int32)
+        self.type_codes = np.asarray(type_codes, dtype=np.int32)
+        self.names = list(names)
+        self.types = list(types)
+        self.distances = np.concatenate(([0.0], np.cumsum(self.lengths)))
+        self.times = None if times is None else np.concatenate(([0.0], np.cumsum(times)))
+        self._node_ids = None
+        if visit_arrays is None:
+            self._build_visits()
+        else:
+            self.points, self.visit_keys, self.visits, self.visit_indptr = visit_arrays
+
+    def _build_visits(self):
+        # number every distinct point, then every distinct (unordered) pair of points; as complex numbers the
+        # points sort by x and then y in a single one dimensional pass
+        ends = np.concatenate([self.sources, self.targets])
+        points, nodes = np.unique(ends[:, 0] + 1j * ends[:, 1], return_inverse=True)
+        nodes = nodes.reshape(2, -1)
+        self.points = np.column_stack([points.real, points.imag])
+        pairs = np.sort(nodes, axis=0).astype(np.int64)
+        codes = pairs[0] * len(points) + pairs[1]
+        self.visit_keys, segment_keys = np.unique(codes, return_inverse=True)
+        # a stable sort keeps every segment's visits in circuit order
+        self.visits = np.argsort(segment_keys, kind='stable').astype(np.int32)
+        self.visit_indptr = np.concatenate(([0], np.cumsum(np.bincount(segment_keys,
+                                                                        minlength=len(self.visit_keys)))))
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @property
+    def total_distance(self):
+        return float(self.distances[-1])
+
+    @property
+    def total_time(self):
+        return None if self.times is None else float(self.times[-1])
+
+    @classmethod
+    def from_edges(cls, edges, speeds=None, default_speed=None):
+        """
+        Builds the index from circuit edges in the order they are driven.
+
+        Parameters:
+        - edges (iterable): (source, target, data) tuples in circuit order with the 'name', 'type' and
+          'length' attributes given by circuit_edges(), and the geometry of contracted edges.
+        - speeds (dict, optional): Speed per road type, in length units per unit of time (for example miles
+          per hour), used to add travel times to the index.
+        - default_speed (float, optional): Speed for road types missing from speeds.
+
+        Returns:
+        CircuitIndex: The index.
+        """
+        sources, targets, lengths, edge_ids, name_index, type_codes = [], [], [], [], [], []
+        names, name_ids, types, type_ids = [], {}, [], {}
+        for position, (source, target, data) in enumerate(edges):
+            name = name_ids.setdefault(data['name'], len(name_ids))
+            if name == len(names):
+                names.append(data['name'])
+            road_type = type_ids.setdefault(data['type'], len(type_ids))
+            if road_type == len(types):
+                types.append(data['type'])
+            for segment_source, segment_target, length in edge_segments(parse_node(source), parse_node(target),
+                                                                        data):
+                sources.append(segment_source[:2])
+                targets.append(segment_target[:2])
+                lengths.append(length)
+                edge_ids.append(position)
+                name_index.append(name)
+                type_codes.append(road_type)
+
+        times = None
+        if speeds is not None or default_speed is not None:
+            speeds = speeds or {}
+            missing = {road_type for road_type in types if road_type not in speeds} if default_speed is None \
+                else set()
+            if missing:
+                raise ValueError(f"No speed given for road types {sorted(missing, key=str)}")
+            type_speeds = np.array([speeds.get(road_type, default_speed) for road_type in types], dtype=np.float64)
+            times = np.asarray(lengths, dtype=np.float64) / type_speeds[np.asarray(type_codes, dtype=np.int64)]
+        return cls(sources, targets, lengths, edge_ids, name_index, type_codes, names=names, types=types,
+                   times=times)
+
+    @classmethod
+    def from_circuit(cls, euler_G, circuit, length_unit="miles", speeds=None, default_speed=None):
+        """
+        Builds the index straight from an Eulerized graph and its ordered circuit, as modify_graph() has them.
+
+        Parameters:
+        - euler_G (networkx.MultiGraph): The Eulerized graph.
+        - circuit (list): The circuit as (source, target) tuples.
+        - length_unit (str): Unit of length for measuring artificial edges.
+        - speeds (dict, optional): Speed per road type, see from_edges().
+        - default_speed (float, optional): Speed for road types missing from speeds.
+
+        Returns:
+        CircuitIndex: The index.
+        """
+        return cls.from_edges(circuit_edges(euler_G, circuit, length_unit), speeds=speeds,
+                              default_speed=default_speed)
+
+    def _prefix(self, by):
+        if by == 'length':
+            return self.distances
+        if by == 'time':
+            if self.times is None:
+                raise ValueError("The index has no travel times, build it with speeds")
+            return self.times
+        raise ValueError("by must be 'length' or 'time'")
+
+    def position_at(self, value, by='length'):
+        """
+        Finds where a unit is after driving the circuit for a given distance or time.
+
+        Parameters:
+        - value (float): Distance (or time) since the start of the circuit. Values past the end of the
+          circuit continue into the next lap.
+        - by (str): 'length' or 'time'.
+
+        Returns:
+        - dict: 'point' (the interpolated (x, y) position), 'segment' (its row in the index), 'edge' (its
+          position in the circuit), 'name', 'type' and 'fraction' (how far along the segment it is).
+        """
+        prefix = self._prefix(by)
+        if not len(self):
+            raise ValueError("The circuit is empty")
+        total = prefix[-1]
+        offset = value % total if total > 0 else 0.0
+        segment = min(int(np.searchsorted(prefix, offset, side='right')) - 1, len(self) - 1)
+        span = prefix[segment + 1] - prefix[segment]
+        fraction = (offset - prefix[segment]) / span if span > 0 else 0.0
+        point = self.sources[segment] + fraction * (self.targets[segment] - self.sources[segment])
+        return {'point': tuple(point.tolist()),
+                'segment': segment,
+                'edge': int(self.edge_ids[segment]),
+                'name': self.names[self.name_index[segment]],
+                'type': self.types[self.type_codes[segment]],
+                'fraction': float(fraction)}
+
+    def next_visit(self, source, target, value=0.0, by='length'):
+        """
+        Finds when the segment between two points is next driven, in either direction.
+
+        Parameters:
+        - source, target: The end points of a road segment, as coordinates or GraphML node labels.
+        - value (float): The distance (or time) to search from.
+        - by (str): 'length' or 'time'.
+
+        Returns:
+        - tuple: (distance or time at which the segment is next entered, its row in the index).
+        """
+        prefix = self._prefix(by)
+        visits = self.visits_of(source, target)
+        starts = prefix[visits]
+        total = prefix[-1]
+        lap, offset = divmod(value, total) if total > 0 else (0.0, 0.0)
+        i = int(np.searchsorted(starts, offset, side='left'))
+        if i == len(visits):
+            # nothing left this lap, the first visit of the next one
+            return float(starts[0] + (lap + 1) * total), int(visits[0])
+        return float(starts[i] + lap * total), int(visits[i])
+
+    def visits_of(self, source, target):
+        """
+        Returns the rows of the index at which the segment between two points is driven, in circuit order.
+        """
+        if self._node_ids is None:
+            self._node_ids = {point: i for i, point in enumerate(map(tuple, self.points.tolist()))}
+        try:
+            u, v = sorted(self._node_ids[tuple(parse_node(node) if isinstance(node, str) else node)[:2]]
+                          for node in (source, target))
+        except KeyError:
+            raise KeyError(f"{source} - {target} is not a segment of the circuit") from None
+        code = u * len(self.points) + v
+        k = int(np.searchsorted(self.visit_keys, code))
+        if k == len(self.visit_keys) or self.visit_keys[k] != code:
+            raise KeyError(f"{source} - {target} is not a segment of the circuit")
+        return self.visits[self.visit_indptr[k]:self.visit_indptr[k + 1]]
+
+    def split(self, k=None, max_length=None, by='length'):
+        """
+        Cuts the circuit into consecutive legs, for example one per shift, at segment boundaries.
+
+        With k alone the circuit is cut into k legs of about equal length (or time), each of at least one
+        segment. With max_length alone it is cut into as few legs as possible that each stay within
+        max_length; a single segment longer than that becomes a leg of its own. With both, the k equal legs
+        must each fit within max_length.
+
+        Parameters:
+        - k (int, optional): Number of legs, at most the number of segments.
+        - max_length (float, optional): Length (or time) budget per leg.
+        - by (str): 'length' or 'time'.
+
+        Returns:
+        - list: (start, stop) rows of the index for each leg, so a leg covers segments start to stop - 1 and
+          its length is distances[stop] - distances[start].
+        """
+        prefix = self._prefix(by)
+        n = len(self)
+        if k is None and max_length is None:
+            raise ValueError("Give k, max_length or both")
+        if k is not None:
+            if k < 1:
+                raise ValueError("k must be at least 1")
+            if k > n:
+                raise ValueError(f"The circuit has only {n} segments, it cannot be cut into {k} legs")
+            targets = prefix[-1] * np.arange(1, k) / k
+            # cut at the segment boundary nearest to each equal share
+            after = np.clip(np.searchsorted(prefix, targets), 1, n)
+            before = after - 1
+            nearest = np.maximum(np.where(targets - prefix[before] <= prefix[after] - targets, before, after), 1)
+            # then move cuts apart so every leg keeps at least one segment and the last cut leaves room for the
+            # legs after it
+            positions = np.arange(1, k)
+            cuts = np.maximum.accumulate(nearest - positions) + positions
+            cuts = np.minimum(cuts, n - k + positions)
+            cuts = np.concatenate(([0], cuts, [n]))
+            legs = list(zip(cuts[:-1].tolist(), cuts[1:].tolist()))
+            if max_length is not None:
+                too_long = [leg for leg in legs if prefix[leg[1]] - prefix[leg[0]] > max_length]
+                if too_long:
+                    raise ValueError(f"The circuit does not fit in {k} legs of at most {max_length}")
+            return legs
+
+        legs = []
+        start = 0
+        while start < n:
+            # the last boundary still within budget, but always at least one segment
+            stop = int(np.searchsorted(prefix, prefix[start] + max_length, side='right')) - 1
+            stop = min(max(stop, start + 1), n)
+            legs.append((start, stop))
+            start = stop
+        return legs
+
+    def save(self, path):
+        """
+        Saves the index as an uncompressed .npz file that load() reads back without any parsing.
+
+        Parameters:
+        - path (str): Destination path.
+        """
+        arrays = dict(sources=self.sources,
+                      targets=self.targets,
+                      lengths=self.lengths,
+                      edge_ids=self.edge_ids,
+                      name_index=self.name_index,
+                      type_codes=self.type_codes,
+                      points=self.points,
+                      visit_keys=self.visit_keys,
+                      visits=self.visits,
+                      visit_indptr=self.visit_indptr,
+                      attributes=np.array(json.dumps({'names': self.names, 'types': self.types})))
+        if self.times is not None:
+            arrays['times'] = np.diff(self.times)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index written by save().
+
+        Parameters:
+        - path (str): Path of the .npz file.
+
+        Returns:
+        CircuitIndex: The loaded index.
+        """
+        with np.load(path) as arrays:
+            attributes = json.loads(str(arrays['attributes']))
+            return cls(arrays['sources'], arrays['targets'], arrays['lengths'], arrays['edge_ids'],
+                       arrays['name_index'], arrays['type_codes'], names=attributes['names'],
+                       types=attributes['types'], times=arrays['times'] if 'times' in arrays else None,
+                       visit_arrays=(arrays['points'], arrays['visit_keys'], arrays['visits'],
+                                     arrays['visit_indptr']))
@@ -0,0 +1,193 @@
+import csv
+import json
+import os
+import time
+import tracemalloc
+import networkx as nx
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from find_euler_path import annotate_circuit, eulerize_graph, order_circuit
+
+TABLE_COLUMNS = ['euler_form_method', 'euler_order_method', 'total_distance', 'original_distance',
+                 'circuit_length_multiplier', 'artificial_edges', 'wall_time_s', 'peak_memory_mb',
+                 'eulerized_dest', 'dest', 'status']
+
+# without them the greedy methods search paths between all pairs of nodes, which runs out of memory on county
+# sized graphs
+SWEEP_FORM_OPTIONS = {"min_weights": {"odd_nodes_only": True}, "dijkstra": {"odd_nodes_only": True}}
+
+
+def compare_methods(graphml_input='new_graph.graphml',
+                    euler_form_methods=("built_in", "built_in_weighted", "min_weights", "dijkstra"),
+                    euler_order_methods=("built_in", "trotter"),
+                    output_dir='method_comparison',
+                    table_dest='method_comparison.csv',
+                    length_unit="miles",
+                    euler_form_options=None,
+                    max_workers=None,
+                    trace_memory=True):
+    """
+    Runs modify_graph() for every combination of eulerization and ordering method in parallel worker
+    processes and collects the results into one comparison table.
+
+    The input graph is read once and handed to every worker. Each combination writes its eulerized graph and
+    circuit to its own files in output_dir, named after the two methods, so runs never overwrite each other.
+    A combination that fails, or whose worker process dies, gets its error in the 'status' column instead of
+    stopping the sweep; combinations lost with a dead worker are rerun one at a time in fresh processes.
+
+    Parameters:
+    - graphml_input (str): Path to the input GraphML file, as written by convert_to_graph_road_edges().
+    - euler_form_methods (iterable): Eulerization methods to compare, as named in modify_graph().
+    - euler_order_methods (iterable): Circuit ordering methods to compare, as named in modify_graph().
+    - output_dir (str): Directory for the eulerized graphs and circuits.
+    - table_dest (str): Path of the comparison table, written as JSON if it ends in ".json" and as CSV
+      otherwise. None skips writing it.
+    - length_unit (str): Unit of length for calculating distances.
+    - euler_form_options (dict): Extra keyword arguments per eulerization method, such as
+      {"dijkstra": {"k_nearest": 10}}. They are added to SWEEP_FORM_OPTIONS, which search only from the
+      odd-degree nodes in "min_weights" and "dijkstra"; pass {"odd_nodes_only": False} to search all pairs.
+    - max_workers (int): Number of worker processes. Defaults to one per CPU.
+    - trace_memory (bool): Measure each run's peak memory with tracemalloc. Tracing slows the runs down, so
+      turn it off when comparing wall times closely.
+
+    Returns:
+    - list: One dict per combination with the TABLE_COLUMNS keys. 'status' is "ok" or the error the
+      combination failed with, in which case the measurements are None.
+    """
+    G = nx.read_graphml(graphml_input, force_multigraph=True)
+    euler_form_options = euler_form_options or {}
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = []
+    for euler_form_method in euler_form_methods:
+        for euler_order_method in euler_order_methods:
+            name = f"{euler_form_method}_{euler_order_method}"
+            jobs.append((G, euler_form_method, euler_order_method, length_unit,
+                         dict(SWEEP_FORM_OPTIONS.get(euler_form_method, {}),
+                              **(euler_form_options.get(euler_form_method) or {})),
+                         os.path.join(output_dir, name + '_eulerized_graph.graphml'),
+                         os.path.join(output_dir, name + '_euler_path_output.graphml'),
+                         trace_memory))
+    if max_workers == 1:
+        rows = []
+        for job in jobs:
+            try:
+                rows.append(run_combination(*job))
+            except Exception as error:
+                rows.append(failed_row(job, error))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(run_combination, *job) for job in jobs]
+            rows = [collect_row(future, job) for future, job in zip(futures, jobs)]
+        # a dead worker breaks the whole pool, so rerun what it took down alone to find the one that died
+        for position, job in enumerate(jobs):
+            if rows[position] is None:
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    rows[position] = collect_row(pool.submit(run_combination, *job), job, retry=False)
+    if table_dest is not None:
+        write_comparison_table(rows, table_dest)
+    return rows
+
+
+def run_combination(G, euler_form_method, euler_order_method, length_unit="miles", euler_form_options=None,
+                    eulerized_dest='eulerized_graph.graphml', dest='euler_path_output.graphml',
+                    trace_memory=True):
+    """
+    Eulerizes and orders a road graph with one combination of methods, timing the run. Runs inside a
+    compare_methods() worker process.
+
+    Parameters:
+    - G (networkx.MultiGraph): The road graph, with its 'total_distance' graph attribute set.
+    - euler_form_method (str): Eulerization method, as in modify_graph().
+    - euler_order_method (str): Circuit ordering method, as in modify_graph().
+    - length_unit (str): Unit of length for calculating distances.
+    - euler_form_options (dict): Extra keyword arguments for the eulerization method.
+    - eulerized_dest (str): Path to write the eulerized graph to.
+    - dest (str): Path to write the circuit to.
+    - trace_memory (bool): Measure the run's peak memory with tracemalloc.
+
+    Returns:
+    - dict: The run's row of the comparison table.
+    """
+    if trace_memory:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        euler_G = eulerize_graph(G, euler_form_method, euler_form_options)
+        circuit = order_circuit(euler_G, euler_order_method)
+        new_G, total_distance, artificial_edges = annotate_circuit(euler_G, circuit, length_unit)
+    finally:
+        wall_time = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1] / 2 ** 20 if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+
+    nx.write_graphml(euler_G, eulerized_dest)
+    nx.write_graphml(new_G, dest)
+    old_length = G.graph['total_distance']
+    return {
+        'euler_form_method': euler_form_method,
+        'euler_order_method': euler_order_method,
+        'total_distance': total_distance,
+        'original_distance': old_length,
+        'circuit_length_multiplier': total_distance / old_length,
+        'artificial_edges': artificial_edges,
+        'wall_time_s': wall_time,
+        'peak_memory_mb': peak_memory,
+        'eulerized_dest': eulerized_dest,
+        'dest': dest,
+        'status': 'ok',
+    }
+
+
+def collect_row(future, job, retry=True):
+    """
+    Waits for a compare_methods() job and returns its row, or a row recording why it failed.
+
+    Parameters:
+    - future (concurrent.futures.Future): The submitted run_combination() call.
+    - job (tuple): The run_combination() arguments it was submitted with.
+    - retry (bool): Return None instead of a failed row when the worker pool broke, so the job can be run
+      again on its own.
+
+    Returns:
+    - dict: The row, or None.
+    """
+    try:
+        return future.result()
+    except BrokenProcessPool as error:
+        return None if retry else failed_row(job, error)
+    except Exception as error:
+        return failed_row(job, error)
+
+
+def failed_row(job, error):
+    """
+    Builds the comparison table row of a run_combination() job that raised error.
+    """
+    _, euler_form_method, euler_order_method, _, _, eulerized_dest, dest, _ = job
+    row = dict.fromkeys(TABLE_COLUMNS)
+    row.update(euler_form_method=euler_form_method, euler_order_method=euler_order_method,
+               eulerized_dest=eulerized_dest, dest=dest, status=f"error: {type(error).__name__}: {error}")
+    return row
+
+
+def write_comparison_table(rows, dest):
+    """
+    Writes the rows returned by compare_methods() as JSON if dest ends in ".json" and as CSV otherwise.
+
+    Parameters:
+    - rows (list): The comparison table rows.
+    - dest (str): The output path.
+
+    Returns:
+    - None
+    """
+    if dest.lower().endswith('.json'):
+        with open(dest, 'w') as f:
+            json.dump(rows, f, indent=2)
+        return
+    with open(dest, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=TABLE_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
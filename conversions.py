@@ -1,16 +1,13 @@
-import ast
 import math
 import geopandas as gpd
 import networkx as nx
-import matplotlib.pyplot as plt
-import pandas as pd
-import scipy as sp
+import numpy as np
 import json
-import re
-import lxml
-import osmnx as ox
-from find_euler_path import calculate_distance_raw
-from shapely.geometry import MultiLineString, LineString
+import shapely
+import instrumentation
+from itertools import islice
+from find_euler_path import calculate_distances_raw, edge_segments, parse_node
+from shapely.geometry import LineString
 
 
 def convert_to_graph_road_nodes(geojson_file, dest='new_graph.graphml'):
@@ -36,99 +33,533 @@ def convert_to_graph_road_edges(geojson_file, dest='new_graph.graphml',
                                 formatted_road_type='MapClass',
                                 has_properties=True,
                                 length_unit="Miles",
-                                weighted_by_road_type=True):
+                                weighted_by_road_type=True,
+                                formatted_one_way=None,
+                                contract_chains=False,
+                                stream=False,
+                                bbox=None,
+                                mask=None,
+                                where=None,
+                                road_types=None,
+                                chunk_size=10000):
     """
     Converts a GeoJSON file containing road data into a NetworkX graph with road edges.
 
+    Passing any of bbox, mask, where or road_types turns on streaming: features are then read one at a time,
+    filtered before they are turned into shapely geometries and added to the graph chunk_size at a time, so
+    a small patrol area can be cut out of a statewide layer without loading the whole layer into memory.
+
     Parameters:
     - geojson_file (str): The path to the GeoJSON file.
-    - dest (str): The destination path to save the resulting graph file (default: 'new_graph.graphml').
+    - dest (str): The destination path to save the resulting graph file, or None to only return the graph
+      (default: 'new_graph.graphml').
     - formatted_road_name (str): The name of the road property in the GeoJSON file (default: 'FullStName').
     - has_properties (bool): Indicates whether the GeoJSON file has road properties (default: True).
     - length_unit (str): The unit of length for calculating road distances (default: 'Miles').
+    - formatted_one_way (str): The name of the one-way property in the GeoJSON file, read with
+      find_one_way(). When set, the graph is directed: one-way roads point the way they can be driven and
+      every road gets a 'oneway' attribute. Eulerize it with the "min_cost_flow" method (default: None).
+    - contract_chains (bool): Contract chains of degree-2 nodes into single edges with
+      contract_degree_two_chains(), so eulerizing and ordering run on a much smaller graph. The full road
+      geometry is restored by convert_to_geojson() (default: False).
+    - stream (bool): Read the features in chunks even without a filter (default: False).
+    - bbox (tuple): Only keep roads intersecting this (minx, miny, maxx, maxy) box, given in the file's
+      coordinate system.
+    - mask (shapely geometry or GeoJSON dict): Only keep roads intersecting this polygon, given in the file's
+      coordinate system. Roads crossing its edge are kept whole.
+    - where (str): Only keep features matching this OGR SQL WHERE clause, for example "SpeedLimit >= 35".
+    - road_types (iterable): Only keep roads whose formatted_road_type property is one of these.
+    - chunk_size (int): Number of features added to the graph at a time when streaming (default: 10000).
 
     Returns:
-    - None
-
-    """
-    # Load the GeoJSON file
-    gdf = gpd.read_file(geojson_file)
-    total_distance = 0
-
-    # Create a NetworkX graph
-    G = nx.MultiGraph()
-
-    # Add edges to the graph
-    for _, road in gdf.iterrows():
-        geometry = road.geometry
-        if isinstance(geometry, LineString):
-            line = [geometry]
-        elif isinstance(geometry, MultiLineString):
-            raise TypeError("MultiLineString found in the data.")
-        for linestring in line:
-            for source, target in zip(list(linestring.coords[:-1]), list(linestring.coords[1:])):
-                if has_properties:
-                    rd_name = road[formatted_road_name]
-                    rd_type = road[formatted_road_type]
-                else:
-                    rd_name = "unnamed"
-                    rd_type = 'no_type'
-                if rd_type is None:
-                    rd_type = 'no_type'
-                distance = calculate_distance_raw(source[0],
-                                                  source[1],
-                                                  target[0],
-                                                  target[1],
-                                                  in_init_length_unit=length_unit)
-                total_distance += distance
-                multiplier = find_multiplier(rd_type, formatted_road_type)
-                for _ in range(multiplier):
-                    G.add_edge(source,
-                               target,
-                               name=rd_name,
-                               type=rd_type,
-                               length=distance)
+    - networkx.MultiGraph: The road graph, a MultiDiGraph when formatted_one_way is set.
+
+    """
+    stream = stream or any(option is not None for option in (bbox, mask, where, road_types))
+    with instrumentation.stage('ingest', source=geojson_file, stream=stream):
+        if stream:
+            G = None
+            feature_count = 0
+            for gdf in read_road_feature_chunks(geojson_file, bbox=bbox, mask=mask, where=where,
+                                                road_types=road_types,
+                                                formatted_road_name=formatted_road_name,
+                                                formatted_road_type=formatted_road_type,
+                                                formatted_one_way=formatted_one_way,
+                                                has_properties=has_properties,
+                                                chunk_size=chunk_size):
+                G = build_road_edges_graph(gdf,
+                                           formatted_road_name=formatted_road_name,
+                                           formatted_road_type=formatted_road_type,
+                                           has_properties=has_properties,
+                                           length_unit=length_unit,
+                                           formatted_one_way=formatted_one_way,
+                                           G=G)
+                feature_count += len(gdf)
+            if G is None:
+                raise ValueError(f"No road features in {geojson_file} match the given filters.")
+        else:
+            # Load the GeoJSON file
+            gdf = gpd.read_file(geojson_file)
+            G = build_road_edges_graph(gdf,
+                                       formatted_road_name=formatted_road_name,
+                                       formatted_road_type=formatted_road_type,
+                                       has_properties=has_properties,
+                                       length_unit=length_unit,
+                                       formatted_one_way=formatted_one_way)
+            feature_count = len(gdf)
+        instrumentation.annotate(features=feature_count, nodes=G.number_of_nodes(), edges=G.number_of_edges())
+    if contract_chains:
+        with instrumentation.stage('contract'):
+            G = contract_degree_two_chains(G)
+            instrumentation.annotate(nodes=G.number_of_nodes(), edges=G.number_of_edges())
 
     # Save the graph to a GraphML file
+    if dest is not None:
+        with instrumentation.stage('export', dest=dest):
+            nx.write_graphml(G, dest)
+    return G
+
+
+def build_road_edges_graph(gdf,
+                           formatted_road_name='FullStName',
+                           formatted_road_type='MapClass',
+                           has_properties=True,
+                           length_unit="Miles",
+                           formatted_one_way=None,
+                           G=None):
+    """
+    Builds the road edge graph written by convert_to_graph_road_edges() from an already loaded GeoDataFrame.
+
+    All LineString coordinates are pulled into NumPy arrays at once, every segment length is measured in a
+    single batched geodesic call and road name/type/multiplier are resolved per feature with column
+    operations before the edges are bulk-added to the graph.
+
+    Parameters:
+    - gdf (geopandas.GeoDataFrame): The road features.
+    - formatted_road_name (str): The name of the road property in the GeoDataFrame (default: 'FullStName').
+    - formatted_road_type (str): The type of the road property in the GeoDataFrame (default: 'MapClass').
+    - has_properties (bool): Indicates whether the features have road properties (default: True).
+    - length_unit (str): The unit of length for calculating road distances (default: 'Miles').
+    - formatted_one_way (str): The name of the one-way property in the GeoDataFrame. When set, a directed
+      graph is built instead (default: None).
+    - G (networkx.MultiGraph, optional): A graph built from earlier chunks of the same layer to add the
+      roads to. A new graph is made if none is given.
+
+    Returns:
+    - networkx.MultiGraph: The road graph, with its 'total_distance' graph attribute set. A
+      networkx.MultiDiGraph with a 'oneway' attribute on every edge if formatted_one_way is set.
+    """
+    sources, targets, segment_features = line_segments(gdf.geometry.values)
+    lengths = calculate_distances_raw(sources[:, 0], sources[:, 1], targets[:, 0], targets[:, 1],
+                                      in_init_length_unit=length_unit)
+
+    if has_properties:
+        rd_names = gdf[formatted_road_name].tolist()
+        rd_types = gdf[formatted_road_type].astype(object)
+        rd_types = rd_types.where(rd_types.notna(), 'no_type').tolist()
+    else:
+        rd_names = ["unnamed"] * len(gdf)
+        rd_types = ['no_type'] * len(gdf)
+    multipliers = {rd_type: find_multiplier(rd_type, formatted_road_type) for rd_type in set(rd_types)}
+
+    # busier roads are visited multiple times, stored as a single edge with a multiplicity (visit count)
+    edges = ((source, target, {'name': rd_names[feature],
+                               'type': rd_types[feature],
+                               'length': distance,
+                               'multiplicity': multipliers[rd_types[feature]]})
+             for source, target, feature, distance in zip(coordinate_tuples(sources),
+                                                         coordinate_tuples(targets),
+                                                         segment_features.tolist(),
+                                                         lengths.tolist()))
+    if formatted_one_way is None:
+        if G is None:
+            G = nx.MultiGraph()
+    else:
+        if G is None:
+            G = nx.MultiDiGraph()
+        directions = [find_one_way(value) for value in gdf[formatted_one_way].tolist()]
+        # one-way roads point the way they are driven, two-way roads keep the order of their coordinates
+        edges = ((target, source, {**data, 'oneway': True}) if directions[feature] < 0
+                 else (source, target, {**data, 'oneway': directions[feature] > 0})
+                 for (source, target, data), feature in zip(edges, segment_features.tolist()))
+    G.add_edges_from(edges)
+
+    # a running sum keeps the exact rounding of adding the segment lengths one at a time, continuing from the
+    # total of any earlier chunks
+    total_distance = G.graph.get('total_distance', 0)
+    if len(lengths):
+        total_distance = float(np.cumsum(np.concatenate(([total_distance], lengths)))[-1])
     G.graph['total_distance'] = total_distance
-    nx.write_graphml(G, dest)
+    return G
+
+
+def contract_degree_two_chains(G):
+    """
+    Contracts chains of degree-2 nodes, such as the vertices along a curving road, into single edges.
+
+    A node between exactly two edges of the same road (same name, type and multiplicity) never changes the
+    parity of the graph, so it is removed and its two edges are joined. Each joined edge keeps the summed
+    length and the road's name, type and multiplicity, plus its full vertex geometry as a JSON list of
+    coordinates in its 'geometry' attribute and the length of every original segment in 'segment_lengths'.
+    convert_to_geojson() uses those to write the circuit back out at full resolution.
+
+    Nodes are kept where contracting them would create a self loop or a second edge between the same two
+    nodes, so every pair of adjacent nodes still stands for a single road. In a directed graph a one-way chain
+    is only contracted where the road enters the node and leaves it again, and the joined edge keeps the
+    direction of travel.
+
+    Parameters:
+    - G (networkx.MultiGraph or networkx.MultiDiGraph): The road graph built by build_road_edges_graph().
+
+    Returns:
+    - networkx.MultiGraph: The contracted copy of G, directed if G is.
+    """
+    G = G.copy()
+
+    def chain(data, start, end):
+        # (coordinates, segment lengths) of an edge, running from start to end
+        if '_chain' not in data:
+            return [parse_node(start), parse_node(end)], [data['length']]
+        chain_start, coordinates, lengths = data['_chain']
+        if chain_start != start:
+            return coordinates[::-1], lengths[::-1]
+        return coordinates, lengths
+
+    directed = G.is_directed()
+    for node in list(G.nodes):
+        if directed:
+            # (neighbor, data) pairs with the edge the road enters the node by first
+            edges = [(u, data) for u, _, data in G.in_edges(node, data=True)] + \
+                    [(w, data) for _, w, data in G.out_edges(node, data=True)]
+            if len(edges) != 2 or (edges[0][1].get('oneway') and G.in_degree(node) != 1):
+                continue
+        else:
+            edges = [(w, data) for _, w, data in G.edges(node, data=True)]
+            if len(edges) != 2:
+                continue
+        (u, first), (w, second) = edges
+        if node in (u, w) or u == w or G.has_edge(u, w) or G.has_edge(w, u):
+            continue
+        if any(first.get(key) != second.get(key) for key in ('name', 'type', 'multiplicity', 'oneway')):
+            continue
+        first_coordinates, first_lengths = chain(first, u, node)
+        second_coordinates, second_lengths = chain(second, node, w)
+        data = dict(first)
+        data['length'] = first['length'] + second['length']
+        data['_chain'] = (u, first_coordinates + second_coordinates[1:], first_lengths + second_lengths)
+        G.remove_node(node)
+        G.add_edge(u, w, **data)
+
+    for _, _, data in G.edges(data=True):
+        if '_chain' in data:
+            _, coordinates, lengths = data.pop('_chain')
+            data['geometry'] = json.dumps([list(point) for point in coordinates])
+            data['segment_lengths'] = json.dumps(lengths)
+    return G
+
+
+def read_road_feature_chunks(geojson_file, bbox=None, mask=None, where=None, road_types=None,
+                             formatted_road_name='FullStName',
+                             formatted_road_type='MapClass',
+                             formatted_one_way=None,
+                             has_properties=True,
+                             chunk_size=10000):
+    """
+    Reads road features from a GeoJSON file (or any other vector format fiona can open) one at a time and
+    yields the ones that pass the filters as small GeoDataFrames.
+
+    The bbox, mask and where filters are handed to OGR so features outside them are skipped while reading.
+    Only the road name and type properties are kept and geometries are only built for features that pass
+    every filter, so memory use depends on chunk_size rather than on the size of the file.
+
+    Parameters:
+    - geojson_file (str): The path to the GeoJSON file.
+    - bbox (tuple): Only keep features intersecting this (minx, miny, maxx, maxy) box.
+    - mask (shapely geometry or GeoJSON dict): Only keep features intersecting this geometry.
+    - where (str): Only keep features matching this OGR SQL WHERE clause.
+    - road_types (iterable): Only keep features whose formatted_road_type property is one of these.
+    - formatted_road_name (str): The name of the road property (default: 'FullStName').
+    - formatted_road_type (str): The type of the road property (default: 'MapClass').
+    - formatted_one_way (str): The name of the one-way property, kept as well if given (default: None).
+    - has_properties (bool): Indicates whether the features have road properties (default: True).
+    - chunk_size (int): Maximum number of features per GeoDataFrame (default: 10000).
+
+    Yields:
+    - geopandas.GeoDataFrame: The next chunk of matching features.
+    """
+    import fiona
+    from shapely.geometry import mapping, shape
+
+    if mask is not None and not isinstance(mask, dict):
+        mask = mapping(mask)
+    road_types = None if road_types is None else set(road_types)
+    columns = [formatted_road_name, formatted_road_type] if has_properties else []
+    if formatted_one_way is not None:
+        columns.append(formatted_one_way)
+
+    with fiona.open(geojson_file) as source:
+        crs = source.crs_wkt or None
+        features = source.filter(bbox=bbox, mask=mask, where=where)
+        geometries, properties = [], {column: [] for column in columns}
+        for feature in features:
+            if feature.geometry is None:
+                continue
+            if road_types is not None and feature.properties.get(formatted_road_type) not in road_types:
+                continue
+            geometries.append(shape(feature.geometry))
+            for column in columns:
+                properties[column].append(feature.properties.get(column))
+            if len(geometries) == chunk_size:
+                yield gpd.GeoDataFrame(properties, geometry=geometries, crs=crs)
+                geometries, properties = [], {column: [] for column in columns}
+        if geometries:
+            yield gpd.GeoDataFrame(properties, geometry=geometries, crs=crs)
+
+
+def line_segments(geometries):
+    """
+    Splits LineString geometries into their consecutive coordinate pairs.
+
+    Parameters:
+    - geometries (array-like): Shapely geometries, all of which must be LineStrings.
+
+    Returns:
+    - tuple: (sources, targets, features) where sources and targets are float arrays of shape (n, 2) or (n, 3)
+      holding the segment end points and features holds the index of the geometry each segment belongs to.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    geometry_types = shapely.get_type_id(geometries)
+    if (geometry_types == shapely.GeometryType.MULTILINESTRING).any():
+        raise TypeError("MultiLineString found in the data.")
+    if (geometry_types != shapely.GeometryType.LINESTRING).any():
+        raise TypeError("Only LineString geometries are supported.")
+
+    # 2D lines mixed in with 3D ones get NaN z values, which coordinate_tuples() drops again
+    coords, index = shapely.get_coordinates(geometries, include_z=bool(shapely.has_z(geometries).any()),
+                                            return_index=True)
+    starts = np.flatnonzero(index[1:] == index[:-1])
+    return coords[starts], coords[starts + 1], index[starts]
+
+
+def coordinate_tuples(coords):
+    """
+    Converts an array of coordinates into the tuples used as node labels, dropping NaN z values.
+
+    Parameters:
+    - coords (numpy.ndarray): Array of shape (n, 2) or (n, 3).
+
+    Returns:
+    - list: A list of coordinate tuples.
+    """
+    if coords.shape[1] == 3 and np.isnan(coords[:, 2]).any():
+        return [point[:2] if math.isnan(point[2]) else point for point in map(tuple, coords.tolist())]
+    return list(map(tuple, coords.tolist()))
 
 
-def convert_to_geojson(graphml_file, dest='output_geojson.geojson', formatted_road_name='FullStName'):
+def convert_to_geojson(graphml_file, dest='output_geojson.geojson', formatted_road_name='FullStName',
+                       driver='GeoJSON', stream=False, chunk_size=50000):
     """
     Convert a GraphML file to GeoJSON format.
 
+    The order/name/length/heading/type columns are built in a single pass over the circuit edges with headings
+    computed in vectorized form, so export time grows linearly with the length of the circuit.
+
     Args:
         graphml_file (str): The path to the GraphML file.
         dest (str, optional): The destination path for the GeoJSON output file. Defaults to 'output_geojson.geojson'.
         formatted_road_name (str, optional): The column name for the road name in the GeoJSON file. Defaults to 'FullStName'.
+        driver (str, optional): "GeoJSON" or "GeoJSONSeq" (one feature per line). Defaults to "GeoJSON".
+        stream (bool, optional): Write features straight to disk chunk by chunk instead of building a
+            GeoDataFrame and writing it in one step. Defaults to False.
+        chunk_size (int, optional): Number of edges handled per chunk when streaming. Defaults to 50000.
 
     Returns:
         None
     """
-    G = nx.read_graphml(graphml_file)
-    gdf = gpd.GeoDataFrame(columns=['order', formatted_road_name, "length", 'heading', 'road_type', 'geometry'])
+    with instrumentation.stage('export', source=graphml_file, dest=dest, driver=driver):
+        G = nx.read_graphml(graphml_file, force_multigraph=True)
+        instrumentation.annotate(edges=G.number_of_edges())
+        write_circuit(G.edges(data=True), dest, formatted_road_name=formatted_road_name, driver=driver,
+                      stream=stream, chunk_size=chunk_size)
+
+
+def write_circuit(edges, dest, formatted_road_name='FullStName', driver='GeoJSON', stream=False, chunk_size=50000):
+    """
+    Writes circuit edges to a GeoJSON file, as convert_to_geojson() does for a circuit read from GraphML.
+
+    Args:
+        edges (iterable): (source, target, data) tuples in circuit order, such as the ones
+            find_euler_path.annotate_circuit_edges() gives.
+        dest (str): The destination path.
+        formatted_road_name (str, optional): The column name for the road name. Defaults to 'FullStName'.
+        driver (str, optional): "GeoJSON" or "GeoJSONSeq" (one feature per line). Defaults to "GeoJSON".
+        stream (bool, optional): Write features straight to disk chunk by chunk instead of building a
+            GeoDataFrame and writing it in one step. Defaults to False.
+        chunk_size (int, optional): Number of edges handled per chunk when streaming. Defaults to 50000.
+
+    Returns:
+        None
+    """
+    if stream:
+        write_circuit_features(edges, dest, formatted_road_name=formatted_road_name, driver=driver,
+                               chunk_size=chunk_size)
+        return
+    circuit_geodataframe(edges, formatted_road_name=formatted_road_name).to_file(dest, driver=driver)
+
+
+def circuit_geodataframe(edges, formatted_road_name='FullStName'):
+    """
+    Builds the GeoDataFrame convert_to_geojson() writes from circuit edges, without touching the disk.
+
+    Args:
+        edges (iterable): (source, target, data) tuples in circuit order.
+        formatted_road_name (str, optional): The column name for the road name. Defaults to 'FullStName'.
+
+    Returns:
+        geopandas.GeoDataFrame: One row per road segment in circuit order.
+    """
+    empty = ({key: [] for key in ['order', formatted_road_name, 'length', 'heading', 'road_type']}, [], [])
+    columns, sources, targets = next(circuit_column_chunks(edges, formatted_road_name=formatted_road_name), empty)
+    return gpd.GeoDataFrame(columns, geometry=segment_lines(sources, targets))
+
+
+def circuit_column_chunks(edges, formatted_road_name='FullStName', chunk_size=None):
+    """
+    Builds the output columns of convert_to_geojson() from circuit edges in a single pass.
+
+    Args:
+        edges (iterable): (source, target, data) tuples in circuit order, with nodes given either as coordinate
+            tuples or as their string form read back from GraphML.
+        formatted_road_name (str, optional): The column name for the road name. Defaults to 'FullStName'.
+        chunk_size (int, optional): Yield the columns every chunk_size edges instead of all at once.
+
+    Yields:
+        tuple: (columns, sources, targets) for one chunk of edges, where columns maps the 'order', road name,
+        'length', 'heading' and 'road_type' column names to their values and sources/targets hold the
+        coordinate tuples of each edge's end points.
+    """
+    node_coordinates = {}
+
+    def coordinates(node):
+        if node not in node_coordinates:
+            node_coordinates[node] = parse_node(node)
+        return node_coordinates[node]
+
     order = 0  # count for each road to be taken to follow eulerian path. Later used to label each road
-    first_road = list(G.edges(data=True))[0]
-    previous_road_name = first_road[2]['name']
-    for source, target, data in G.edges(data=True):
-        source = ast.literal_eval(source)
-        target = ast.literal_eval(target)
-        if data['name'] != previous_road_name:
-            order += 1
-        previous_road_name = data['name']
-        heading = find_heading(source, target)
-        new_road = gpd.GeoDataFrame({
-            'order': [str(order) + ", "],
-            formatted_road_name: [data['name']],
-            # 'FullStName' is the column name for the road name in the geojson file
-            'length': [data['length']],  # 'Miles' is the column name for the road length in the geojson file
-            'heading': [heading],
-            'road_type': [data['type']],
-            'geometry': [LineString([source, target])]
-        })
-        gdf = pd.concat([gdf, new_road], ignore_index=True)
-    gdf.to_file(dest, driver='GeoJSON')
+    previous_road_name = None
+    edges = iter(edges)
+    first_chunk = True
+    while True:
+        chunk = list(islice(edges, chunk_size)) if chunk_size else list(edges)
+        if not chunk:
+            return
+        if first_chunk:
+            previous_road_name = chunk[0][2]['name']
+            first_chunk = False
+        orders, names, lengths, types, sources, targets = [], [], [], [], [], []
+        for source, target, data in chunk:
+            if data['name'] != previous_road_name:
+                order += 1
+            previous_road_name = data['name']
+            for segment_source, segment_target, length in edge_segments(coordinates(source),
+                                                                        coordinates(target), data):
+                orders.append(str(order) + ", ")
+                names.append(data['name'])
+                lengths.append(length)
+                types.append(data['type'])
+                sources.append(segment_source)
+                targets.append(segment_target)
+        yield {
+            'order': orders,
+            formatted_road_name: names,
+            'length': lengths,
+            'heading': find_headings(sources, targets),
+            'road_type': types,
+        }, sources, targets
+        if not chunk_size:
+            return
+
+
+def write_circuit_features(edges, dest, formatted_road_name='FullStName', driver='GeoJSON', chunk_size=50000):
+    """
+    Streams circuit edges to disk as GeoJSON features without holding the whole circuit in memory.
+
+    Args:
+        edges (iterable): (source, target, data) tuples in circuit order.
+        dest (str): The destination path.
+        formatted_road_name (str, optional): The column name for the road name. Defaults to 'FullStName'.
+        driver (str, optional): "GeoJSON" for a FeatureCollection or "GeoJSONSeq" for newline-delimited features.
+        chunk_size (int, optional): Number of edges handled per chunk. Defaults to 50000.
+
+    Returns:
+        None
+    """
+    if driver not in ("GeoJSON", "GeoJSONSeq"):
+        raise ValueError("driver must be 'GeoJSON' or 'GeoJSONSeq'")
+    sequence = driver == "GeoJSONSeq"
+    separator = "\n" if sequence else ",\n"
+    with open(dest, 'w') as f:
+        if not sequence:
+            f.write('{"type": "FeatureCollection", "features": [\n')
+        first = True
+        for feature in circuit_features(edges, formatted_road_name=formatted_road_name, chunk_size=chunk_size):
+            if not first:
+                f.write(separator)
+            f.write(json.dumps(feature))
+            first = False
+        f.write("\n" if sequence else "\n]}\n")
+
+
+def circuit_features(edges, formatted_road_name='FullStName', chunk_size=50000):
+    """
+    Turns circuit edges into GeoJSON feature dicts with the columns convert_to_geojson() writes.
+
+    Args:
+        edges (iterable): (source, target, data) tuples in circuit order.
+        formatted_road_name (str, optional): The column name for the road name. Defaults to 'FullStName'.
+        chunk_size (int, optional): Number of edges handled per chunk. Defaults to 50000.
+
+    Yields:
+        dict: One GeoJSON LineString feature per road segment.
+    """
+    for columns, sources, targets in circuit_column_chunks(edges, formatted_road_name=formatted_road_name,
+                                                           chunk_size=chunk_size):
+        for order, name, length, heading, road_type, source, target in zip(columns['order'],
+                                                                           columns[formatted_road_name],
+                                                                           columns['length'],
+                                                                           columns['heading'].tolist(),
+                                                                           columns['road_type'],
+                                                                           sources,
+                                                                           targets):
+            properties = {'order': order,
+                          formatted_road_name: name,
+                          'length': length,
+                          'heading': heading,
+                          'road_type': road_type}
+            yield {
+                "type": "Feature",
+                # NaN is not valid JSON, GDAL writes missing values as null as well
+                "properties": {key: None if isinstance(value, float) and math.isnan(value) else value
+                               for key, value in properties.items()},
+                "geometry": {"type": "LineString", "coordinates": [list(source), list(target)]},
+            }
+
+
+def segment_lines(sources, targets):
+    """
+    Creates one two-point LineString per (source, target) coordinate pair.
+
+    Args:
+        sources (list): Coordinate tuples of the segment start points.
+        targets (list): Coordinate tuples of the segment end points.
+
+    Returns:
+        numpy.ndarray: Array of shapely LineStrings.
+    """
+    if len({len(point) for point in sources} | {len(point) for point in targets}) == 1:
+        return shapely.linestrings(np.stack([np.asarray(sources, dtype=np.float64),
+                                             np.asarray(targets, dtype=np.float64)], axis=1))
+    return np.array([LineString([source, target]) for source, target in zip(sources, targets)], dtype=object)
 
 
 def find_heading(source, target):
@@ -170,6 +601,57 @@ def find_heading(source, target):
     return compass_bearing
 
 
+def find_headings(sources, targets):
+    """
+    Vectorized version of find_heading() for many segments at once.
+
+    :Parameters:
+      - `sources: Sequence of (longitude, latitude[, z]) tuples for the first points, in decimal degrees
+      - `targets: Sequence of (longitude, latitude[, z]) tuples for the second points, in decimal degrees
+    :Returns:
+      The compass bearings in degrees
+    :Returns Type:
+      numpy.ndarray
+    """
+    if len(sources) == 0:
+        return np.zeros(0, dtype=np.float64)
+    sources = np.array([point[:2] for point in sources], dtype=np.float64)
+    targets = np.array([point[:2] for point in targets], dtype=np.float64)
+
+    lat1 = np.radians(sources[:, 1])
+    lat2 = np.radians(targets[:, 1])
+
+    diffLong = np.radians(targets[:, 0] - sources[:, 0])
+
+    x = np.sin(diffLong) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - (np.sin(lat1) * np.cos(lat2) * np.cos(diffLong))
+
+    initial_bearing = np.degrees(np.arctan2(x, y))
+    return (initial_bearing + 360) % 360
+
+
+def find_one_way(value):
+    """
+    Reads a road's one-way property. Understands OpenStreetMap style values ("yes", "-1", "no") and the
+    "FT"/"TF"/"B" codes used by many county road layers; anything else, including a missing value, counts
+    as a two-way road.
+
+    Returns:
+    - int: 1 if the road can only be driven in the order of its coordinates, -1 if only against it and 0 if
+      it can be driven both ways.
+    """
+    if value is None or isinstance(value, bool):
+        return int(bool(value))
+    if isinstance(value, (int, float)):
+        return 0 if math.isnan(value) else int(np.sign(value))
+    value = str(value).strip().lower()
+    if value in ('yes', 'y', 'true', '1', 'ft', 'f'):
+        return 1
+    if value in ('-1', 'reverse', 'tf', 't'):
+        return -1
+    return 0
+
+
 def find_multiplier(rd_type, rd_format):
     if rd_format == "MapClass":
         triple = ["Limited Access Freeway"]
@@ -0,0 +1,340 @@
+import argparse
+import heapq
+import json
+import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+import instrumentation
+
+
+class DistanceIndex:
+    """
+    Precomputed shortest path index of a road graph, built once and saved to disk so that repeated
+    eulerizations of the same network don't search it from scratch.
+
+    The index holds the road network as integer CSR adjacency, with parallel roads merged into their shortest
+    one, together with landmark (ALT) distances: a few landmark nodes spread around the edge of the network
+    and the road distance from each of them to every node. By the triangle inequality, the largest
+    |d(l, u) - d(l, v)| over the landmarks l is a lower bound on the distance between u and v, which guides
+    the A* searches of distance() and path() straight towards their target.
+
+    The eulerizers in find_euler_path use it in three ways:
+    - the nearest-neighbour searches between odd-degree nodes walk neighbors(), plain lists instead of
+      networkx's nested attribute dicts,
+    - the methods that pair every odd-degree node with every other get their distances from pair_lengths(),
+      which searches from a batch of sources at a time in compiled code,
+    - the paths of the pairs those methods match come from path().
+
+    Roads count in both directions, as the eulerizers pair up odd-degree nodes without regard to one-way
+    roads.
+
+    Attributes:
+    - labels (list): The node labels, in node id order. Loaded indexes have the labels GraphML writes.
+    - indptr, indices, weights (numpy.ndarray): CSR adjacency. The neighbors of node i are
+      indices[indptr[i]:indptr[i + 1]], at distances weights[indptr[i]:indptr[i + 1]].
+    - landmarks (numpy.ndarray): int32 node ids of the landmarks.
+    - landmark_distances (numpy.ndarray): float64 array of shape (landmarks, nodes) holding the distance from
+      every landmark to every node.
+    - weight (str or None): The edge attribute the distances measure, None if they count edges.
+    """
+
+    def __init__(self, labels, indptr, indices, weights, landmarks, landmark_distances, weight='length'):
+        self.labels = list(labels)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.landmarks = np.asarray(landmarks, dtype=np.int32)
+        self.landmark_distances = np.asarray(landmark_distances, dtype=np.float64)
+        self.weight = weight
+        self.node_ids = {label: i for i, label in enumerate(self.labels)}
+        self._search_lists = None
+
+    @property
+    def number_of_nodes(self):
+        return len(self.labels)
+
+    @classmethod
+    def from_networkx(cls, G, landmarks=16, weight='length'):
+        """
+        Builds the index of a networkx road graph.
+
+        Parameters:
+        - G (networkx.Graph): The road graph, connected. Directed graphs are indexed ignoring direction.
+        - landmarks (int): Number of landmarks. More landmarks give tighter bounds but a larger index.
+        - weight (str, optional): Edge attribute used as length, edges without it count as 1. None counts
+          every edge as 1, as the "built_in" and "min_weights" methods do.
+
+        Returns:
+        DistanceIndex: The index.
+        """
+        node_ids = {node: i for i, node in enumerate(G)}
+        sources, targets, lengths = [], [], []
+        for u, v, data in G.edges(data=True):
+            sources.append(node_ids[u])
+            targets.append(node_ids[v])
+            lengths.append(data.get(weight, 1) if weight is not None else 1)
+        return cls.build(list(G), sources, targets, lengths, landmarks=landmarks, weight=weight)
+
+    @classmethod
+    def from_road_graph(cls, road_graph, landmarks=16, weighted=True):
+        """
+        Builds the index of a RoadGraph. Node ids are the RoadGraph's and labels are the ones GraphML writes,
+        so the index also serves the same network loaded with networkx.
+
+        Parameters:
+        - road_graph (RoadGraph): The road graph, connected.
+        - landmarks (int): Number of landmarks.
+        - weighted (bool): Use edge lengths, otherwise every edge counts as 1. Edges without length count as 1.
+
+        Returns:
+        DistanceIndex: The index.
+        """
+        lengths = np.where(np.isnan(road_graph.lengths), 1.0, road_graph.lengths) if weighted \
+            else np.ones(len(road_graph.lengths))
+        return cls.build(road_graph.node_labels(), road_graph.sources, road_graph.targets, lengths,
+                         landmarks=landmarks, weight='length' if weighted else None)
+
+    @classmethod
+    def build(cls, labels, sources, targets, lengths, landmarks=16, weight='length'):
+        """
+        Builds the index from edge arrays, choosing landmarks by farthest point selection: each new landmark
+        is the node farthest from the landmarks chosen so far.
+
+        Parameters:
+        - labels (list): The node labels.
+        - sources, targets (array-like): Node ids of the end nodes of each edge.
+        - lengths (array-like): Length of each edge.
+        - landmarks (int): Number of landmarks.
+        - weight (str or None): The edge attribute the lengths came from.
+
+        Returns:
+        DistanceIndex: The index.
+        """
+        node_count = len(labels)
+        if node_count == 0:
+            raise nx.NetworkXPointlessConcept("Cannot index null graph")
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.float64)
+        loops = sources == targets
+        rows = np.concatenate([sources[~loops], targets[~loops]])
+        columns = np.concatenate([targets[~loops], sources[~loops]])
+        lengths = np.concatenate([lengths[~loops], lengths[~loops]])
+
+        # keep only the shortest of parallel edges, csr_matrix would add them up
+        order = np.lexsort((lengths, columns, rows))
+        rows, columns, lengths = rows[order], columns[order], lengths[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+        rows, columns, lengths = rows[first], columns[first], lengths[first]
+        indptr = np.zeros(node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=node_count), out=indptr[1:])
+        index = cls(labels, indptr, columns, lengths, np.zeros(0), np.zeros((0, node_count)), weight=weight)
+        graph = index.csgraph()
+        if connected_components(graph, directed=False)[0] > 1:
+            raise nx.NetworkXError("G is not connected")
+
+        chosen, rows_of_distances = [], []
+        landmark = int(np.argmax(dijkstra(graph, directed=False, indices=0)))
+        closest = np.full(node_count, np.inf)
+        for _ in range(min(landmarks, node_count)):
+            distances = dijkstra(graph, directed=False, indices=landmark)
+            chosen.append(landmark)
+            rows_of_distances.append(distances)
+            closest = np.minimum(closest, distances)
+            landmark = int(np.argmax(closest))
+            if closest[landmark] == 0:
+                break
+        index.landmarks = np.array(chosen, dtype=np.int32)
+        index.landmark_distances = np.array(rows_of_distances)
+        return index
+
+    def csgraph(self):
+        """
+        Returns:
+        scipy.sparse.csr_matrix: The adjacency as a sparse matrix for scipy.sparse.csgraph.
+        """
+        return csr_matrix((self.weights, self.indices, self.indptr), shape=(self.number_of_nodes,) * 2)
+
+    def ids_of(self, nodes):
+        """
+        Returns:
+        list: The node ids of the given node labels.
+        """
+        node_ids = self.node_ids
+        return [node_ids[node] for node in nodes]
+
+    def labels_of(self, ids):
+        """
+        Returns:
+        list: The node labels of the given node ids.
+        """
+        labels = self.labels
+        return [labels[node] for node in ids]
+
+    def neighbors(self):
+        """
+        Builds the neighbors function used by the shortest path searches in find_euler_path, on node ids.
+
+        Returns:
+        function: Maps a node id to an iterable of (neighbor id, edge length) pairs.
+        """
+        indptr, indices, weights = self._lists()
+
+        def neighbors(node):
+            start, end = indptr[node], indptr[node + 1]
+            return zip(indices[start:end], weights[start:end])
+
+        return neighbors
+
+    def lower_bound(self, source, target):
+        """
+        Returns:
+        float: The landmark lower bound on the distance between two nodes.
+        """
+        u, v = self.node_ids[source], self.node_ids[target]
+        return float(np.abs(self.landmark_distances[:, u] - self.landmark_distances[:, v]).max(initial=0))
+
+    def distance(self, source, target):
+        """
+        Returns:
+        float: The shortest path distance between two nodes, found by an A* search.
+        """
+        return self._astar(self.node_ids[source], self.node_ids[target])[0]
+
+    def path(self, source, target):
+        """
+        Returns:
+        list: The labels of the nodes on a shortest path from source to target, found by an A* search.
+        """
+        return self.labels_of(self._astar(self.node_ids[source], self.node_ids[target])[1])
+
+    def pair_lengths(self, sources, targets=None, cutoff=None):
+        """
+        Finds the distance between every source and every target, searching from a batch of sources at a time
+        with scipy's Dijkstra instead of one networkx search per node.
+
+        Parameters:
+        - sources (list): The node labels to search from.
+        - targets (collection, optional): The node labels to look for. Defaults to sources.
+        - cutoff (float, optional): Only report pairs at most this far apart.
+
+        Returns:
+        list: (length, source, target) tuples with each unordered pair listed once, like the pair_lengths
+        returned by find_euler_path.shortest_path_trees().
+        """
+        source_ids = np.array(self.ids_of(sources), dtype=np.int64)
+        target_ids = source_ids if targets is None else np.array(self.ids_of(targets), dtype=np.int64)
+        target_ids = np.unique(target_ids)
+        limit = np.inf if cutoff is None else cutoff
+        graph = self.csgraph()
+        labels = self.labels
+        pair_lengths = []
+        seen_pairs = set()
+        # each batch gets a dense (sources, nodes) distance array, kept to about 64 MB
+        batch = max(1, 2 ** 23 // self.number_of_nodes)
+        for start in range(0, len(source_ids), batch):
+            batch_ids = source_ids[start:start + batch]
+            distances = dijkstra(graph, directed=False, indices=batch_ids, limit=limit)
+            instrumentation.count('shortest_path_searches', len(batch_ids))
+            for source, row in zip(batch_ids.tolist(), distances[:, target_ids]):
+                reached = (target_ids != source) & (row <= limit)
+                for target, distance in zip(target_ids[reached].tolist(), row[reached].tolist()):
+                    pair = (source, target) if source < target else (target, source)
+                    if pair not in seen_pairs:
+                        seen_pairs.add(pair)
+                        pair_lengths.append((distance, labels[source], labels[target]))
+        return pair_lengths
+
+    def _lists(self):
+        # plain lists are much faster than NumPy arrays to index one item at a time
+        if self._search_lists is None:
+            self._search_lists = (self.indptr.tolist(), self.indices.tolist(), self.weights.tolist(),
+                                  self.landmark_distances.T.tolist())
+        return self._search_lists[:3]
+
+    def _astar(self, source, target):
+        indptr, indices, weights = self._lists()
+        embedding = self._search_lists[3]
+        goal = embedding[target]
+        bounds = {}
+
+        def bound(node):
+            value = bounds.get(node)
+            if value is None:
+                value = bounds[node] = max((abs(a - b) for a, b in zip(embedding[node], goal)), default=0)
+            return value
+
+        distances = {source: 0.0}
+        predecessors = {source: None}
+        settled = set()
+        queue = [(bound(source), 0.0, source)]
+        while queue:
+            _, distance, node = heapq.heappop(queue)
+            if node in settled:
+                continue
+            if node == target:
+                break
+            settled.add(node)
+            for i in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[i]
+                new_distance = distance + weights[i]
+                if neighbor not in settled and new_distance < distances.get(neighbor, np.inf):
+                    distances[neighbor] = new_distance
+                    predecessors[neighbor] = node
+                    heapq.heappush(queue, (new_distance + bound(neighbor), new_distance, neighbor))
+        else:
+            raise nx.NetworkXNoPath(f"No path between {self.labels[source]} and {self.labels[target]}")
+        instrumentation.count('shortest_path_searches')
+        instrumentation.count('settled_nodes', len(settled) + 1)
+        path = [target]
+        while predecessors[path[-1]] is not None:
+            path.append(predecessors[path[-1]])
+        path.reverse()
+        return distances[target], path
+
+    def save(self, path):
+        """
+        Saves the index as an uncompressed .npz file that load() reads back without rebuilding anything.
+
+        Parameters:
+        - path (str): Destination path.
+        """
+        np.savez(path,
+                 indptr=self.indptr,
+                 indices=self.indices,
+                 weights=self.weights,
+                 landmarks=self.landmarks,
+                 landmark_distances=self.landmark_distances,
+                 attributes=np.array(json.dumps({'labels': [str(label) for label in self.labels],
+                                                 'weight': self.weight})))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index written by save().
+
+        Parameters:
+        - path (str): Path of the .npz file.
+
+        Returns:
+        DistanceIndex: The loaded index, labelling nodes as GraphML does.
+        """
+        with np.load(path) as arrays:
+            attributes = json.loads(str(arrays['attributes']))
+            return cls(attributes['labels'], arrays['indptr'], arrays['indices'], arrays['weights'],
+                       arrays['landmarks'], arrays['landmark_distances'], weight=attributes['weight'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the distance index of a GraphML road graph.")
+    parser.add_argument('graphml_input', help="GraphML road graph written by convert_to_graph_road_edges()")
+    parser.add_argument('dest', help="destination .npz file")
+    parser.add_argument('--landmarks', type=int, default=16)
+    parser.add_argument('--count-edges', action='store_true',
+                        help='measure distances in edges, for the "built_in" and "min_weights" methods')
+    args = parser.parse_args()
+    G = nx.read_graphml(args.graphml_input, force_multigraph=True)
+    DistanceIndex.from_networkx(G, landmarks=args.landmarks, weight=None if args.count_edges else 'length') \
+        .save(args.dest)
@@ -0,0 +1,425 @@
+import heapq
+import networkx as nx
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from find_euler_path import annotate_circuit, eulerize_graph, order_circuit
+
+
+def plan_districts(graphml_input='new_graph.graphml',
+                   k=4,
+                   dest='district_{}_euler_path_output.graphml',
+                   euler_form_method="built_in",
+                   euler_order_method="built_in",
+                   length_unit="miles",
+                   euler_form_options=None,
+                   max_workers=None):
+    """
+    Splits a road graph into k connected districts of similar total road length and builds one Euler circuit
+    per district, eulerizing and ordering the districts in parallel worker processes.
+
+    Every road belongs to exactly one district. A road crossing a district border is patrolled by one of the
+    two districts, so the circuits together cover the whole network.
+
+    Parameters:
+    - graphml_input (str): Path to the input GraphML file, as written by convert_to_graph_road_edges().
+    - k (int): Number of districts.
+    - dest (str): Output path pattern for the district circuits, formatted with the district number.
+      None skips writing them.
+    - euler_form_method (str): Eulerization method, as in modify_graph().
+    - euler_order_method (str): Circuit ordering method, as in modify_graph().
+    - length_unit (str): Unit of length for calculating distances.
+    - euler_form_options (dict): Extra keyword arguments for the eulerization method.
+    - max_workers (int): Number of worker processes. Defaults to one per CPU.
+
+    Returns:
+    - tuple: A list with each district's circuit as a networkx.MultiDiGraph and a list with each district's
+      [total distance, original distance, multiplier, "artificial edges: n"] like modify_graph() returns.
+    """
+    G = nx.read_graphml(graphml_input, force_multigraph=True)
+    districts = district_subgraphs(G, partition_districts(G, k))
+    jobs = [(district, euler_form_method, euler_order_method, length_unit, euler_form_options)
+            for district in districts]
+    if max_workers == 1 or len(jobs) == 1:
+        results = [plan_district(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(plan_district, *zip(*jobs)))
+
+    circuits = [circuit for circuit, attributes in results]
+    attributes = [attributes for circuit, attributes in results]
+    if dest is not None:
+        for district, circuit in enumerate(circuits):
+            nx.write_graphml(circuit, dest.format(district))
+    return circuits, attributes
+
+
+def plan_district(district_G, euler_form_method="built_in", euler_order_method="built_in",
+                  length_unit="miles", euler_form_options=None):
+    """
+    Eulerizes and orders a single district. Runs inside a plan_districts() worker process.
+
+    Parameters:
+    - district_G (networkx.MultiGraph): The district's roads, with its 'total_distance' graph attribute set.
+    - euler_form_method (str): Eulerization method, as in modify_graph().
+    - euler_order_method (str): Circuit ordering method, as in modify_graph().
+    - length_unit (str): Unit of length for calculating distances.
+    - euler_form_options (dict): Extra keyword arguments for the eulerization method.
+
+    Returns:
+    - tuple: The district's circuit as a networkx.MultiDiGraph and its modify_graph() style attribute list.
+    """
+    euler_G = eulerize_graph(district_G, euler_form_method, euler_form_options)
+    circuit = order_circuit(euler_G, euler_order_method)
+    new_G, total_distance, artificial_edges = annotate_circuit(euler_G, circuit, length_unit)
+    old_length = district_G.graph['total_distance']
+    return new_G, [total_distance, old_length, total_distance / old_length,
+                   "artificial edges: " + str(artificial_edges)]
+
+
+def partition_districts(G, k, weight='length', tolerance=0.02):
+    """
+    Partitions the edges of a connected road graph into k connected districts of similar total road length.
+
+    Districts are peeled off one at a time from the edge of the network: a district grows outward from the
+    unclaimed node farthest from the rest, taking nodes closest to its start first, until it holds its share
+    of the remaining road. Growing by distance keeps districts compact, so few roads cross between them.
+    Border nodes are then moved between neighbouring districts until every district's load is within
+    tolerance of the average, or no move can narrow the gaps any further. Roads inside a district belong to
+    it, and roads crossing a border go, longest first, to the lighter of their two districts.
+
+    Nodes are always visited in the order of G, so the same graph gives the same districts in every run.
+
+    Parameters:
+    - G (networkx.MultiGraph): The road graph.
+    - k (int): Number of districts.
+    - weight (str): Edge attribute holding the road length.
+    - tolerance (float): Largest relative difference between a district's load and the average load that
+      rebalancing stops at.
+
+    Returns:
+    - list: The district number of each edge, in the order of G.edges(keys=True).
+    """
+    if k < 1 or k > G.number_of_nodes():
+        raise ValueError("k must be between 1 and the number of nodes")
+    if not nx.is_connected(G):
+        raise nx.NetworkXError("G is not connected")
+    # each road counts half towards the load of either endpoint
+    node_loads = dict.fromkeys(G, 0)
+    for source, target, length in G.edges(data=weight, default=1):
+        node_loads[source] += length / 2
+        node_loads[target] += length / 2
+
+    owner = {}
+    pending = [(set(G), k)]
+    while pending:
+        nodes, parts = pending.pop()
+        pending.extend(peel_district(G, nodes, parts, owner, node_loads, weight, tolerance))
+    rebalance_districts(G, owner, k, node_loads, tolerance)
+
+    loads = [0] * k
+    edge_districts = []
+    crossing = []
+    for index, (source, target, length) in enumerate(G.edges(data=weight, default=1)):
+        edge_districts.append(owner[source])
+        if owner[source] == owner[target]:
+            loads[owner[source]] += length
+        else:
+            crossing.append((length, index, target))
+    # longest crossing roads first, so the short ones can even out what they leave
+    crossing.sort(key=lambda road: road[0], reverse=True)
+    for length, index, target in crossing:
+        if loads[owner[target]] < loads[edge_districts[index]]:
+            edge_districts[index] = owner[target]
+        loads[edge_districts[index]] += length
+    return edge_districts
+
+
+def peel_district(G, nodes, parts, owner, node_loads, weight='length', tolerance=0.02, attempts=16):
+    """
+    Claims one district out of a connected set of unclaimed nodes that is to be split into parts districts.
+
+    The district grows from a node on the far edge of the set, closest nodes first, until it holds
+    1 / parts of the set's load. If that splits what is left into pieces, pieces too small to make up a
+    district of their own can only go to the new district, which they border, and the remaining districts
+    are shared out between the other pieces by load. Either can leave districts far from their share, so the
+    district is grown again to other loads, first making room for the pieces it swallowed and then trying
+    loads around its share, keeping the attempt whose districts all come closest to their share.
+
+    Parameters:
+    - G (networkx.MultiGraph): The road graph.
+    - nodes (set): The unclaimed, connected nodes.
+    - parts (int): Number of districts to split the nodes into.
+    - owner (dict): The district number of each claimed node, updated in place.
+    - node_loads (dict): The load each node adds to its district.
+    - weight (str): Edge attribute holding the road length.
+    - tolerance (float): Relative difference from the share that is close enough to stop trying.
+    - attempts (int): Maximum number of times the district is grown.
+
+    Returns:
+    - list: (nodes, parts) for each piece still to be split.
+    """
+    district = len(set(owner.values()))
+    if parts == 1:
+        owner.update(dict.fromkeys(nodes, district))
+        return []
+    ordered = [node for node in G if node in nodes]
+    total = sum(node_loads[node] for node in ordered)
+    target = total / parts
+
+    # the node farthest from the first one lies on the far edge of the set
+    start = grow_district(G, nodes, ordered[0], node_loads, weight=weight)[-1]
+    offsets = [sign * step / 20 for step in range(1, attempts) for sign in (-1, 1)]
+    best = None
+    goal = target
+    for _ in range(attempts):
+        claimed = set(grow_district(G, nodes, start, node_loads, goal, weight))
+        pieces = [(piece, sum(node_loads[node] for node in piece))
+                  for piece in connected_pieces(G, [node for node in ordered if node not in claimed])]
+        pieces.sort(key=lambda piece: piece[1], reverse=True)
+        # every remaining district needs a piece, and a piece needs about half a district's load to get one
+        # unless it is the last piece left
+        while len(pieces) > parts - 1 or (len(pieces) > 1 and pieces[-1][1] < target / 2):
+            piece, piece_load = pieces.pop()
+            claimed.update(piece)
+        load = total - sum(piece_load for piece, piece_load in pieces)
+        shares = share_districts([piece_load for piece, piece_load in pieces], parts - 1)
+        error = max([abs(load - target)] + [abs(piece_load / share - target)
+                                            for (piece, piece_load), share in zip(pieces, shares)]) / target
+        if best is None or error < best[0]:
+            best = (error, claimed, pieces, shares)
+        if best[0] <= tolerance or not offsets:
+            break
+        if load - target > tolerance * target and goal - (load - target) > 0:
+            # the pieces swallowed pushed the district over its share, so leave that much room for them
+            goal -= load - target
+        else:
+            goal = target * (1 + offsets.pop(0))
+    error, claimed, pieces, shares = best
+    owner.update(dict.fromkeys(claimed, district))
+    return [(set(piece), share) for (piece, piece_load), share in zip(pieces, shares)]
+
+
+def share_districts(loads, parts):
+    """
+    Shares out parts districts between pieces with the given loads, at least one each, in proportion to their
+    load.
+    """
+    if not loads:
+        return []
+    remaining = sum(loads)
+    shares = [max(1, round(parts * load / remaining)) for load in loads]
+    # hand spare districts to the pieces with the most load per district, or take them back from the least
+    while sum(shares) != parts:
+        step = 1 if sum(shares) < parts else -1
+        index = max((i for i in range(len(shares)) if shares[i] + step >= 1),
+                    key=lambda i: loads[i] / shares[i] * step)
+        shares[index] += step
+    return shares
+
+
+def grow_district(G, nodes, start, node_loads, target=None, weight='length'):
+    """
+    Claims nodes of a set outward from a start node, closest by road first, until they hold the target load.
+
+    Parameters:
+    - G (networkx.MultiGraph): The road graph.
+    - nodes (set): The nodes that may be claimed.
+    - start: The node to grow from.
+    - node_loads (dict): The load each node adds to its district.
+    - target (float, optional): Load to stop at. None claims every node reachable within the set.
+    - weight (str): Edge attribute holding the road length.
+
+    Returns:
+    - list: The claimed nodes in the order they were claimed, so the last one is the farthest from start.
+    """
+    load = 0
+    order = 0
+    frontier = [(0, order, start)]
+    claimed = {}
+    while frontier and (target is None or load < target):
+        distance, _, node = heapq.heappop(frontier)
+        if node in claimed:
+            continue
+        claimed[node] = None
+        load += node_loads[node]
+        for _, neighbor, length in G.edges(node, data=weight, default=1):
+            if neighbor in nodes and neighbor not in claimed:
+                order += 1
+                heapq.heappush(frontier, (distance + length, order, neighbor))
+    return list(claimed)
+
+
+def connected_pieces(G, nodes):
+    """
+    Splits nodes into the connected pieces they form in G, without building a subgraph view, so the pieces
+    and the nodes in them come out in the order of nodes.
+
+    Parameters:
+    - G (networkx.MultiGraph): The road graph.
+    - nodes (list): The nodes to split.
+
+    Returns:
+    - list: A list of nodes for each piece.
+    """
+    allowed = set(nodes)
+    seen = set()
+    pieces = []
+    for first in nodes:
+        if first in seen:
+            continue
+        seen.add(first)
+        piece = [first]
+        for node in piece:
+            for neighbor in G[node]:
+                if neighbor in allowed and neighbor not in seen:
+                    seen.add(neighbor)
+                    piece.append(neighbor)
+        pieces.append(piece)
+    return pieces
+
+
+def rebalance_districts(G, owner, k, node_loads, tolerance=0.02, search_limit=256):
+    """
+    Moves border nodes from heavier to lighter neighbouring districts, in place, until every district's load
+    is within tolerance of the average.
+
+    A node only moves when that narrows the load gap between its two districts. If its old district would
+    fall apart without it, the pieces cut off from the heaviest one move along with it, which lets districts
+    on tree-like road networks grow past a junction. The pieces are found with searches of at most
+    search_limit nodes; once no more moves pass, the limit is raised, up to searching whole districts, before
+    giving up.
+
+    Parameters:
+    - G (networkx.MultiGraph): The road graph.
+    - owner (dict): The district number of each node, updated in place.
+    - k (int): Number of districts.
+    - node_loads (dict): The load each node adds to its district.
+    - tolerance (float): Largest relative difference between a district's load and the average load.
+    - search_limit (int): Nodes searched at first when looking for the pieces a move cuts off.
+
+    Returns:
+    - None
+    """
+    loads = [0] * k
+    sizes = [0] * k
+    for node, district in owner.items():
+        loads[district] += node_loads[node]
+        sizes[district] += 1
+    average = sum(loads) / k
+
+    def border():
+        return [node for node in G if any(owner[neighbor] != owner[node] for neighbor in G[node])]
+
+    queue = deque(border())
+    queued = set(queue)
+    while max(loads) > (1 + tolerance) * average or min(loads) < (1 - tolerance) * average:
+        if not queue:
+            if search_limit >= len(G):
+                break
+            search_limit *= 4
+            queue.extend(border())
+            queued.update(queue)
+            continue
+        node = queue.popleft()
+        queued.discard(node)
+        district = owner[node]
+        neighbours = {owner[neighbor] for neighbor in G[node]} - {district}
+        if not neighbours:
+            continue
+        lighter = min(sorted(neighbours), key=lambda d: loads[d])
+        if loads[lighter] + node_loads[node] >= loads[district]:
+            continue
+        moving = detached_nodes(G, owner, node, node_loads, search_limit)
+        if moving is None or len(moving) == sizes[district]:
+            continue
+        moving_load = sum(node_loads[moved] for moved in moving)
+        if loads[lighter] + moving_load >= loads[district]:
+            continue
+        for moved in moving:
+            owner[moved] = lighter
+        loads[district] -= moving_load
+        loads[lighter] += moving_load
+        sizes[district] -= len(moving)
+        sizes[lighter] += len(moving)
+        # the move puts the neighbours of what moved on the border
+        for moved in moving:
+            for neighbor in [moved, *G[moved]]:
+                if neighbor not in queued:
+                    queue.append(neighbor)
+                    queued.add(neighbor)
+
+
+def detached_nodes(G, owner, node, node_loads, search_limit=256):
+    """
+    Finds the nodes that have to leave a district along with a node to keep the rest of it connected: the
+    node itself and every piece the district would fall into without it, apart from the heaviest one.
+
+    Each piece is searched from one of the node's district neighbours, at most search_limit nodes at a time.
+    A search that stops at the limit is taken to have found the heaviest piece, so the pieces cut off are
+    only known when the searches that stop there all meet.
+
+    Parameters:
+    - G (networkx.MultiGraph): The road graph.
+    - owner (dict): The district number of each node.
+    - node: The node about to leave its district.
+    - node_loads (dict): The load each node adds to its district.
+    - search_limit (int): Maximum number of nodes searched per piece.
+
+    Returns:
+    - list: The nodes to move, starting with node, or None if the searches were too short to tell.
+    """
+    district = owner[node]
+    pieces = []
+    # nodes of searches that stopped at the limit, all in the same piece
+    open_nodes = set()
+    seen = {node}
+    for start in G[node]:
+        if start in seen or owner[start] != district:
+            continue
+        seen.add(start)
+        piece = [start]
+        is_open = False
+        for current in piece:
+            if len(piece) > search_limit:
+                if open_nodes:
+                    return None
+                is_open = True
+                break
+            for neighbor in G[current]:
+                if neighbor in open_nodes:
+                    is_open = True
+                    break
+                if neighbor not in seen and owner[neighbor] == district:
+                    seen.add(neighbor)
+                    piece.append(neighbor)
+            if is_open:
+                break
+        if is_open:
+            open_nodes.update(piece)
+        else:
+            pieces.append(piece)
+    if not open_nodes and pieces:
+        # the whole district was searched, so its heaviest piece stays
+        pieces.remove(max(pieces, key=lambda piece: sum(node_loads[member] for member in piece)))
+    return [node] + [moved for piece in pieces for moved in piece]
+
+
+def district_subgraphs(G, edge_districts):
+    """
+    Splits a road graph into one graph per district.
+
+    Parameters:
+    - G (networkx.MultiGraph): The road graph.
+    - edge_districts (list): The district number of each edge, see partition_districts().
+
+    Returns:
+    - list: A networkx.MultiGraph per district that was given any roads, each with its 'total_distance'
+      graph attribute set.
+    """
+    districts = {}
+    for (source, target, key, data), district in zip(G.edges(keys=True, data=True), edge_districts):
+        if district not in districts:
+            districts[district] = nx.MultiGraph(total_distance=0)
+        districts[district].add_edge(source, target, key, **data)
+        districts[district].graph['total_distance'] += data.get('length', 0)
+    return [districts[district] for district in sorted(districts)]
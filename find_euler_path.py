@@ -1,89 +1,274 @@
 import ast
+import json
 import networkx as nx
-import matplotlib.pyplot as plt
 import heapq
+import numpy as np
+import instrumentation
 from itertools import combinations
 from pyproj import Geod
 from networkx.utils import pairwise
 
+WGS84_GEOD = Geod(ellps='WGS84')
+
+# road lengths are scaled to integer flow costs, network_simplex() is not reliable with floating point costs
+FLOW_COST_SCALE = 10 ** 6
+
 
 def modify_graph(graphml_input='new_graph.graphml',
                  dest='euler_path_output.graphml',
                  euler_form_method="built_in",
                  euler_order_method="built_in",
-                 length_unit="miles"):
+                 length_unit="miles",
+                 euler_form_options=None,
+                 index_dest=None,
+                 speeds=None,
+                 eulerized_dest='eulerized_graph.graphml'):
     """
     Modifies a graph by finding an Euler path and writing the modified graph to a GraphML file.
 
+    pipeline.plan_patrol() runs the same stages on graphs in memory, writing files only when asked.
+
     Parameters:
     - graphml_input (str): Path to the input GraphML file.
     - dest (str): Path to the output GraphML file.
-    - method (str): Method for Eulerization. Can be "built_in" or "min_weights" or "dijkstra".
+    - method (str): Method for Eulerization. Can be "built_in" or "min_weights" or "dijkstra", or
+      "min_cost_flow" for graphs with one-way roads, which are ordered into a directed circuit.
     - length_unit (str): Unit of length for calculating distances.
+    - euler_form_options (dict): Extra keyword arguments for the eulerization method, such as
+      {"odd_nodes_only": True, "k_nearest": 10} for "min_weights" and "dijkstra". Every method takes a
+      "distance_index", a DistanceIndex of the input graph or the path of one saved to disk.
+    - index_dest (str): Also save a CircuitIndex of the circuit to this .npz file, keeping the order the
+      roads are driven in for position and shift-split queries.
+    - speeds (dict): Speed per road type for the travel times in the CircuitIndex, see
+      CircuitIndex.from_edges().
+    - eulerized_dest (str): Path to write the eulerized graph to, None to skip writing it.
 
     Returns:
     - list: A list containing the total distance of the Euler path and the number of artificial edges created.
     """
-    G = nx.read_graphml(graphml_input)
-    if euler_form_method == "min_weights":
-        euler_G = eulerize_minimize_weights(G)
-    elif euler_form_method == "dijkstra":
-        euler_G = eulerize_minimize_weights_dijkistra(G)
-    elif euler_form_method == "built_in_weighted":
-        euler_G = eulerize_built_in_weighted(G)
-    else:
-        euler_G = eulerize_built_in(G)
-    nx.write_graphml(euler_G, 'eulerized_graph.graphml')
-    if euler_order_method == "trotter":
-        circuit = trotter(euler_G)
-    else:
-        circuit = list(nx.eulerian_circuit(euler_G))
-    nx.write_graphml(nx.MultiDiGraph(circuit), dest)
-    new_G = nx.MultiDiGraph()
-    total_distance = 0
-    artificial_edges = 0
-    for source, target in circuit:
-        edge_data = euler_G.get_edge_data(source, target)
-        if edge_data is None or len(edge_data[0]) == 0 or len(edge_data) == 0 or 'name' not in edge_data[0]:
-            road_name = "unnamed"
-            artificial_edges += 1
-            init_length = calculate_distance(source, target, init_length_unit=length_unit)
-        else:
-            road_name = edge_data[0]['name']
-            init_length = edge_data[0]['length']
-            init_type = edge_data[0]['type']
-        new_G.add_edge(source, target, name=road_name, length=init_length, type=init_type)
-        total_distance += init_length
-
-    nx.write_graphml(new_G, dest)
+    with instrumentation.stage('ingest', source=graphml_input):
+        # edges carry a multiplicity instead of being repeated, so the file may have no parallel edges at all
+        G = nx.read_graphml(graphml_input, force_multigraph=True)
+        instrumentation.annotate(nodes=G.number_of_nodes(), edges=G.number_of_edges())
+    euler_G = eulerize_graph(G, euler_form_method, euler_form_options)
+    if eulerized_dest is not None:
+        with instrumentation.stage('export', dest=eulerized_dest):
+            nx.write_graphml(euler_G, eulerized_dest)
+    circuit = order_circuit(euler_G, euler_order_method)
+    new_G, total_distance, artificial_edges = annotate_circuit(euler_G, circuit, length_unit)
+    with instrumentation.stage('export', dest=dest):
+        nx.write_graphml(new_G, dest)
+    if index_dest is not None:
+        from circuit_index import CircuitIndex
+        with instrumentation.stage('export', dest=index_dest):
+            CircuitIndex.from_circuit(euler_G, circuit, length_unit, speeds=speeds).save(index_dest)
     old_length = G.graph['total_distance']
     circuit_length_multiplier = total_distance / old_length
     return [total_distance, old_length, circuit_length_multiplier, "artificial edges: " + str(artificial_edges)]
 
 
-def eulerize_built_in(G):
+def eulerize_graph(G, euler_form_method="built_in", euler_form_options=None):
     """
-    Eulerizes a graph by adding edges.
-    Doesn't add an edge between nodes that dont already have a single edge between them
+    Eulerizes a road graph with the method named by modify_graph()'s euler_form_method.
 
     Parameters:
-    G (networkx.Graph): The input graph.
+    - G (networkx.MultiGraph): The road graph.
+    - euler_form_method (str): "built_in", "built_in_weighted", "min_weights", "dijkstra" or
+      "min_cost_flow". Directed graphs, as built from road layers with one-way roads, need "min_cost_flow".
+    - euler_form_options (dict): Extra keyword arguments for the eulerization method.
 
     Returns:
-    networkx.Graph: The Eulerized graph.
+    - networkx.MultiGraph: The Eulerized graph, or a networkx.MultiDiGraph for "min_cost_flow".
+    """
+    euler_form_options = euler_form_options or {}
+    if isinstance(euler_form_options.get('distance_index'), str):
+        # only loading a saved index needs scipy
+        from distance_index import DistanceIndex
+        euler_form_options = dict(euler_form_options,
+                                  distance_index=DistanceIndex.load(euler_form_options['distance_index']))
+    if G.is_directed() and euler_form_method != "min_cost_flow":
+        raise ValueError(f'The graph has one-way roads, which "{euler_form_method}" cannot eulerize. '
+                         'Use "min_cost_flow" instead.')
+    with instrumentation.stage('eulerize', method=euler_form_method) as record:
+        if record is not None:
+            record.update(nodes=G.number_of_nodes(), edges=G.number_of_edges(),
+                          odd_nodes=len(find_odd_degree_nodes(G)))
+        if euler_form_method == "min_weights":
+            euler_G = eulerize_minimize_weights(G, **euler_form_options)
+        elif euler_form_method == "dijkstra":
+            euler_G = eulerize_minimize_weights_dijkistra(G, **euler_form_options)
+        elif euler_form_method == "built_in_weighted":
+            euler_G = eulerize_built_in_weighted(G, **euler_form_options)
+        elif euler_form_method == "min_cost_flow":
+            euler_G = eulerize_min_cost_flow(G, **euler_form_options)
+        else:
+            euler_G = eulerize_built_in(G, **euler_form_options)
+        if record is not None:
+            record['added_traversals'] = int(euler_G.size(weight='multiplicity') - G.size(weight='multiplicity'))
+    return euler_G
+
+
+def order_circuit(euler_G, euler_order_method="built_in"):
+    """
+    Orders the edges of an Eulerized graph into a circuit with the method named by modify_graph()'s
+    euler_order_method.
+
+    Parameters:
+    - euler_G (networkx.MultiGraph): The Eulerized graph.
+    - euler_order_method (str): "built_in", "trotter" or "hierholzer". trotter() only follows undirected
+      edges, so directed graphs are ordered with "hierholzer" instead, which moves to the lowest numbered
+      neighbor just the same.
+
+    Returns:
+    - list: The circuit as (source, target) tuples.
+    """
+    with instrumentation.stage('order', method=euler_order_method):
+        if euler_order_method == "trotter" and not euler_G.is_directed():
+            circuit = trotter(expand_multiplicity(euler_G))
+        elif euler_order_method in ("hierholzer", "trotter"):
+            circuit = hierholzer(euler_G)
+        else:
+            circuit = list(nx.eulerian_circuit(expand_multiplicity(euler_G)))
+        instrumentation.annotate(circuit_edges=len(circuit))
+    return circuit
+
+
+def annotate_circuit(euler_G, circuit, length_unit="miles"):
+    """
+    Builds the output circuit graph written by modify_graph(), copying road name, length and type onto each
+    traversed edge, along with the geometry of edges contracted by contract_degree_two_chains(). Edges with no
+    road behind them are counted as artificial and measured directly.
+
+    Parameters:
+    - euler_G (networkx.MultiGraph): The Eulerized graph the circuit was ordered from.
+    - circuit (list): The circuit as (source, target) tuples.
+    - length_unit (str): Unit of length for calculating distances.
+
+    Returns:
+    - tuple: The circuit as a networkx.MultiDiGraph, its total distance and the number of artificial edges.
     """
-    return nx.eulerize(G)
+    with instrumentation.stage('annotate'):
+        edges, artificial_edges = annotate_circuit_edges(euler_G, circuit, length_unit)
+        new_G = nx.MultiDiGraph()
+        new_G.add_edges_from(edges)
+        total_distance = 0
+        for _, _, data in edges:
+            total_distance += data['length']
+        instrumentation.annotate(circuit_edges=len(circuit), artificial_edges=artificial_edges,
+                                 total_distance=total_distance)
+    return new_G, total_distance, artificial_edges
 
 
-def eulerize_built_in_weighted(G):
+def annotate_circuit_edges(euler_G, circuit, length_unit="miles"):
     """
-    WORK IN PROGRESS NOT READY YET
+    Gives every circuit edge the attributes annotate_circuit() gives it, in one pass over the circuit.
+
+    Roads are looked up once per pair of nodes however often the circuit drives them, and all artificial
+    edges are measured together in a single vectorized call. Unlike the circuit graph annotate_circuit()
+    builds, the list keeps the order the edges are driven in.
 
-    Mostly contains source code from networkx eulerize() function with few tweaks to account for road segment length.
+    Parameters:
+    - euler_G (networkx.MultiGraph): The Eulerized graph the circuit was ordered from.
+    - circuit (list): The circuit as (source, target) tuples.
+    - length_unit (str): Unit of length for measuring artificial edges.
+
+    Returns:
+    - tuple: A list of (source, target, data) tuples in circuit order and the number of artificial edges.
+      Edges driven more than once share their data dict, which must not be modified.
+    """
+    roads = {}
+    edges = []
+    artificial = []
+    for source, target in circuit:
+        key = (source, target)
+        if key not in roads:
+            roads[key] = road_edge_data(euler_G, source, target)
+        data = roads[key]
+        if data is None:
+            artificial.append(len(edges))
+        edges.append((source, target, data))
+    if artificial:
+        points = {}
+        for position in artificial:
+            for node in edges[position][:2]:
+                if node not in points:
+                    points[node] = parse_node(node)
+        sources = np.array([points[edges[position][0]][:2] for position in artificial], dtype=np.float64)
+        targets = np.array([points[edges[position][1]][:2] for position in artificial], dtype=np.float64)
+        lengths = calculate_distances_raw(sources[:, 0], sources[:, 1], targets[:, 0], targets[:, 1],
+                                          in_init_length_unit=length_unit)
+        for position, length in zip(artificial, lengths.tolist()):
+            source, target, _ = edges[position]
+            edges[position] = (source, target, {'name': "unnamed", 'length': length, 'type': 'no_type'})
+    return edges, len(artificial)
+
+
+def circuit_edges(euler_G, circuit, length_unit="miles"):
+    """
+    Yields the circuit edges in order with the attributes annotate_circuit() gives them. Unlike the circuit
+    graph it builds, this keeps the order the edges are driven in, for example for CircuitIndex.
+
+    Parameters:
+    - euler_G (networkx.MultiGraph): The Eulerized graph the circuit was ordered from.
+    - circuit (list): The circuit as (source, target) tuples.
+    - length_unit (str): Unit of length for measuring artificial edges.
+
+    Yields:
+    - tuple: (source, target, data) for each edge of the circuit.
+    """
+    yield from annotate_circuit_edges(euler_G, circuit, length_unit)[0]
+
+
+def road_edge_data(euler_G, source, target):
+    """
+    Returns the name, length and type of the road between two nodes, plus the geometry of edges contracted
+    by contract_degree_two_chains(), or None if no road joins them.
+    """
+    edge_data = euler_G.get_edge_data(source, target)
+    # the first edge between the two nodes stands for the road
+    edge_data = None if not edge_data else next(iter(edge_data.values()))
+    if edge_data is None or 'name' not in edge_data:
+        return None
+    data = {'name': edge_data['name'], 'length': edge_data['length'], 'type': edge_data['type']}
+    data.update((key, edge_data[key]) for key in ('geometry', 'segment_lengths') if key in edge_data)
+    return data
+
+
+def edge_segments(source, target, data):
+    """
+    Expands a circuit edge back into the road segments it was contracted from by contract_degree_two_chains().
+
+    Parameters:
+    source (tuple): Coordinates of the node the circuit leaves the edge from.
+    target (tuple): Coordinates of the node the circuit enters.
+    data (dict): The edge's attributes.
+
+    Returns:
+    list: (source, target, length) for each original segment in the order it is traversed, or just the edge
+    itself if it was never contracted.
+    """
+    if 'geometry' not in data:
+        return [(source, target, data['length'])]
+    points = [tuple(point) for point in json.loads(data['geometry'])]
+    lengths = json.loads(data['segment_lengths'])
+    if points[0] != source:
+        points.reverse()
+        lengths.reverse()
+    return list(zip(points[:-1], points[1:], lengths))
+
+
+def eulerize_built_in(G, distance_index=None):
+    """
+    Eulerizes a graph by adding edges.
     Doesn't add an edge between nodes that dont already have a single edge between them
 
+    Same as the networkx eulerize() function, except that edges count with their multiplicity when finding
+    odd-degree nodes and added edges are recorded as multiplicity.
+
     Parameters:
     G (networkx.Graph): The input graph.
+    distance_index (DistanceIndex, optional): An index of G counting edges. The distances between odd-degree
+        nodes then come from it and only the paths of matched pairs are searched.
 
     Returns:
     networkx.Graph: The Eulerized graph.
@@ -97,17 +282,11 @@ def eulerize_built_in_weighted(G):
         raise nx.NetworkXPointlessConcept("Cannot Eulerize null graph")
     if not nx.is_connected(G):
         raise nx.NetworkXError("G is not connected")
-    odd_degree_nodes = [n for n, d in G.degree() if d % 2 == 1]
+    odd_degree_nodes = find_odd_degree_nodes(G)
     G = nx.MultiGraph(G)
     if len(odd_degree_nodes) == 0:
         return G
 
-    # get all shortest paths between vertices of odd degree
-    odd_deg_pairs_paths = []
-    for m, n in combinations(odd_degree_nodes, 2):
-        path = nx.dijkstra_path(G, source=m, target=n, weight=(lambda u,v, data:  G[u][v][0].get('weight', 1)))
-        odd_deg_pairs_paths.append((m, {n: path}))
-
     # use the number of vertices in a graph + 1 as an upper bound on
     # the maximum length of a path in G
     upper_bound_on_max_path_length = len(G) + 1
@@ -117,45 +296,132 @@ def eulerize_built_in_weighted(G):
     # as edge-weights in a new graph
     # store the paths in the graph for easy indexing later
     Gp = nx.Graph()
-    for n, Ps in odd_deg_pairs_paths:
-        for m, P in Ps.items():
-            if n != m:
-                Gp.add_edge(
-                    m, n, weight=upper_bound_on_max_path_length - len(P), path=P
-                )
+    if distance_index is None:
+        # get all shortest paths between vertices of odd degree
+        odd_deg_pairs_paths = [
+            (m, {n: nx.shortest_path(G, source=m, target=n)})
+            for m, n in combinations(odd_degree_nodes, 2)
+        ]
+        instrumentation.count('shortest_path_searches', len(odd_deg_pairs_paths))
+        for n, Ps in odd_deg_pairs_paths:
+            for m, P in Ps.items():
+                if n != m:
+                    Gp.add_edge(
+                        m, n, weight=upper_bound_on_max_path_length - len(P), path=P
+                    )
+    else:
+        check_distance_index(distance_index, G, None)
+        for length, m, n in distance_index.pair_lengths(odd_degree_nodes):
+            Gp.add_edge(m, n, weight=upper_bound_on_max_path_length - (int(length) + 1))
 
     # find the minimum weight matching of edges in the weighted graph
     best_matching = nx.Graph(list(nx.max_weight_matching(Gp)))
 
     # duplicate each edge along each path in the set of paths in Gp
     for m, n in best_matching.edges():
-        path = Gp[m][n]["path"]
-        G.add_edges_from(nx.utils.pairwise(path))
+        path = Gp[m][n]["path"] if distance_index is None else distance_index.path(m, n)
+        instrumentation.observe('matched_path_length', len(path) - 1)
+        for u, v in pairwise(path):
+            add_edge_copy(G, u, v)
+    return G
+
+
+def eulerize_built_in_weighted(G, k_nearest=10, distance_index=None, exact=False):
+    """
+    Eulerizes a graph by adding edges, solving it as a road-length weighted Chinese Postman problem.
+
+    Follows the approach of the networkx eulerize() function, but uses road segment length instead of hop
+    counts and, instead of finding shortest paths between every pair of odd-degree nodes and matching on the
+    complete graph of them, matches on a sparse candidate graph linking each odd-degree node to its
+    k_nearest nearest odd-degree neighbours by network distance. If that graph has no perfect matching a
+    denser one (doubling k_nearest) is tried.
+
+    With the default k_nearest this is a heuristic: the matching is the best one on the candidate graph, but
+    an optimal postman solution may need a pair that was left out. On random graphs the added distance comes
+    out a few percent above the optimum now and then; on a 20,000 segment perturbed grid from benchmark.py
+    it was 0.008% above. k_nearest None, or exact True, gives the optimal postman solution. exact checks the
+    matching against the pairs left out, see certify_min_weight_matching(), which stays far cheaper than
+    matching on the complete graph of odd-degree nodes but makes the matching several times slower on large
+    networks.
+    Doesn't add an edge between nodes that dont already have a single edge between them
+
+    Parameters:
+    G (networkx.Graph): The input graph.
+    k_nearest (int, optional): Number of nearest odd-degree neighbours per odd-degree node in the candidate
+        graph. None matches on the complete graph of odd-degree nodes. Default is 10.
+    distance_index (DistanceIndex, optional): An index of G measuring 'length', whose adjacency is searched
+        instead of G's.
+    exact (bool, optional): Prove the sparse matching optimal, or add the pairs it is missing, so the result
+        is an optimal postman solution. Default is False.
+
+    Returns:
+    networkx.Graph: The Eulerized graph.
+
+    References:
+    - Aric A. Hagberg, Daniel A. Schult and Pieter J. Swart, “Exploring network structure, dynamics, and
+      function using NetworkX”, in Proceedings of the 7th Python in Science Conference (SciPy2008),
+      Gäel Varoquaux, Travis Vaught, and Jarrod Millman (Eds), (Pasadena, CA USA), pp. 11–15, Aug 2008
+    """
+    check_k_nearest(k_nearest)
+    if G.order() == 0:
+        raise nx.NetworkXPointlessConcept("Cannot Eulerize null graph")
+    if not nx.is_connected(G):
+        raise nx.NetworkXError("G is not connected")
+    odd_degree_nodes = find_odd_degree_nodes(G)
+    G = nx.MultiGraph(G)
+    if len(odd_degree_nodes) == 0:
+        return G
+
+    # duplicate each edge along each path in the set of matched paths
+    for path in odd_node_paths(G, match_odd_nodes_min_weight, odd_degree_nodes, 'length', distance_index,
+                               k_nearest=k_nearest, exact=exact):
+        for u, v in pairwise(path):
+            add_edge_copy(G, u, v, length=min(data.get('length', 1) for data in G[u][v].values()))
     return G
 
 
-def eulerize_minimize_weights(old_G):
+def eulerize_minimize_weights(old_G, odd_nodes_only=False, cutoff=None, k_nearest=None, distance_index=None):
     """
     Eulerize the given graph by adding edges between pairs of odd-degree nodes
     to minimize the weights of the resulting Eulerian circuit.
 
     Parameters:
     old_G (networkx.Graph): The input graph.
+    odd_nodes_only (bool): Only search shortest paths from odd-degree nodes instead of between all pairs of
+        nodes, rebuilding paths only for the pairs that get matched. Implied by cutoff and k_nearest.
+    cutoff (int, optional): Only pair odd-degree nodes at most this many edges apart.
+    k_nearest (int, optional): Only consider the k nearest odd-degree neighbours of each odd-degree node.
+    distance_index (DistanceIndex, optional): An index of old_G counting edges. Only the distances between
+        odd-degree nodes are then searched, with paths only for the pairs that get matched.
 
     Returns:
     networkx.Graph: The Eulerized graph.
     """
     # Create a copy of the graph to avoid modifying the original graph
-    G = old_G.copy()
-    print("started eulerize_minimize_weights")
+    G = old_G.copy() if old_G.is_multigraph() else nx.MultiGraph(old_G)
     # Find all nodes with odd degree
-    odd_degree_nodes = [node for node, degree in G.degree() if degree % 2 == 1]
+    odd_degree_nodes = find_odd_degree_nodes(G)
+
+    if odd_nodes_only or cutoff is not None or k_nearest is not None:
+        for path in odd_node_paths(G, match_odd_nodes_greedily, odd_degree_nodes, None, distance_index,
+                                   cutoff=cutoff, k_nearest=k_nearest):
+            for u, v in pairwise(path):
+                add_edge_copy(G, u, v)
+        if instrumentation.is_recording():
+            instrumentation.annotate(odd_nodes_left=len(find_odd_degree_nodes(G)))
+        return eulerize_built_in(G, distance_index=distance_index)
 
-    shortest_paths = dict(nx.all_pairs_shortest_path(G))
+    if distance_index is None:
+        shortest_paths = dict(nx.all_pairs_shortest_path(G))
+        instrumentation.count('shortest_path_searches', G.number_of_nodes())
 
-    # Create a priority queue of pairs of odd-degree nodes, with distances as priorities
-    pair_queue = [(len(shortest_paths[node_A][node_B]), node_A, node_B) for i, node_A in enumerate(odd_degree_nodes) for
-                  node_B in odd_degree_nodes[i + 1:]]
+        # Create a priority queue of pairs of odd-degree nodes, with distances as priorities
+        pair_queue = [(len(shortest_paths[node_A][node_B]), node_A, node_B) for i, node_A in enumerate(odd_degree_nodes)
+                      for node_B in odd_degree_nodes[i + 1:]]
+    else:
+        check_distance_index(distance_index, G, None)
+        pair_queue = [(int(length) + 1, node_A, node_B)
+                      for length, node_A, node_B in distance_index.pair_lengths(odd_degree_nodes)]
     heapq.heapify(pair_queue)
 
     # While there are nodes with odd degree
@@ -167,62 +433,673 @@ def eulerize_minimize_weights(old_G):
         if node_A in odd_degree_nodes and node_B in odd_degree_nodes:
 
             # Duplicate all edges in the shortest path between node1 and node2
-            path = shortest_paths[node_A][node_B]
+            path = shortest_paths[node_A][node_B] if distance_index is None else distance_index.path(node_A, node_B)
+            instrumentation.observe('matched_path_length', len(path) - 1)
             for i in range(len(path) - 1):
-                G.add_edge(path[i], path[i + 1])
+                add_edge_copy(G, path[i], path[i + 1])
             # Remove node1 and node2 from the list of nodes with odd degree
             odd_degree_nodes.remove(node_A)
             odd_degree_nodes.remove(node_B)
-    odd_degree_nodes = [node for node, degree in G.degree() if degree % 2 == 1]
-    print("odd degree nodes: ", odd_degree_nodes)
-    return nx.eulerize(G)
+    if instrumentation.is_recording():
+        instrumentation.annotate(odd_nodes_left=len(find_odd_degree_nodes(G)))
+    return eulerize_built_in(G, distance_index=distance_index)
 
 
-def eulerize_minimize_weights_dijkistra(old_G):
+def eulerize_minimize_weights_dijkistra(old_G, odd_nodes_only=False, cutoff=None, k_nearest=None,
+                                        distance_index=None):
     """
     Eulerize the given graph by adding edges between pairs of odd-degree nodes
     to minimize the weights of the resulting Eulerian circuit.
 
     Parameters:
     old_G (networkx.Graph): The input graph.
+    odd_nodes_only (bool): Run Dijkstra only from odd-degree nodes instead of between all pairs of nodes,
+        keeping lengths and shortest-path trees from that single run and rebuilding paths only for the pairs
+        that get matched. Implied by cutoff and k_nearest.
+    cutoff (float, optional): Only pair odd-degree nodes whose road distance is at most cutoff.
+    k_nearest (int, optional): Only consider the k nearest odd-degree neighbours of each odd-degree node.
+    distance_index (DistanceIndex, optional): An index of old_G measuring 'length'. Only the distances
+        between odd-degree nodes are then searched, with paths only for the pairs that get matched.
 
     Returns:
     networkx.Graph: The Eulerized graph.
     """
     # Create a copy of the graph to avoid modifying the original graph
-    G = old_G.copy()
-    print("started eulerize_minimize_weights")
+    G = old_G.copy() if old_G.is_multigraph() else nx.MultiGraph(old_G)
     # Find all nodes with odd degree
-    odd_degree_nodes = [node for node, degree in G.degree() if degree % 2 == 1]
+    odd_degree_nodes = find_odd_degree_nodes(G)
+
+    if odd_nodes_only or cutoff is not None or k_nearest is not None:
+        for path in odd_node_paths(G, match_odd_nodes_greedily, odd_degree_nodes, 'length', distance_index,
+                                   cutoff=cutoff, k_nearest=k_nearest):
+            for i in range(len(path) - 1):
+                # Add the edge with the weight of the shortest parallel road, which the path was measured on
+                u, v = path[i], path[i + 1]
+                add_edge_copy(G, u, v, length=min(data['length'] for data in G[u][v].values()))
+        if instrumentation.is_recording():
+            instrumentation.annotate(odd_nodes_left=len(find_odd_degree_nodes(G)))
+        return eulerize_built_in(G)
 
-    shortest_paths = dict(nx.all_pairs_dijkstra_path(G, weight='length'))
-    path_lengths = dict(nx.all_pairs_dijkstra_path_length(G, weight='length'))
+    if distance_index is None:
+        shortest_paths = dict(nx.all_pairs_dijkstra_path(G, weight='length'))
+        path_lengths = dict(nx.all_pairs_dijkstra_path_length(G, weight='length'))
+        instrumentation.count('shortest_path_searches', 2 * G.number_of_nodes())
 
-    # Create a priority queue of pairs of odd-degree nodes, with distances as priorities
-    pair_queue = [(path_lengths[node_A][node_B], node_A, node_B) for i, node_A in enumerate(odd_degree_nodes) for node_B
-                  in odd_degree_nodes[i + 1:]]
+        # Create a priority queue of pairs of odd-degree nodes, with distances as priorities
+        pair_queue = [(path_lengths[node_A][node_B], node_A, node_B) for i, node_A in enumerate(odd_degree_nodes)
+                      for node_B in odd_degree_nodes[i + 1:]]
+    else:
+        check_distance_index(distance_index, G, 'length')
+        pair_queue = distance_index.pair_lengths(odd_degree_nodes)
     heapq.heapify(pair_queue)
 
     # While there are nodes with odd degree
     while pair_queue:
 
         # Pop the pair with the shortest distance
-        _, node_A, node_B = heapq.heappop(pair_queue)
+        length, node_A, node_B = heapq.heappop(pair_queue)
 
         if node_A in odd_degree_nodes and node_B in odd_degree_nodes:
 
             # Duplicate all edges in the shortest path between node1 and node2
-            path = shortest_paths[node_A][node_B]
+            path = shortest_paths[node_A][node_B] if distance_index is None else distance_index.path(node_A, node_B)
+            instrumentation.observe('matched_path_length', length)
             for i in range(len(path) - 1):
-                # Add the edge with the same weight as the original
-                G.add_edge(path[i], path[i + 1], length=G[path[i]][path[i + 1]][0]['length'])
-                print(G[path[i]][path[i + 1]])
+                # Add the edge with the weight of the shortest parallel road, which the path was measured on
+                u, v = path[i], path[i + 1]
+                add_edge_copy(G, u, v, length=min(data['length'] for data in G[u][v].values()))
             # Remove node1 and node2 from the list of nodes with odd degree
             odd_degree_nodes.remove(node_A)
             odd_degree_nodes.remove(node_B)
-    odd_degree_nodes = [node for node, degree in G.degree() if degree % 2 == 1]
-    print("odd degree nodes: ", odd_degree_nodes)
-    return nx.eulerize(G)
+    if instrumentation.is_recording():
+        instrumentation.annotate(odd_nodes_left=len(find_odd_degree_nodes(G)))
+    return eulerize_built_in(G)
+
+
+def eulerize_min_cost_flow(old_G, k_nearest=10, distance_index=None):
+    """
+    Eulerizes a road network with one-way roads by solving it as a directed or mixed Chinese Postman problem.
+
+    Roads whose 'oneway' attribute is true can only be driven from their source to their target node, all
+    other roads either way. Instead of pairing up odd-degree nodes, every node has to be left as many times
+    as it is entered. The extra traversals that achieve this come from a min-cost flow on the road network
+    itself, with road length as the cost, so no table of distances between node pairs is ever built.
+
+    If every road is one-way the flow is solved one traversal at a time and the result is optimal. Mixed
+    networks are solved with the heuristic of Edmonds and Johnson: odd-degree nodes are first matched like in
+    eulerize_built_in_weighted(), ignoring direction, which leaves every node's in and out degree differing by
+    an even number. The flow then works in units of two traversals. Sending a unit against the way a two-way
+    road is currently driven reverses one of its traversals at no cost, and any other unit drives a road
+    twice more.
+
+    Parameters:
+    old_G (networkx.MultiDiGraph or networkx.MultiGraph): The input graph, such as the one built by
+        convert_to_graph_road_edges() with formatted_one_way set.
+    k_nearest (int, optional): Number of nearest odd-degree neighbours per odd-degree node when matching
+        them in a mixed network, see eulerize_built_in_weighted(). Default is 10.
+    distance_index (DistanceIndex, optional): An index of old_G measuring 'length', searched instead of
+        old_G when matching odd-degree nodes.
+
+    Returns:
+    networkx.MultiDiGraph: The Eulerized graph. Every edge points the way it is driven and its multiplicity
+    is how many times it is driven that way, so a two-way road driven both ways has an edge in each direction.
+
+    References:
+    - Jack Edmonds and Ellis L. Johnson, "Matching, Euler tours and the Chinese postman", Mathematical
+      Programming 5, pp. 88–124, 1973
+    """
+    check_k_nearest(k_nearest)
+    if old_G.order() == 0:
+        raise nx.NetworkXPointlessConcept("Cannot Eulerize null graph")
+    roads = list(old_G.edges(data=True))
+    one_way = [bool(data.get('oneway', False)) for _, _, data in roads]
+    traversals = [data.get('multiplicity', 1) for _, _, data in roads]
+
+    # the roads ignoring direction, built edge by edge since roads in opposite directions may share a key
+    U = nx.MultiGraph()
+    U.add_nodes_from(old_G)
+    U.add_edges_from((u, v, {'length': data.get('length', 1), 'multiplicity': count, 'road': road})
+                     for road, ((u, v, data), count) in enumerate(zip(roads, traversals)))
+    if not nx.is_connected(U):
+        raise nx.NetworkXError("G is not connected")
+
+    mixed = not all(one_way)
+    if mixed:
+        odd_degree_nodes = find_odd_degree_nodes(U)
+        if odd_degree_nodes:
+            for path in odd_node_paths(U, match_odd_nodes_min_weight, odd_degree_nodes, 'length',
+                                       distance_index, k_nearest=k_nearest):
+                for u, v in pairwise(path):
+                    shortest = min(U[u][v].values(), key=lambda data: data['length'])
+                    traversals[shortest['road']] += 1
+
+    # two-way roads start out driven from source to target, which leaves even imbalances in a mixed network
+    unit = 2 if mixed else 1
+    balance = dict.fromkeys(old_G, 0)
+    for (u, v, _), count in zip(roads, traversals):
+        balance[u] += count
+        balance[v] -= count
+    F = nx.MultiDiGraph()
+    for node, excess in balance.items():
+        F.add_node(node, demand=excess // unit)
+    for road, (u, v, data) in enumerate(roads):
+        if u == v:
+            continue
+        cost = unit * round(data.get('length', 1) * FLOW_COST_SCALE)
+        F.add_edge(u, v, weight=cost, road=road, kind='forward')
+        if not one_way[road]:
+            F.add_edge(v, u, weight=cost, road=road, kind='backward')
+            F.add_edge(v, u, weight=0, capacity=traversals[road], road=road, kind='reverse')
+
+    forward = list(traversals)
+    backward = [0] * len(roads)
+    if any(balance.values()):
+        try:
+            _, flow = nx.network_simplex(F)
+        except nx.NetworkXUnfeasible:
+            raise nx.NetworkXError("G is not strongly connected, some roads cannot be driven in a circuit")
+        for u, targets in flow.items():
+            for v, keyed_flow in targets.items():
+                for key, amount in keyed_flow.items():
+                    if not amount:
+                        continue
+                    arc = F[u][v][key]
+                    if arc['kind'] == 'forward':
+                        forward[arc['road']] += unit * amount
+                    elif arc['kind'] == 'backward':
+                        backward[arc['road']] += unit * amount
+                    else:
+                        forward[arc['road']] -= amount
+                        backward[arc['road']] += amount
+    instrumentation.annotate(flow_arcs=F.number_of_edges())
+
+    G = nx.MultiDiGraph()
+    G.graph.update(old_G.graph)
+    G.add_nodes_from(old_G.nodes(data=True))
+    for (u, v, data), forward_count, backward_count in zip(roads, forward, backward):
+        data = {key: value for key, value in data.items() if key != 'multiplicity'}
+        if forward_count:
+            G.add_edge(u, v, **data, multiplicity=forward_count)
+        if backward_count:
+            G.add_edge(v, u, **data, multiplicity=backward_count)
+    return G
+
+
+def find_odd_degree_nodes(G):
+    """
+    Finds the nodes of odd degree, counting each edge as many times as its multiplicity.
+
+    Parameters:
+    G (networkx.Graph): The input graph.
+
+    Returns:
+    list: The odd-degree nodes.
+    """
+    return [node for node, degree in G.degree(weight='multiplicity') if degree % 2 == 1]
+
+
+def add_edge_copy(G, u, v, **attr):
+    """
+    Adds one more traversal of the road between u and v, as done when eulerizing.
+
+    Instead of a new parallel edge for every copy, the copies are kept on a single unnamed edge whose
+    multiplicity counts them.
+
+    Parameters:
+    G (networkx.MultiGraph): The graph to modify.
+    u, v: The end nodes of the edge.
+    attr: Attributes of the copy, such as its length.
+    """
+    if G.is_multigraph() and G.has_edge(u, v):
+        for data in G[u][v].values():
+            if 'name' not in data and all(data.get(key) == value for key, value in attr.items()):
+                data['multiplicity'] = data.get('multiplicity', 1) + 1
+                return
+    G.add_edge(u, v, multiplicity=1, **attr)
+
+
+def expand_multiplicity(G):
+    """
+    Turns every edge with a multiplicity into that many parallel edges, for methods such as the networkx
+    eulerian_circuit() function and trotter() that don't understand multiplicity.
+
+    Parameters:
+    G (networkx.MultiGraph): The input graph.
+
+    Returns:
+    networkx.MultiGraph: The expanded graph, or G itself if no edge is traversed more than once.
+    """
+    if all(data.get('multiplicity', 1) == 1 for _, _, data in G.edges(data=True)):
+        return G
+    expanded = G.__class__()
+    expanded.graph.update(G.graph)
+    expanded.add_nodes_from(G.nodes(data=True))
+    for u, v, data in G.edges(data=True):
+        copy = {key: value for key, value in data.items() if key != 'multiplicity'}
+        expanded.add_edges_from((u, v, copy) for _ in range(data.get('multiplicity', 1)))
+    return expanded
+
+
+def odd_node_paths(G, match, odd_degree_nodes, weight, distance_index=None, **options):
+    """
+    Pairs up odd-degree nodes with a matching function such as match_odd_nodes_min_weight(), searching either
+    G itself or the adjacency of a DistanceIndex of G, which is faster to search.
+
+    Parameters:
+    G (networkx.Graph): The input graph.
+    match (function): match_odd_nodes_min_weight() or match_odd_nodes_greedily().
+    odd_degree_nodes (list): The nodes to pair up.
+    weight (str, optional): Edge attribute used as length, None counts every edge as 1.
+    distance_index (DistanceIndex, optional): An index of G measuring the same weight.
+    options: Extra keyword arguments for match, such as k_nearest.
+
+    Returns:
+    iterable: The shortest path between each matched pair.
+    """
+    if distance_index is None:
+        return match(weighted_neighbors(G, weight), odd_degree_nodes, **options)
+    check_distance_index(distance_index, G, weight)
+    paths = match(distance_index.neighbors(), distance_index.ids_of(odd_degree_nodes), **options)
+    return (distance_index.labels_of(path) for path in paths)
+
+
+def check_distance_index(distance_index, G, weight):
+    """
+    Makes sure a DistanceIndex was built for G's nodes and measures distance the way an eulerization method
+    does, raising a ValueError otherwise.
+
+    Parameters:
+    distance_index (DistanceIndex): The index.
+    G (networkx.Graph): The graph being eulerized.
+    weight (str, optional): Edge attribute the method uses as length, None if it counts edges.
+    """
+    if distance_index.weight != weight:
+        def describe(weight):
+            return "edges" if weight is None else f"'{weight}'"
+        raise ValueError(f"The distance index measures {describe(distance_index.weight)} but this method "
+                         f"measures {describe(weight)}")
+    if distance_index.number_of_nodes != G.number_of_nodes() or \
+            not all(node in G for node in distance_index.labels):
+        raise ValueError("The distance index was built for a different road graph")
+
+
+def weighted_neighbors(G, weight='length'):
+    """
+    Wraps a networkx graph into the neighbors function used by shortest_path_trees().
+
+    Parameters:
+    G (networkx.Graph): The input graph. Parallel edges count with their shortest length.
+    weight (str, optional): Edge attribute used as length, edges without it count as 1.
+        None counts every edge as 1. Default is 'length'.
+
+    Returns:
+    function: Maps a node to an iterable of (neighbor, edge length) pairs.
+    """
+    multigraph = G.is_multigraph()
+
+    def edge_length(edge_data):
+        if weight is None:
+            return 1
+        if multigraph:
+            return min(data.get(weight, 1) for data in edge_data.values())
+        return edge_data.get(weight, 1)
+
+    def neighbors(node):
+        return ((neighbor, edge_length(edge_data)) for neighbor, edge_data in G[node].items())
+
+    return neighbors
+
+
+def shortest_path_trees(neighbors, sources, targets=None, cutoff=None, k_nearest=None):
+    """
+    Runs Dijkstra only from the given odd-degree nodes, stopping each search at a distance cutoff or once the
+    k nearest target nodes have been reached. Works on any graph representation.
+
+    Instead of every path between every pair of nodes, only the distance of each (source, target) pair and
+    the predecessor tree of each search are kept; rebuild_path() turns a tree into a path when it is needed.
+
+    Parameters:
+    neighbors (function): Maps a node to an iterable of (neighbor, edge length) pairs.
+    sources (list): The nodes to search from.
+    targets (collection, optional): The nodes to look for. Defaults to sources.
+    cutoff (float, optional): Stop each search at this distance.
+    k_nearest (int, optional): Stop each search after reaching this many targets.
+
+    Returns:
+    tuple: (pair_lengths, trees) where pair_lengths is a list of (length, source, target) tuples with each
+    unordered pair listed once, and trees maps every source to the predecessor dict of its search.
+    """
+    targets = set(sources) if targets is None else set(targets)
+    pair_lengths = []
+    seen_pairs = set()
+    trees = {}
+    for source in sources:
+        distances = {}
+        predecessors = {source: None}
+        found = 0
+        queue = [(0, 0, source)]
+        counter = 1  # breaks ties between equal distances without comparing nodes
+        while queue:
+            distance, _, node = heapq.heappop(queue)
+            if node in distances:
+                continue
+            if cutoff is not None and distance > cutoff:
+                break
+            distances[node] = distance
+            if node != source and node in targets:
+                pair = frozenset((source, node))
+                if pair not in seen_pairs:
+                    seen_pairs.add(pair)
+                    pair_lengths.append((distance, source, node))
+                found += 1
+                if k_nearest is not None and found >= k_nearest:
+                    break
+            for neighbor, length in neighbors(node):
+                if neighbor in distances:
+                    continue
+                new_distance = distance + length
+                known = predecessors.get(neighbor)
+                if neighbor not in predecessors or new_distance < known[1]:
+                    predecessors[neighbor] = (node, new_distance)
+                    heapq.heappush(queue, (new_distance, counter, neighbor))
+                    counter += 1
+        trees[source] = {node: predecessors[node] for node in distances}
+        instrumentation.count('shortest_path_searches')
+        instrumentation.count('settled_nodes', len(distances))
+    return pair_lengths, trees
+
+
+def rebuild_path(tree, target):
+    """
+    Rebuilds the shortest path to target from a predecessor tree returned by shortest_path_trees().
+
+    Parameters:
+    tree (dict): Maps each reached node to (previous node, distance), and the source to None.
+    target: The node to rebuild the path to.
+
+    Returns:
+    list: The nodes of the path, from the source of the tree to target.
+    """
+    path = [target]
+    step = tree[target]
+    while step is not None:
+        path.append(step[0])
+        step = tree[step[0]]
+    path.reverse()
+    return path
+
+
+def match_odd_nodes_greedily(neighbors, odd_degree_nodes, cutoff=None, k_nearest=None):
+    """
+    Pairs up odd-degree nodes by repeatedly matching the closest remaining pair, like
+    eulerize_minimize_weights_dijkistra() does, but with shortest paths searched only from odd-degree nodes.
+
+    Nodes left without a partner because of cutoff or k_nearest are searched for again among themselves;
+    once a round matches nothing the limits are dropped so that every node gets paired.
+
+    Parameters:
+    neighbors (function): Maps a node to its (neighbor, edge length) pairs, see weighted_neighbors().
+    odd_degree_nodes (list): The nodes to pair up.
+    cutoff (float, optional): Only pair nodes at most this far apart in the first rounds.
+    k_nearest (int, optional): Only consider the k nearest odd-degree neighbours in the first rounds.
+
+    Yields:
+    list: The shortest path between each matched pair, rebuilt only once the pair is matched.
+    """
+    remaining = list(odd_degree_nodes)
+    while len(remaining) > 1:
+        pair_lengths, trees = shortest_path_trees(neighbors, remaining, cutoff=cutoff, k_nearest=k_nearest)
+        # Create a priority queue of pairs of odd-degree nodes, with distances as priorities
+        pair_queue = [(length, node_A, node_B) for length, node_A, node_B in pair_lengths]
+        heapq.heapify(pair_queue)
+        unmatched = set(remaining)
+        while pair_queue:
+            # Pop the pair with the shortest distance
+            length, node_A, node_B = heapq.heappop(pair_queue)
+            if node_A in unmatched and node_B in unmatched:
+                unmatched.remove(node_A)
+                unmatched.remove(node_B)
+                instrumentation.observe('matched_path_length', length)
+                yield rebuild_path(trees[node_A], node_B)
+        if len(unmatched) == len(remaining):
+            if cutoff is None and k_nearest is None:
+                # the rest cannot reach each other, eulerize_built_in() reports that
+                return
+            cutoff = k_nearest = None
+        remaining = [node for node in remaining if node in unmatched]
+
+
+def check_k_nearest(k_nearest):
+    """
+    Raises a ValueError unless k_nearest is None or at least 1, since doubling a smaller value never reaches
+    a candidate graph with a perfect matching.
+    """
+    if k_nearest is not None and k_nearest < 1:
+        raise ValueError(f"k_nearest must be None or at least 1, got {k_nearest}")
+
+
+def match_odd_nodes_min_weight(neighbors, odd_degree_nodes, k_nearest=10, exact=False):
+    """
+    Finds a minimum-weight perfect matching of the odd-degree nodes by network distance.
+
+    The matching is solved on a sparse candidate graph that links each odd-degree node to its k_nearest
+    nearest odd-degree neighbours. When that graph has no perfect matching, k_nearest is doubled until it
+    does, ending with the complete graph of odd-degree nodes. The result is then the best matching on the
+    candidate graph, which is not always the best one on the complete graph unless exact is set.
+
+    Parameters:
+    neighbors (function): Maps a node to its (neighbor, edge length) pairs, see weighted_neighbors().
+        The graph must be connected.
+    odd_degree_nodes (list): The nodes to match, an even number of them.
+    k_nearest (int, optional): Starting number of candidate neighbours per node, None for all of them.
+    exact (bool, optional): Check the matching against the pairs left out of the candidate graph with
+        certify_min_weight_matching(), so it is a minimum-weight perfect matching of the complete graph.
+
+    Returns:
+    list: The shortest path between each matched pair.
+    """
+    check_k_nearest(k_nearest)
+    while True:
+        if k_nearest is None or k_nearest >= len(odd_degree_nodes) - 1:
+            # every other node is a candidate, and each search still stops once it has reached them all
+            k_nearest = len(odd_degree_nodes) - 1
+        pair_lengths, trees = shortest_path_trees(neighbors, odd_degree_nodes, k_nearest=k_nearest)
+
+        # store the search each pair was found in so its path can be rebuilt after matching
+        Gp = nx.Graph()
+        Gp.add_nodes_from(odd_degree_nodes)
+        for length, node_A, node_B in pair_lengths:
+            Gp.add_edge(node_A, node_B, weight=length, source=node_A)
+        best_matching = nx.min_weight_matching(Gp)
+        if 2 * len(best_matching) == len(odd_degree_nodes):
+            break
+        if k_nearest == len(odd_degree_nodes) - 1:
+            raise nx.NetworkXError("Odd-degree nodes cannot be perfectly matched")
+        k_nearest *= 2
+    if exact and k_nearest < len(odd_degree_nodes) - 1:
+        best_matching = certify_min_weight_matching(neighbors, odd_degree_nodes, Gp, trees, best_matching)
+
+    paths = []
+    for node_A, node_B in best_matching:
+        source = Gp[node_A][node_B]["source"]
+        target = node_B if source == node_A else node_A
+        instrumentation.observe('matched_path_length', Gp[node_A][node_B]["weight"])
+        paths.append(rebuild_path(trees[source], target))
+    return paths
+
+
+def certify_min_weight_matching(neighbors, odd_degree_nodes, Gp, trees, matching, cut_rounds=20):
+    """
+    Proves that a perfect matching found on a sparse candidate graph is a minimum-weight perfect matching of
+    the complete graph of odd-degree nodes, or finds one that is.
+
+    The dual of the matching linear program, solved on the candidate graph by matching_duals(), gives every
+    pair of nodes a reduced cost, its distance less the dual values it is charged with, and a lower bound on
+    the weight of any perfect matching. Every pair of an optimal matching has a reduced cost no larger than
+    the gap between the matching's weight and that bound, so only pairs that close need checking. They are
+    found with one search per node, bounded by the node's dual values and the gap. If none is missing from
+    the candidate graph the matching is optimal. Otherwise the missing pairs are added and the matching
+    solved again, which is then optimal as well unless a pair was found whose reduced cost is negative, in
+    which case the duals were not valid for the complete graph and the check is repeated with new ones.
+
+    Parameters:
+    neighbors (function): Maps a node to its (neighbor, edge length) pairs, see weighted_neighbors().
+    odd_degree_nodes (list): The nodes being matched.
+    Gp (networkx.Graph): The candidate graph, with the 'weight' of each pair and the 'source' whose tree in
+        trees reaches the other node. Missing pairs are added to it.
+    trees (dict): Shortest-path trees by source, see shortest_path_trees(). Trees of new searches are merged
+        into it.
+    matching (set): A minimum-weight perfect matching of Gp.
+    cut_rounds (int): Rounds of odd-set cuts added to tighten the lower bound, see matching_duals().
+
+    Returns:
+    set: A minimum-weight perfect matching of the complete graph of odd-degree nodes, as (node, node) pairs.
+    """
+    targets = set(odd_degree_nodes)
+    while True:
+        y, cuts, z, lower_bound = matching_duals(Gp, odd_degree_nodes, cut_rounds)
+        upper_bound = sum(Gp[node_A][node_B]['weight'] for node_A, node_B in matching)
+        # the linear program is solved in floating point, so reduced costs are only trusted up to this
+        tolerance = 1e-6 * max(upper_bound, 1e-9)
+        gap = max(upper_bound - lower_bound, 0) + tolerance
+        membership = {node: set() for node in odd_degree_nodes}
+        charged = dict(y)
+        for index, (cut, value) in enumerate(zip(cuts, z)):
+            for node in cut:
+                membership[node].add(index)
+                charged[node] += value
+        instrumentation.count('matching_certificates')
+        instrumentation.observe('matching_gap', gap)
+
+        missing = {}
+        negative = False
+        for source in odd_degree_nodes:
+            # a pair within the gap is reached from whichever end is charged more
+            cutoff = 2 * charged[source] + gap
+            if cutoff < 0:
+                continue
+            pair_lengths, tree = shortest_path_trees(neighbors, [source], targets, cutoff=cutoff)
+            for length, _, target in pair_lengths:
+                if Gp.has_edge(source, target) or length > charged[source] + charged[target] + gap:
+                    continue
+                reduced_cost = length - y[source] - y[target] - sum(
+                    z[index] for index in membership[source] ^ membership[target])
+                if reduced_cost <= gap:
+                    pair = frozenset((source, target))
+                    if pair not in missing:
+                        missing[pair] = (length, source)
+                        trees[source] = {**trees.get(source, {}), **tree[source]}
+                    negative = negative or reduced_cost < -tolerance
+        if not missing:
+            return matching
+        instrumentation.count('matching_pairs_added', len(missing))
+        for pair, (length, source) in missing.items():
+            node_A, node_B = tuple(pair)
+            Gp.add_edge(node_A, node_B, weight=length, source=source)
+        matching = nx.min_weight_matching(Gp)
+        if not negative:
+            return matching
+
+
+def matching_duals(Gp, odd_degree_nodes, cut_rounds=20):
+    """
+    Solves the linear program of a minimum-weight perfect matching on a candidate graph and returns its
+    dual, for certify_min_weight_matching().
+
+    The program starts with one degree constraint per node. Its solutions may then pair nodes up in halves
+    around odd cycles, and the node set of every such cycle gets an odd-set cut, requiring at least one
+    matched pair to leave it, for up to cut_rounds rounds. The cuts bring the lower bound close to, and
+    usually onto, the weight of the optimal matching.
+
+    Parameters:
+    Gp (networkx.Graph): The candidate graph, with the length of each pair as 'weight'.
+    odd_degree_nodes (list): The nodes being matched.
+    cut_rounds (int): Most rounds of cuts to add.
+
+    Returns:
+    tuple: The dual value of each node as a dict, the cuts as sets of nodes, the dual value of each cut
+    and the lower bound these give on the weight of any perfect matching of the complete graph.
+    """
+    # only certifying sparse matchings needs scipy
+    from scipy.optimize import linprog
+    from scipy.sparse import csr_matrix
+
+    ids = {node: i for i, node in enumerate(odd_degree_nodes)}
+    pairs = list(Gp.edges(data='weight'))
+    ends = np.array([(ids[node_A], ids[node_B]) for node_A, node_B, _ in pairs], dtype=np.int64).reshape(-1, 2)
+    weights = np.array([weight for _, _, weight in pairs], dtype=np.float64)
+    # lengths are scaled to around 1 so the solver's tolerances mean the same on every graph
+    scale = weights.mean() if len(weights) and weights.mean() > 0 else 1.0
+    columns = np.arange(len(pairs))
+    degree = csr_matrix((np.ones(2 * len(pairs)), (ends.T.ravel(), np.r_[columns, columns])),
+                        shape=(len(odd_degree_nodes), len(pairs)))
+    cuts = []
+    crossings = []
+    for cut_round in range(cut_rounds + 1):
+        A_ub = b_ub = None
+        if crossings:
+            # at least one matched pair leaves every cut: -x(crossing) <= -1
+            A_ub = csr_matrix((-np.ones(sum(map(len, crossings))),
+                               (np.repeat(np.arange(len(crossings)), list(map(len, crossings))),
+                                np.concatenate(crossings))), shape=(len(crossings), len(pairs)))
+            b_ub = -np.ones(len(crossings))
+        result = linprog(weights / scale, A_ub=A_ub, b_ub=b_ub, A_eq=degree, b_eq=np.ones(len(odd_degree_nodes)),
+                         bounds=(0, None), method='highs')
+        if result.status != 0:
+            raise nx.NetworkXError(f"Matching duals could not be found: {result.message}")
+        new_cuts = odd_set_cuts(result.x, ends, len(odd_degree_nodes)) if cut_round < cut_rounds else []
+        if not new_cuts:
+            break
+        for cut in new_cuts:
+            inside = np.zeros(len(odd_degree_nodes), dtype=bool)
+            inside[cut] = True
+            cuts.append(cut)
+            crossings.append(np.flatnonzero(inside[ends[:, 0]] != inside[ends[:, 1]]))
+
+    y = result.eqlin.marginals * scale
+    # the solver's dual values can come out a hair below zero
+    z = np.maximum(-result.ineqlin.marginals * scale, 0) if crossings else np.zeros(0)
+    lower_bound = float(y.sum() + z.sum())
+    return ({node: float(y[i]) for node, i in ids.items()},
+            [{odd_degree_nodes[i] for i in cut} for cut in cuts], z.tolist(), lower_bound)
+
+
+def odd_set_cuts(x, ends, node_count, tolerance=1e-6):
+    """
+    Finds the odd sets of nodes that a fractional matching pairs up only among themselves, for
+    matching_duals().
+
+    Parameters:
+    x (numpy.ndarray): How much of each pair the fractional matching uses.
+    ends (numpy.ndarray): The two node ids of each pair.
+    node_count (int): The number of nodes.
+    tolerance (float): Values this close to 0 or 1 count as whole.
+
+    Returns:
+    list: Node id arrays of the odd sets with less than one matched pair leaving them.
+    """
+    # only certifying sparse matchings needs scipy
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    fractional = (x > tolerance) & (x < 1 - tolerance)
+    if not fractional.any():
+        return []
+    support = ends[fractional]
+    graph = csr_matrix((np.ones(len(support)), (support[:, 0], support[:, 1])), shape=(node_count, node_count))
+    _, labels = connected_components(graph, directed=False)
+    touched = np.zeros(node_count, dtype=bool)
+    touched[support.ravel()] = True
+    cuts = []
+    for label in np.unique(labels[touched]):
+        cut = np.flatnonzero(labels == label)
+        if len(cut) % 2 == 0:
+            continue
+        inside = labels == label
+        leaving = x[inside[ends[:, 0]] != inside[ends[:, 1]]].sum()
+        if leaving < 1 - tolerance:
+            cuts.append(cut)
+    return cuts
 
 
 def calculate_distance_raw(lon1, lat1, lon2, lat2, in_init_length_unit="miles"):
@@ -240,13 +1117,52 @@ def calculate_distance_raw(lon1, lat1, lon2, lat2, in_init_length_unit="miles"):
     float: The calculated distance between the two points.
 
     """
-    geod = Geod(ellps='WGS84')
-    _, _, distance = geod.inv(lon1, lat1, lon2, lat2)
+    _, _, distance = WGS84_GEOD.inv(lon1, lat1, lon2, lat2)
     if in_init_length_unit == "kilometers":
         return distance / 1000
     return distance / 1609.344
 
 
+def calculate_distances_raw(lons1, lats1, lons2, lats2, in_init_length_unit="miles"):
+    """
+    Vectorized version of calculate_distance_raw() that measures many point pairs in a single Geod.inv call.
+
+    Parameters:
+    lons1 (array-like): The longitudes of the first points.
+    lats1 (array-like): The latitudes of the first points.
+    lons2 (array-like): The longitudes of the second points.
+    lats2 (array-like): The latitudes of the second points.
+    in_init_length_unit (str, optional): The unit of length for the calculated distances. Default is "miles".
+
+    Returns:
+    numpy.ndarray: The calculated distances, in the same order as the input points.
+    """
+    lons1, lats1, lons2, lats2 = (np.asarray(a, dtype=np.float64) for a in (lons1, lats1, lons2, lats2))
+    if lons1.size == 0:
+        return np.zeros(0, dtype=np.float64)
+    _, _, distances = WGS84_GEOD.inv(lons1, lats1, lons2, lats2)
+    distances = np.asarray(distances, dtype=np.float64)
+    if in_init_length_unit == "kilometers":
+        return distances / 1000
+    return distances / 1609.344
+
+
+def parse_node(node):
+    """
+    Turns a node label into a coordinate tuple. Labels read back from GraphML are strings such as
+    "(-84.1, 34.2, 0.0)"; tuple labels are returned unchanged.
+
+    Parameters:
+    node (str or tuple): The node label.
+
+    Returns:
+    tuple: The node's coordinates.
+    """
+    if isinstance(node, tuple):
+        return node
+    return tuple(float(value) for value in node.strip("()").split(","))
+
+
 def calculate_distance(source, target, init_length_unit="miles"):
     """
     Calculate the distance between two points.
@@ -304,4 +1220,121 @@ def trotter(G):
             current_node = current_path.pop()
 
     euler_circuit_edge_list = list(pairwise(total_circuit))
-    return euler_circuit_edge_list
\ No newline at end of file
+    return euler_circuit_edge_list
+
+
+def hierholzer(G, keys=False):
+    """
+    Hierholzer's algorithm for finding an Euler circuit in linear time, following trotter()'s rule of always
+    moving to the lowest numbered neighbor.
+
+    Parameters:
+    G (networkx.Graph): The input graph.
+    keys (bool): Return (source, target, key) edges of a multigraph instead of (source, target).
+
+    Returns:
+    list: A list containing the edges of the Euler circuit.
+    """
+    return list(iter_hierholzer(G, keys=keys))
+
+
+def iter_hierholzer(G, keys=False):
+    """
+    Yields the edges of the Euler circuit found by hierholzer() while the circuit is still being ordered.
+
+    Every node keeps a sorted adjacency list with a cursor, so choosing the lowest unused neighbor and
+    removing an edge are constant time and the graph is never copied. Edges are traversed as many times as
+    their multiplicity. The circuit is kept as an array backed stack; its bottom entries are final as soon
+    as their nodes have no unused edges left, so those edges are yielded right away and only the rest waits
+    until ordering finishes.
+
+    Parameters:
+    G (networkx.Graph): The input graph, directed or undirected, which must be Eulerian.
+    keys (bool): Yield (source, target, key) edges of a multigraph instead of (source, target).
+
+    Yields:
+    tuple: (source, target) for each edge of the circuit, in order.
+    """
+    directed = G.is_directed()
+    if directed:
+        if any(G.in_degree(node, weight='multiplicity') != G.out_degree(node, weight='multiplicity')
+               for node in G):
+            raise nx.NetworkXError("G is not Eulerian.")
+    elif find_odd_degree_nodes(G):
+        raise nx.NetworkXError("G is not Eulerian.")
+
+    # adjacency[node] lists (neighbor, edge id) pairs sorted so the lowest neighbor comes first
+    adjacency = {node: [] for node in G}
+    edge_keys = []
+    traversals = []
+    edges = G.edges(keys=True, data='multiplicity', default=1) if G.is_multigraph() \
+        else ((u, v, None, count) for u, v, count in G.edges(data='multiplicity', default=1))
+    for u, v, key, count in edges:
+        adjacency[u].append((v, len(edge_keys)))
+        if u != v and not directed:
+            adjacency[v].append((u, len(edge_keys)))
+        edge_keys.append(key)
+        traversals.append(count)
+    for neighbors in adjacency.values():
+        neighbors.sort()
+    if not edge_keys:
+        return
+
+    # choose the first node in the graph that has an edge
+    start = next(node for node in G if adjacency[node])
+    previous = None
+    for node, edge in euler_circuit_nodes(start, adjacency, traversals):
+        if edge is not None:
+            yield (previous, node, edge_keys[edge]) if keys else (previous, node)
+        previous = node
+
+
+def euler_circuit_nodes(start, adjacency, remaining):
+    """
+    The Hierholzer walk behind iter_hierholzer(), working on any graph representation.
+
+    Parameters:
+    start: The node the circuit starts and ends at.
+    adjacency (dict or list): Maps each node to its (neighbor, edge id) pairs, sorted so the preferred
+        neighbor comes first. Undirected edges are listed under both of their end nodes.
+    remaining (bytearray or list): How many more times each edge id has to be traversed. Updated in place.
+
+    Yields:
+    tuple: (node, edge id) for each node of the circuit in order, where the edge id is the edge used to get
+    to the node from the previous one, None for the start.
+    """
+    cursors = {}
+    to_traverse = sum(remaining)
+
+    def exhausted(node):
+        neighbors = adjacency[node]
+        cursor = cursors.get(node, 0)
+        while cursor < len(neighbors) and not remaining[neighbors[cursor][1]]:
+            cursor += 1
+        cursors[node] = cursor
+        return cursor == len(neighbors)
+
+    stack = [(start, None)]
+    finished = []  # entries popped from the top of the stack, in reverse circuit order
+    bottom = 0  # stack[:bottom] has already been yielded
+    traversed = 0
+    while True:
+        node = stack[-1][0]
+        if not exhausted(node):
+            next_node, edge = adjacency[node][cursors[node]]
+            remaining[edge] -= 1
+            stack.append((next_node, edge))
+            traversed += 1
+            # the bottom of the stack can't get sub-circuits spliced in once its node has no edges left
+            while bottom + 1 < len(stack) and exhausted(stack[bottom][0]):
+                yield stack[bottom]
+                bottom += 1
+        elif len(stack) > bottom + 1:
+            finished.append(stack.pop())
+        else:
+            break
+    if traversed != to_traverse:
+        raise nx.NetworkXError("G is not connected.")
+
+    yield stack[bottom]
+    yield from reversed(finished)
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import networkx as nx
+import numpy as np
+import instrumentation
+from road_graph import RoadGraph, circuit_to_networkx
+
+CACHE_FORMAT_VERSION = 1
+
+
+def file_digest(path):
+    """
+    Hashes a file's contents.
+
+    Parameters:
+    - path (str): The file to hash.
+
+    Returns:
+    - str: The hex SHA-256 digest of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(input_digest, **parameters):
+    """
+    Combines the input file hash and the parameters that shaped a result into a cache key.
+
+    Parameters:
+    - input_digest (str): Hash of the input GeoJSON, see file_digest().
+    - parameters: The conversion and eulerization parameters.
+
+    Returns:
+    - str: The hex SHA-256 cache key.
+    """
+    payload = json.dumps({'version': CACHE_FORMAT_VERSION, 'input': input_digest, 'parameters': parameters},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def cached_euler_circuit(geojson_file,
+                         cache_dir='.graph_cache',
+                         formatted_road_name='FullStName',
+                         formatted_road_type='MapClass',
+                         has_properties=True,
+                         length_unit="Miles",
+                         euler_form_method="built_in_weighted",
+                         euler_form_options=None,
+                         graphml_dest=None,
+                         eulerized_dest=None,
+                         circuit_dest=None):
+    """
+    Converts, eulerizes and orders a GeoJSON road layer like convert_to_graph_road_edges() followed by
+    modify_graph(), storing every stage in a binary cache so unchanged inputs load without recomputing.
+
+    Each stage is cached under a key built from the hash of the GeoJSON file and the parameters that stage
+    depends on: the converted graph under the conversion parameters, the eulerized graph additionally under
+    the eulerization method and options, and the circuit under the eulerized graph's key. Stages are stored
+    as uncompressed .npz files (see RoadGraph.save()). GraphML is only written when a destination is given.
+
+    Parameters:
+    - geojson_file (str): The path to the GeoJSON file.
+    - cache_dir (str): Directory holding the cache files (default: '.graph_cache').
+    - formatted_road_name, formatted_road_type, has_properties, length_unit:
+      Passed to the conversion, see convert_to_graph_road_edges().
+    - euler_form_method (str): "built_in_weighted", "dijkstra", "min_weights" or "built_in",
+      see road_graph.eulerize_road_graph().
+    - euler_form_options (dict): Extra keyword arguments for eulerize_road_graph(), e.g. {"k_nearest": 20}.
+      A "distance_index" may be given as a DistanceIndex or the path of one saved to disk; it only speeds up
+      the searches, so it is not part of the cache key.
+    - graphml_dest (str): Write the converted graph to this GraphML file (default: None).
+    - eulerized_dest (str): Write the eulerized graph to this GraphML file (default: None).
+    - circuit_dest (str): Write the ordered circuit to this GraphML file, in the format modify_graph() writes
+      and convert_to_geojson() reads (default: None).
+
+    Returns:
+    - tuple: (road_graph, euler_graph, nodes, edges) where the graphs are RoadGraphs and nodes/edges describe
+      the circuit as returned by road_graph.road_graph_circuit().
+    """
+    euler_form_options = euler_form_options or {}
+    os.makedirs(cache_dir, exist_ok=True)
+    input_digest = file_digest(geojson_file)
+    conversion_key = cache_key(input_digest,
+                               formatted_road_name=formatted_road_name,
+                               formatted_road_type=formatted_road_type,
+                               has_properties=has_properties,
+                               length_unit=length_unit)
+    euler_key = cache_key(conversion_key, euler_form_method=euler_form_method,
+                          **{key: value for key, value in euler_form_options.items() if key != 'distance_index'})
+
+    graph_path = os.path.join(cache_dir, conversion_key + '.graph.npz')
+    with instrumentation.stage('ingest', source=geojson_file, cache_hit=os.path.exists(graph_path)):
+        if os.path.exists(graph_path):
+            road_graph = RoadGraph.load(graph_path)
+        else:
+            # a cache hit never reads the GeoJSON, so geopandas is only loaded on a miss
+            import geopandas as gpd
+            from conversions import build_road_edges_graph
+            G = build_road_edges_graph(gpd.read_file(geojson_file),
+                                       formatted_road_name=formatted_road_name,
+                                       formatted_road_type=formatted_road_type,
+                                       has_properties=has_properties,
+                                       length_unit=length_unit)
+            road_graph = RoadGraph.from_networkx(G)
+            _save_atomically(road_graph.save, graph_path)
+        instrumentation.annotate(nodes=road_graph.number_of_nodes, edges=road_graph.number_of_edges)
+
+    euler_path = os.path.join(cache_dir, euler_key + '.eulerized.npz')
+    with instrumentation.stage('eulerize', method=euler_form_method, cache_hit=os.path.exists(euler_path)):
+        if os.path.exists(euler_path):
+            euler_graph = RoadGraph.load(euler_path)
+        else:
+            if isinstance(euler_form_options.get('distance_index'), str):
+                from distance_index import DistanceIndex
+                euler_form_options = dict(euler_form_options,
+                                          distance_index=DistanceIndex.load(euler_form_options['distance_index']))
+            euler_graph = road_graph.eulerize(method=euler_form_method, **euler_form_options)
+            _save_atomically(euler_graph.save, euler_path)
+
+    circuit_path = os.path.join(cache_dir, euler_key + '.circuit.npz')
+    with instrumentation.stage('order', method="hierholzer", cache_hit=os.path.exists(circuit_path)):
+        if os.path.exists(circuit_path):
+            with np.load(circuit_path) as arrays:
+                nodes, edges = arrays['nodes'], arrays['edges']
+        else:
+            nodes, edges = euler_graph.euler_circuit()
+            _save_atomically(lambda path: np.savez(path, nodes=nodes, edges=edges), circuit_path)
+        instrumentation.annotate(circuit_edges=len(edges))
+
+    with instrumentation.stage('export'):
+        if graphml_dest is not None:
+            nx.write_graphml(road_graph.to_networkx(), graphml_dest)
+        if eulerized_dest is not None:
+            nx.write_graphml(euler_graph.to_networkx(), eulerized_dest)
+        if circuit_dest is not None:
+            nx.write_graphml(circuit_to_networkx(euler_graph, nodes, edges), circuit_dest)
+    return road_graph, euler_graph, nodes, edges
+
+
+def _save_atomically(save, path):
+    # write to a temporary name first so concurrent runs never load a half-written cache file
+    temporary_path = '%s.%d.tmp.npz' % (path[:-len('.npz')], os.getpid())
+    save(temporary_path)
+    os.replace(temporary_path, path)
@@ -0,0 +1,164 @@
+import contextlib
+import contextvars
+import json
+import logging
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+_recorder = contextvars.ContextVar('stage_recorder', default=None)
+_current_record = contextvars.ContextVar('stage_record', default=None)
+
+
+class StageRecorder:
+    """
+    Collects one record per pipeline stage (ingest, eulerize, order, annotate, export) with its wall time,
+    optional peak memory and whatever counts the stage reports, such as node, edge and odd-node counts,
+    shortest path searches and matched path lengths.
+
+    Records are dicts that can be serialized to JSON. Besides being kept in records, each one can be logged as
+    a JSON message and written as a line of JSON to a stream.
+
+    Parameters:
+    - log (bool): Log each record through the "instrumentation" logger at INFO level. The record itself is
+      also attached to the log record as its stage_record attribute.
+    - stream (file, optional): Write each record to this text stream as a line of JSON.
+    - trace_memory (bool): Measure each stage's peak memory with tracemalloc, which slows the stages down.
+    """
+
+    def __init__(self, log=False, stream=None, trace_memory=False):
+        self.log = log
+        self.stream = stream
+        self.trace_memory = trace_memory
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+        if self.log or self.stream is not None:
+            message = json.dumps(record, default=str)
+            if self.log:
+                logger.info(message, extra={'stage_record': record})
+            if self.stream is not None:
+                self.stream.write(message + '\n')
+
+    def write_json(self, dest):
+        """
+        Writes every record collected so far to dest as a JSON list.
+        """
+        with open(dest, 'w') as f:
+            json.dump(self.records, f, indent=2, default=str)
+
+
+@contextlib.contextmanager
+def recording(recorder=None, **options):
+    """
+    Turns instrumentation on for the code run inside the with block.
+
+    Parameters:
+    - recorder (StageRecorder, optional): The recorder to collect into. A new one is made from options if
+      none is given.
+    - options: Keyword arguments for a new StageRecorder.
+
+    Yields:
+    - StageRecorder: The recorder.
+    """
+    recorder = recorder or StageRecorder(**options)
+    started_tracing = recorder.trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+        if started_tracing:
+            tracemalloc.stop()
+
+
+def is_recording():
+    """
+    Tells whether a recorder is active, for reports that take work to compute.
+    """
+    return _recorder.get() is not None
+
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    """
+    Records a pipeline stage run inside the with block. Does nothing unless a recorder is active.
+
+    Parameters:
+    - name (str): The stage name.
+    - fields: Values to put in the record straight away, such as the method used.
+
+    Yields:
+    - dict: The stage's record, or None when nothing is recording.
+    """
+    recorder = _recorder.get()
+    if recorder is None:
+        yield None
+        return
+    parent = _current_record.get()
+    record = {'stage': name, **fields}
+    if parent is not None:
+        record['parent'] = parent['stage']
+    trace_memory = recorder.trace_memory and tracemalloc.is_tracing()
+    if trace_memory:
+        start_memory, peak_so_far = tracemalloc.get_traced_memory()
+        if parent is not None:
+            parent['_peak'] = max(parent.get('_peak', 0), peak_so_far)
+        tracemalloc.reset_peak()
+    record['started_at'] = time.time()
+    start = time.perf_counter()
+    token = _current_record.set(record)
+    try:
+        yield record
+    except BaseException as error:
+        record['error'] = f"{type(error).__name__}: {error}"
+        raise
+    finally:
+        _current_record.reset(token)
+        record['wall_time_s'] = time.perf_counter() - start
+        if trace_memory:
+            peak = max(tracemalloc.get_traced_memory()[1], record.pop('_peak', 0))
+            record['peak_memory_mb'] = (peak - start_memory) / 2 ** 20
+            if parent is not None:
+                parent['_peak'] = max(parent.get('_peak', 0), peak)
+        recorder.emit(record)
+
+
+def annotate(**fields):
+    """
+    Adds values, such as node and edge counts, to the record of the current stage.
+    """
+    record = _current_record.get()
+    if record is not None:
+        record.update(fields)
+
+
+def count(name, amount=1):
+    """
+    Adds amount to a counter, such as the number of shortest path searches, in the current stage's record.
+    """
+    record = _current_record.get()
+    if record is not None:
+        record[name] = record.get(name, 0) + amount
+
+
+def observe(name, value):
+    """
+    Adds a value, such as the length of a matched path, to a count/total/min/max summary in the current
+    stage's record.
+    """
+    record = _current_record.get()
+    if record is None:
+        return
+    summary = record.get(name)
+    if summary is None:
+        record[name] = {'count': 1, 'total': value, 'min': value, 'max': value}
+    else:
+        summary['count'] += 1
+        summary['total'] += value
+        summary['min'] = min(summary['min'], value)
+        summary['max'] = max(summary['max'], value)
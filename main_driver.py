@@ -1,104 +1,241 @@
-import conversions
-import contextily as ctx
-import find_euler_path
-import geopandas as gpd
-import matplotlib.pyplot as plt
+import argparse
+import json
 
+# every subcommand imports the modules it needs itself, so a run only pays for the libraries it uses:
+# eulerize and order never load geopandas or matplotlib, and nothing loads contextily
 
-# scroll down past this function
 
-def plot(geojson_file, time_delay=0, arrow_spacing=15):
+def plot(geojson_file, time_delay=0, arrow_spacing=15, dest=None):
     """
     Plots the lines from a GeoJSON file and adds arrows to represent the direction of the lines.
     Supports delay while graphing to better visualize the direction of path
 
+    All lines are drawn in one batch by render.draw_circuit(); with a delay the circuit is revealed in order
+    by render.animate_circuit(). Use those directly to save images or videos without a display.
+
     Parameters:
     - geojson_file (str): The path to the GeoJSON file.
-    - time_delay (float): The delay between each line plot in seconds. Default is 0.
+    - time_delay (float): The delay between each frame of the animation in seconds. Default is 0, which
+      draws the whole circuit at once.
     - arrow_spacing (int): The spacing between arrows. Only every `arrow_spacing` line will have an arrow. Default is 15.
+    - dest (str): Save the plot as an image (or, with a delay, as a video or GIF) here instead of showing it.
 
     Returns:
     None
     """
-    # Load the GeoJSON file
-    gdf = gpd.read_file(geojson_file)
+    import render
+
+    if time_delay > 0:
+        animation = render.animate_circuit(geojson_file, interval=time_delay * 1000, arrow_spacing=arrow_spacing,
+                                           dest=dest)
+    else:
+        render.draw_circuit(geojson_file, arrow_spacing=arrow_spacing, dest=dest)
+    if dest is not None:
+        return
 
-    # Create a new plot
-    fig, ax = plt.subplots()
+    # Show the plot
+    # ctx.add_basemap(ax) with contextily for a street map underneath
+    import matplotlib.pyplot as plt
+    plt.show()
 
-    # Iterate over the GeoDataFrame
-    for i, row in gdf.iterrows():
-        # Get the line's start and end points
-        if row['geometry'].geom_type == 'MultiLineString' or row['geometry'].geom_type == 'MultiPolygon':
-            start = row['geometry'][0].coords[0][:2]
-            end = row['geometry'][-1].coords[-1][:2]
-        else:
-            start = row['geometry'].coords[0][:2]
-            end = row['geometry'].coords[-1][:2]
 
-        # Plot the line
-        ax.plot(*row['geometry'].xy, color='blue')
+def convert(args):
+    """
+    convert: GeoJSON roads to a GraphML road graph, see conversions.convert_to_graph_road_edges().
+    """
+    from conversions import convert_to_graph_road_edges
+
+    convert_to_graph_road_edges(args.geojson_file,
+                                dest=args.dest,
+                                formatted_road_name=args.road_name,
+                                formatted_road_type=args.road_type,
+                                has_properties=not args.no_properties,
+                                length_unit=args.length_unit,
+                                weighted_by_road_type=not args.unweighted,
+                                formatted_one_way=args.one_way,
+                                contract_chains=args.contract_chains,
+                                bbox=args.bbox,
+                                where=args.where,
+                                road_types=args.road_types)
+
+
+def eulerize(args):
+    """
+    eulerize: road graph to Eulerized graph, see find_euler_path.eulerize_graph().
+    """
+    import networkx as nx
+    from find_euler_path import eulerize_graph
 
-        # Add an arrow at the end of the line to represent the direction
-        if i % arrow_spacing == 0 and time_delay == 0:
-            ax.annotate('', xy=end, xytext=start, arrowprops=dict(facecolor='red', edgecolor='red'))
+    G = nx.read_graphml(args.graphml_input, force_multigraph=True)
+    euler_G = eulerize_graph(G, args.method, args.options)
+    nx.write_graphml(euler_G, args.dest)
+    added = euler_G.size(weight='multiplicity') - G.size(weight='multiplicity')
+    print(f"added traversals: {added:g}")
 
-        # fig.canvas.draw()
 
-        # Add a delay
-        if time_delay > 0:
-            plt.pause(time_delay)
+def order(args):
+    """
+    order: Eulerized graph to circuit graph, see find_euler_path.order_circuit() and annotate_circuit().
+    """
+    import networkx as nx
+    from find_euler_path import annotate_circuit, order_circuit
 
-    # Show the plot
-    # ctx.add_basemap(ax)
-    plt.show()
+    euler_G = nx.read_graphml(args.graphml_input, force_multigraph=True)
+    circuit = order_circuit(euler_G, args.method)
+    new_G, total_distance, artificial_edges = annotate_circuit(euler_G, circuit, args.length_unit)
+    nx.write_graphml(new_G, args.dest)
+    if args.index_dest is not None:
+        from circuit_index import CircuitIndex
+        CircuitIndex.from_circuit(euler_G, circuit, args.length_unit).save(args.index_dest)
+    print([total_distance, "artificial edges: " + str(artificial_edges)])
 
 
-"""
-The lines below are the important ones. Here, you can run all the code from the rest
-of the repository.
-
-convert_to_graph_road_edges() converts a GeoJSON file to a NetworkX graph with road edges.
-If you use your own geojson data, and its not from forsyth county ga, you will need to verify
-that the geojson data is in the correct format and enter the appropriate label for road type
-and road name as keyword parameters below. If you are using data that doesn't have names for 
-each road, make sure to set has_properties to False. You can also set weighted_by_road_type 
-to false if you want to minimize the length of the whole path and don't want certain roads to 
-be traversed more times than others. 
-
-- If weighted_by_road_type is True, the multipliers will default to being setup as can be seen
-in "conversions.py". You can modify the find_multiplier() method there according to your
-original data's labeling. 
-
-find_euler_path.modify_graph() takes a graphml file and modifies it to be eulerian. The parameters 
-are defaulted so that it converts the file produced by convert_to_graph_road_edges(). There are three
-options for the method parameter: "built_in" and "min_weights". "built_in" is faster and more practical
-for most applications.
-will produce a shorter eulerian path.
-- this returns a list of three numbers in the from of 
-[(total distance of eulerian path), (total distance of original path), (eulerization distance increase multiplier), (number of artificial edges added)]
-this output is later printed to the console.
-
-- You can change the method to find an euler circuit, although the differences are minimal.
-    - built_in: uses .eulerian_circuit() function from networkX
-    - "trotter": uses algorithm taught in class
-- You can run this program as is, with no modifications to the parameters below, for an example eulerization and output visualized.
-"""
-
-conversions.convert_to_graph_road_edges('forsyth_major_bottom_left_roads.geojson',
-                                        dest='forsyth_major_bottom_left_roads.graphml',
-                                        formatted_road_name='FullStName',  # road name label
-                                        formatted_road_type='RoadPosTyp',  # road type label
-                                        has_properties=True,
-                                        length_unit='miles',
-                                        weighted_by_road_type=True)  # toggle for multiplying busy roads
-
-attributes = find_euler_path.modify_graph(graphml_input='forsyth_major_bottom_left_roads.graphml',
-                                          dest='euler_path_output.graphml',
-                                          euler_form_method="built_in",     # method to produce graph capable of forming euler circuit
-                                          euler_order_method="trotter",    # method to order euler circuit
-                                          length_unit="miles")
-
-conversions.convert_to_geojson('euler_path_output.graphml')
-print(attributes)
-plot('output_geojson.geojson', time_delay=0.00000000000000000001)
+def export(args):
+    """
+    export: circuit graph to GeoJSON, see conversions.convert_to_geojson().
+    """
+    from conversions import convert_to_geojson
+
+    convert_to_geojson(args.graphml_input, dest=args.dest, formatted_road_name=args.road_name,
+                       driver=args.driver, stream=args.stream)
+
+
+def tiles(args):
+    """
+    tiles: circuit GeoJSON to MBTiles vector tiles, see vector_tiles.write_circuit_tiles().
+    """
+    from vector_tiles import write_circuit_tiles
+
+    count = write_circuit_tiles(args.geojson_file, dest=args.dest, min_zoom=args.min_zoom, max_zoom=args.max_zoom,
+                                formatted_road_name=args.road_name)
+    print(f"wrote {count} tiles to {args.dest}")
+
+
+def run_example():
+    """
+    Runs the whole pipeline on the Forsyth County sample data and plots the result.
+
+    convert_to_graph_road_edges() converts a GeoJSON file to a NetworkX graph with road edges.
+    If you use your own geojson data, and its not from forsyth county ga, you will need to verify
+    that the geojson data is in the correct format and enter the appropriate label for road type
+    and road name as keyword parameters below. If you are using data that doesn't have names for
+    each road, make sure to set has_properties to False. You can also set weighted_by_road_type
+    to false if you want to minimize the length of the whole path and don't want certain roads to
+    be traversed more times than others.
+
+    - If weighted_by_road_type is True, the multipliers will default to being setup as can be seen
+    in "conversions.py". You can modify the find_multiplier() method there according to your
+    original data's labeling.
+
+    find_euler_path.modify_graph() takes a graphml file and modifies it to be eulerian. The parameters
+    are defaulted so that it converts the file produced by convert_to_graph_road_edges(). There are three
+    options for the method parameter: "built_in" and "min_weights". "built_in" is faster and more practical
+    for most applications.
+    will produce a shorter eulerian path.
+    - this returns a list of three numbers in the from of
+    [(total distance of eulerian path), (total distance of original path), (eulerization distance increase multiplier), (number of artificial edges added)]
+    this output is later printed to the console.
+
+    - You can change the method to find an euler circuit, although the differences are minimal.
+        - built_in: uses .eulerian_circuit() function from networkX
+        - "trotter": uses algorithm taught in class
+        - "hierholzer": same lowest-neighbor rule as "trotter", but runs in linear time on large circuits
+    - You can run this program as is, with no subcommand, for an example eulerization and output visualized.
+    """
+    import conversions
+    import find_euler_path
+
+    conversions.convert_to_graph_road_edges('forsyth_major_bottom_left_roads.geojson',
+                                            dest='forsyth_major_bottom_left_roads.graphml',
+                                            formatted_road_name='FullStName',  # road name label
+                                            formatted_road_type='RoadPosTyp',  # road type label
+                                            has_properties=True,
+                                            length_unit='miles',
+                                            weighted_by_road_type=True)  # toggle for multiplying busy roads
+
+    attributes = find_euler_path.modify_graph(graphml_input='forsyth_major_bottom_left_roads.graphml',
+                                              dest='euler_path_output.graphml',
+                                              euler_form_method="built_in",     # method to produce graph capable of forming euler circuit
+                                              euler_order_method="trotter",    # method to order euler circuit
+                                              length_unit="miles")
+
+    conversions.convert_to_geojson('euler_path_output.graphml')
+    print(attributes)
+    plot('output_geojson.geojson', time_delay=0.00000000000000000001)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Plan police patrol circuits step by step. Without a subcommand "
+                                                 "the Forsyth County example is run and plotted.")
+    subparsers = parser.add_subparsers(dest='command')
+
+    convert_parser = subparsers.add_parser('convert', help="convert GeoJSON roads to a GraphML road graph")
+    convert_parser.add_argument('geojson_file')
+    convert_parser.add_argument('--dest', default='new_graph.graphml')
+    convert_parser.add_argument('--road-name', default='FullStName', help="road name property")
+    convert_parser.add_argument('--road-type', default='MapClass', help="road type property")
+    convert_parser.add_argument('--no-properties', action='store_true', help="the roads have no name or type")
+    convert_parser.add_argument('--length-unit', default='miles')
+    convert_parser.add_argument('--unweighted', action='store_true', help="do not weight roads by their type")
+    convert_parser.add_argument('--one-way', help="one-way property, makes the graph directed")
+    convert_parser.add_argument('--contract-chains', action='store_true', help="contract chains of degree-2 nodes")
+    convert_parser.add_argument('--bbox', type=float, nargs=4, metavar=('MINX', 'MINY', 'MAXX', 'MAXY'),
+                                help="only keep roads intersecting this box")
+    convert_parser.add_argument('--where', help="only keep features matching this OGR SQL WHERE clause")
+    convert_parser.add_argument('--road-types', nargs='+', help="only keep roads of these types")
+    convert_parser.set_defaults(handler=convert)
+
+    eulerize_parser = subparsers.add_parser('eulerize', help="eulerize a GraphML road graph")
+    eulerize_parser.add_argument('graphml_input')
+    eulerize_parser.add_argument('--dest', default='eulerized_graph.graphml')
+    eulerize_parser.add_argument('--method', default="built_in",
+                                 choices=["built_in", "built_in_weighted", "min_weights", "dijkstra",
+                                          "min_cost_flow"])
+    eulerize_parser.add_argument('--options', type=json.loads, default=None,
+                                 help='extra keyword arguments for the method as JSON, e.g. \'{"k_nearest": 5}\'')
+    eulerize_parser.set_defaults(handler=eulerize)
+
+    order_parser = subparsers.add_parser('order', help="order an Eulerized graph into a circuit")
+    order_parser.add_argument('graphml_input')
+    order_parser.add_argument('--dest', default='euler_path_output.graphml')
+    order_parser.add_argument('--method', default="built_in", choices=["built_in", "trotter", "hierholzer"])
+    order_parser.add_argument('--length-unit', default="miles")
+    order_parser.add_argument('--index-dest', help="also save a CircuitIndex of the circuit here")
+    order_parser.set_defaults(handler=order)
+
+    export_parser = subparsers.add_parser('export', help="write a circuit graph as GeoJSON")
+    export_parser.add_argument('graphml_input')
+    export_parser.add_argument('--dest', default='output_geojson.geojson')
+    export_parser.add_argument('--road-name', default='FullStName', help="property name for the road name")
+    export_parser.add_argument('--driver', default='GeoJSON', choices=['GeoJSON', 'GeoJSONSeq'])
+    export_parser.add_argument('--stream', action='store_true', help="write features to disk chunk by chunk")
+    export_parser.set_defaults(handler=export)
+
+    tiles_parser = subparsers.add_parser('tiles', help="write a circuit GeoJSON file as MBTiles vector tiles")
+    tiles_parser.add_argument('geojson_file')
+    tiles_parser.add_argument('--dest', default='circuit.mbtiles')
+    tiles_parser.add_argument('--min-zoom', type=int, default=10)
+    tiles_parser.add_argument('--max-zoom', type=int, default=16)
+    tiles_parser.add_argument('--road-name', default='FullStName', help="road name column of the circuit")
+    tiles_parser.set_defaults(handler=tiles)
+
+    plot_parser = subparsers.add_parser('plot', help="plot a circuit GeoJSON file")
+    plot_parser.add_argument('geojson_file')
+    plot_parser.add_argument('--delay', type=float, default=0, help="seconds between animation frames")
+    plot_parser.add_argument('--arrow-spacing', type=int, default=15)
+    plot_parser.add_argument('--dest', help="save the plot here instead of showing it")
+    plot_parser.set_defaults(handler=lambda args: plot(args.geojson_file, args.delay, args.arrow_spacing,
+                                                       args.dest))
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command is None:
+        run_example()
+    else:
+        args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import argparse
+import networkx as nx
+import instrumentation
+from find_euler_path import annotate_circuit_edges, eulerize_graph, order_circuit
+
+
+class PatrolPlan:
+    """
+    A patrol circuit kept in memory with the graphs it was planned from, as plan_patrol() returns it.
+
+    Nothing is written to disk unless one of the write methods is called, so any number of plans can be made
+    side by side in the same directory, and the GeoJSON, GraphML and CircuitIndex outputs are all built from
+    the same in-memory circuit instead of from files read back between the stages.
+
+    Attributes:
+    - G (networkx.MultiGraph): The road graph, with its 'total_distance' graph attribute set.
+    - euler_G (networkx.MultiGraph): The Eulerized graph.
+    - circuit (list): The circuit as (source, target) tuples.
+    - edges (list): The circuit edges in the order they are driven, as annotate_circuit_edges() gives them.
+    - total_distance (float): Length of the circuit.
+    - artificial_edges (int): Number of circuit edges that follow no road.
+    - length_unit (str): Unit of length the artificial edges were measured in.
+    """
+
+    def __init__(self, G, euler_G, circuit, edges, total_distance, artificial_edges, length_unit="miles"):
+        self.G = G
+        self.euler_G = euler_G
+        self.circuit = circuit
+        self.edges = edges
+        self.total_distance = total_distance
+        self.artificial_edges = artificial_edges
+        self.length_unit = length_unit
+
+    @property
+    def original_distance(self):
+        return self.G.graph['total_distance']
+
+    def attributes(self):
+        """
+        Returns [total distance, original distance, multiplier, "artificial edges: n"] like modify_graph().
+        """
+        return [self.total_distance, self.original_distance, self.total_distance / self.original_distance,
+                "artificial edges: " + str(self.artificial_edges)]
+
+    def circuit_graph(self):
+        """
+        Builds the circuit graph modify_graph() writes, one edge per circuit edge.
+        """
+        circuit_G = nx.MultiDiGraph()
+        circuit_G.add_edges_from(self.edges)
+        return circuit_G
+
+    def geodataframe(self, formatted_road_name='FullStName'):
+        """
+        Builds the circuit GeoDataFrame convert_to_geojson() writes, in circuit order. It can be handed
+        straight to render.draw_circuit() or render.animate_circuit().
+        """
+        # planning works on graphs alone, geopandas is only loaded to build the GeoDataFrame
+        from conversions import circuit_geodataframe
+        return circuit_geodataframe(self.edges, formatted_road_name=formatted_road_name)
+
+    def circuit_index(self, speeds=None, default_speed=None):
+        """
+        Builds the CircuitIndex of the circuit, see CircuitIndex.from_edges().
+        """
+        from circuit_index import CircuitIndex
+        return CircuitIndex.from_edges(self.edges, speeds=speeds, default_speed=default_speed)
+
+    def write(self, geojson_dest=None, circuit_dest=None, eulerized_dest=None, graph_dest=None,
+              index_dest=None, formatted_road_name='FullStName', driver='GeoJSON', stream=False,
+              chunk_size=50000, speeds=None, tiles_dest=None):
+        """
+        Writes the requested outputs. Outputs whose path is None are skipped.
+
+        Parameters:
+        - geojson_dest (str): Path for the circuit as GeoJSON, as convert_to_geojson() writes it.
+        - circuit_dest (str): Path for the circuit graph as GraphML, as modify_graph() writes it.
+        - eulerized_dest (str): Path for the Eulerized graph as GraphML.
+        - graph_dest (str): Path for the road graph as GraphML, as convert_to_graph_road_edges() writes it.
+        - index_dest (str): Path for the CircuitIndex of the circuit.
+        - formatted_road_name (str): Property name for the road name in the GeoJSON output.
+        - driver (str): "GeoJSON" or "GeoJSONSeq", see convert_to_geojson().
+        - stream (bool): Stream the GeoJSON features to disk chunk by chunk, see convert_to_geojson().
+        - chunk_size (int): Number of edges handled per chunk when streaming.
+        - speeds (dict): Speed per road type for the travel times in the CircuitIndex.
+        - tiles_dest (str): Path for the circuit as MBTiles vector tiles, see vector_tiles.write_circuit_tiles().
+
+        Returns:
+        - None
+        """
+        for dest, graph in ((graph_dest, self.G), (eulerized_dest, self.euler_G)):
+            if dest is not None:
+                with instrumentation.stage('export', dest=dest):
+                    nx.write_graphml(graph, dest)
+        if circuit_dest is not None:
+            with instrumentation.stage('export', dest=circuit_dest):
+                nx.write_graphml(self.circuit_graph(), circuit_dest)
+        if index_dest is not None:
+            with instrumentation.stage('export', dest=index_dest):
+                self.circuit_index(speeds=speeds).save(index_dest)
+        if geojson_dest is not None:
+            from conversions import write_circuit
+            with instrumentation.stage('export', dest=geojson_dest, driver=driver):
+                instrumentation.annotate(edges=len(self.edges))
+                write_circuit(self.edges, geojson_dest, formatted_road_name=formatted_road_name, driver=driver,
+                              stream=stream, chunk_size=chunk_size)
+        if tiles_dest is not None:
+            from vector_tiles import write_circuit_tiles
+            write_circuit_tiles(self.geodataframe(formatted_road_name), tiles_dest,
+                                formatted_road_name=formatted_road_name)
+
+
+def plan_patrol(source,
+                euler_form_method="built_in",
+                euler_order_method="built_in",
+                length_unit="miles",
+                euler_form_options=None,
+                **conversion_options):
+    """
+    Runs the whole pipeline, ingest, eulerize, order and annotate, in memory, passing the graphs and the
+    circuit straight from one stage to the next.
+
+    This is modify_graph() between convert_to_graph_road_edges() and convert_to_geojson() without the
+    GraphML files they hand each other: nothing is written until PatrolPlan.write() is called.
+
+    Parameters:
+    - source (str or networkx.MultiGraph): The roads, as a road graph, a GraphML file written by
+      convert_to_graph_road_edges() (ending in ".graphml") or a GeoJSON file to convert. Nodes are
+      labelled with str() like GraphML labels them, copying a given graph whose labels are not strings.
+    - euler_form_method (str): Eulerization method, as in modify_graph().
+    - euler_order_method (str): Circuit ordering method, as in modify_graph().
+    - length_unit (str): Unit of length for measuring artificial edges.
+    - euler_form_options (dict): Extra keyword arguments for the eulerization method.
+    - **conversion_options: Keyword arguments for convert_to_graph_road_edges() when source is a GeoJSON
+      file, for example formatted_road_type or bbox.
+
+    Returns:
+    - PatrolPlan: The circuit and the graphs it was planned from.
+    """
+    if isinstance(source, nx.Graph):
+        G = source
+    elif str(source).lower().endswith('.graphml'):
+        with instrumentation.stage('ingest', source=source):
+            G = nx.read_graphml(source, force_multigraph=True)
+            instrumentation.annotate(nodes=G.number_of_nodes(), edges=G.number_of_edges())
+    else:
+        from conversions import convert_to_graph_road_edges
+        G = convert_to_graph_road_edges(source, dest=None, **conversion_options)
+    if not all(isinstance(node, str) for node in G):
+        # label the nodes as GraphML does, the lowest-neighbour ordering compares labels and would otherwise
+        # give a different circuit than modify_graph() on the same roads
+        G = nx.relabel_nodes(G, str)
+    euler_G = eulerize_graph(G, euler_form_method, euler_form_options)
+    circuit = order_circuit(euler_G, euler_order_method)
+    with instrumentation.stage('annotate'):
+        edges, artificial_edges = annotate_circuit_edges(euler_G, circuit, length_unit)
+        total_distance = 0
+        for _, _, data in edges:
+            total_distance += data['length']
+        instrumentation.annotate(circuit_edges=len(circuit), artificial_edges=artificial_edges,
+                                 total_distance=total_distance)
+    return PatrolPlan(G, euler_G, circuit, edges, total_distance, artificial_edges, length_unit)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Plan a patrol circuit in memory and write only the outputs asked for.")
+    parser.add_argument('source', help="GeoJSON roads, or a GraphML road graph ending in .graphml")
+    parser.add_argument('--geojson-dest', help="write the circuit as GeoJSON here")
+    parser.add_argument('--circuit-dest', help="write the circuit graph as GraphML here")
+    parser.add_argument('--eulerized-dest', help="write the Eulerized graph as GraphML here")
+    parser.add_argument('--graph-dest', help="write the road graph as GraphML here")
+    parser.add_argument('--index-dest', help="write the CircuitIndex of the circuit here")
+    parser.add_argument('--tiles-dest', help="write the circuit as MBTiles vector tiles here")
+    parser.add_argument('--method', default="built_in", help="eulerization method, as in modify_graph()")
+    parser.add_argument('--order', default="built_in", help="circuit ordering method, as in modify_graph()")
+    parser.add_argument('--length-unit', default="miles")
+    parser.add_argument('--road-name', default='FullStName', help="road name property of the GeoJSON roads")
+    parser.add_argument('--road-type', default='MapClass', help="road type property of the GeoJSON roads")
+    parser.add_argument('--contract-chains', action='store_true', help="contract chains of degree-2 nodes")
+    args = parser.parse_args()
+    conversion_options = {}
+    if not args.source.lower().endswith('.graphml'):
+        conversion_options = dict(formatted_road_name=args.road_name, formatted_road_type=args.road_type,
+                                  length_unit=args.length_unit, contract_chains=args.contract_chains)
+    plan = plan_patrol(args.source, euler_form_method=args.method, euler_order_method=args.order,
+                       length_unit=args.length_unit, **conversion_options)
+    plan.write(geojson_dest=args.geojson_dest, circuit_dest=args.circuit_dest, eulerized_dest=args.eulerized_dest,
+               graph_dest=args.graph_dest, index_dest=args.index_dest, formatted_road_name=args.road_name,
+               tiles_dest=args.tiles_dest)
+    print(plan.attributes())
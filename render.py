@@ -0,0 +1,166 @@
+import math
+import os
+import geopandas as gpd
+import numpy as np
+import shapely
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba
+from matplotlib.figure import Figure
+
+
+def draw_circuit(circuit, ax=None, arrow_spacing=15, color='blue', arrow_color='red', linewidth=1,
+                 dest=None, dpi=150):
+    """
+    Draws every road of a circuit at once as a single LineCollection, with a direction arrow at the end of
+    every arrow_spacing-th road, pointing away from its start, drawn as a single quiver.
+
+    Parameters:
+    - circuit (str or geopandas.GeoDataFrame): The circuit, such as the GeoJSON file written by
+      convert_to_geojson(), with one row per road in circuit order.
+    - ax (matplotlib.axes.Axes, optional): The axes to draw on. A new figure is made if none is given.
+    - arrow_spacing (int): Only every arrow_spacing-th road gets an arrow. 0 draws no arrows.
+    - color: Color of the roads.
+    - arrow_color: Color of the arrows.
+    - linewidth (float): Width of the road lines.
+    - dest (str, optional): Save the figure as an image here. A new figure is then drawn off screen, so
+      this works without a display.
+    - dpi (int): Resolution of the saved image.
+
+    Returns:
+    - tuple: (figure, axes, line collection, quiver or None).
+    """
+    lines, line_features, starts, ends = circuit_lines(read_circuit(circuit))
+    fig, ax = _figure(ax, headless=dest is not None)
+    collection, quiver = _add_circuit(ax, lines, starts, ends, arrow_spacing, color, arrow_color, linewidth)
+    if dest is not None:
+        fig.savefig(dest, dpi=dpi)
+    return fig, ax, collection, quiver
+
+
+def animate_circuit(circuit, frames=300, interval=20, arrow_spacing=15, color='blue', arrow_color='red',
+                    linewidth=1, dest=None, frames_dir=None, fps=30, dpi=150):
+    """
+    Reveals a circuit road by road in the order it is driven.
+
+    All roads are drawn once up front and each frame only makes the next batch of them visible, so frames
+    cost the same no matter how long the circuit is. On screen the animation is blitted; with dest or
+    frames_dir it is rendered off screen, which works without a display.
+
+    Parameters:
+    - circuit (str or geopandas.GeoDataFrame): The circuit, as for draw_circuit().
+    - frames (int): Number of frames. Long circuits reveal several roads per frame; circuits with fewer
+      roads than frames reveal one road per frame.
+    - interval (float): Delay between frames on screen, in milliseconds.
+    - arrow_spacing (int): Only every arrow_spacing-th road gets an arrow. 0 draws no arrows.
+    - color: Color of the roads.
+    - arrow_color: Color of the arrows.
+    - linewidth (float): Width of the road lines.
+    - dest (str, optional): Save the animation as a video or GIF here, with whatever movie writer matplotlib
+      finds for the file extension (ffmpeg for .mp4, Pillow for .gif).
+    - frames_dir (str, optional): Save every frame as a numbered PNG image in this directory.
+    - fps (int): Frames per second of the saved video.
+    - dpi (int): Resolution of the saved frames.
+
+    Returns:
+    - matplotlib.animation.FuncAnimation: The animation. Keep a reference to it while it is shown. None when
+      only frames_dir is given, since the frames are then saved without animating.
+    """
+    from matplotlib.animation import FuncAnimation
+
+    lines, line_features, starts, ends = circuit_lines(read_circuit(circuit))
+    headless = dest is not None or frames_dir is not None
+    fig, ax = _figure(None, headless=headless)
+    collection, quiver = _add_circuit(ax, lines, starts, ends, arrow_spacing, color, arrow_color, linewidth)
+    artists = [collection] if quiver is None else [collection, quiver]
+
+    feature_count = len(starts)
+    frames = max(1, min(frames, feature_count))
+    per_frame = math.ceil(feature_count / frames)
+    line_colors = np.tile(to_rgba(color), (len(lines), 1))
+    arrow_features = np.arange(0, feature_count, arrow_spacing) if arrow_spacing else np.zeros(0, dtype=int)
+    arrow_colors = np.tile(to_rgba(arrow_color), (len(arrow_features), 1))
+
+    def reveal(frame):
+        shown = min(feature_count, (frame + 1) * per_frame)
+        line_colors[:, 3] = 0
+        line_colors[:np.searchsorted(line_features, shown), 3] = 1
+        collection.set_color(line_colors)
+        if quiver is not None:
+            arrow_colors[:, 3] = 0
+            arrow_colors[:np.searchsorted(arrow_features, shown), 3] = 1
+            quiver.set_color(arrow_colors)
+        return artists
+
+    reveal(-1)
+    animation = None
+    if dest is not None or not headless:
+        animation = FuncAnimation(fig, reveal, frames=frames, interval=interval, blit=not headless, repeat=False)
+    if frames_dir is not None:
+        os.makedirs(frames_dir, exist_ok=True)
+        for frame in range(frames):
+            reveal(frame)
+            fig.savefig(os.path.join(frames_dir, f'frame_{frame:05d}.png'), dpi=dpi)
+    if dest is not None:
+        animation.save(dest, fps=fps, dpi=dpi)
+    return animation
+
+
+def read_circuit(circuit):
+    """
+    Reads a circuit GeoJSON file, passing GeoDataFrames through unchanged.
+    """
+    if isinstance(circuit, gpd.GeoDataFrame):
+        return circuit
+    return gpd.read_file(circuit)
+
+
+def circuit_lines(gdf):
+    """
+    Pulls the coordinates of every road out of a circuit GeoDataFrame in one vectorized pass.
+
+    Parameters:
+    - gdf (geopandas.GeoDataFrame): The circuit, one row per road in circuit order.
+
+    Returns:
+    - tuple: (lines, line_features, starts, ends) where lines is a list of (n, 2) coordinate arrays, one per
+      LineString part, line_features holds the row each line belongs to, and starts and ends hold the first
+      and last point of every non-empty row, used for the direction arrows.
+    """
+    geometries = np.asarray(gdf.geometry.values, dtype=object)
+    parts, part_features = shapely.get_parts(geometries, return_index=True)
+    coords, index = shapely.get_coordinates(parts, return_index=True)
+    breaks = np.flatnonzero(np.diff(index)) + 1
+    lines = np.split(coords, breaks)
+    line_features = part_features[np.unique(index)] if len(index) else np.zeros(0, dtype=int)
+
+    coords, index = shapely.get_coordinates(geometries, return_index=True)
+    firsts = np.r_[0, np.flatnonzero(np.diff(index)) + 1] if len(index) else np.zeros(0, dtype=int)
+    lasts = np.r_[firsts[1:] - 1, len(index) - 1] if len(index) else np.zeros(0, dtype=int)
+    return lines if len(coords) else [], line_features, coords[firsts], coords[lasts]
+
+
+def _figure(ax, headless=False):
+    # off screen figures skip pyplot entirely, so no display or GUI backend is needed
+    if ax is not None:
+        return ax.figure, ax
+    if headless:
+        fig = Figure()
+        return fig, fig.add_subplot()
+    import matplotlib.pyplot as plt
+    return plt.subplots()
+
+
+def _add_circuit(ax, lines, starts, ends, arrow_spacing, color, arrow_color, linewidth):
+    collection = LineCollection(lines, colors=color, linewidths=linewidth)
+    ax.add_collection(collection)
+    ax.autoscale_view()
+    quiver = None
+    if arrow_spacing and len(starts):
+        starts, ends = starts[::arrow_spacing], ends[::arrow_spacing]
+        # same sized arrows pointing at each road's end, however short the road is
+        directions = ends - starts
+        norms = np.hypot(directions[:, 0], directions[:, 1])[:, None]
+        directions = np.divide(directions, norms, out=np.zeros_like(directions), where=norms > 0)
+        quiver = ax.quiver(ends[:, 0], ends[:, 1], directions[:, 0], directions[:, 1], color=arrow_color,
+                           angles='xy', pivot='tip', scale=60, scale_units='width', width=0.003)
+    return collection, quiver
@@ -0,0 +1,443 @@
+import json
+import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from find_euler_path import (parse_node, euler_circuit_nodes, match_odd_nodes_greedily, match_odd_nodes_min_weight)
+
+
+class RoadGraph:
+    """
+    Compact, integer-indexed road graph backed by NumPy arrays.
+
+    Nodes are numbered 0..n-1 with their coordinates in a float64 array, adjacency is stored in CSR form and
+    every edge is a row of per-edge arrays instead of a networkx attribute dict. Parallel copies of the same
+    road segment are stored once with a multiplicity (visit count).
+
+    Attributes:
+    - coordinates (numpy.ndarray): float64 array of shape (n, 2) or (n, 3); NaN z values mark 2D nodes.
+    - sources, targets (numpy.ndarray): int32 end nodes of each edge.
+    - lengths (numpy.ndarray): float64 length of each edge, NaN where the edge has no length.
+    - type_codes (numpy.ndarray): int32 index into types of each edge's road type, -1 for none.
+    - multiplicity (numpy.ndarray): int32 number of times each edge has to be traversed.
+    - name_index (numpy.ndarray): int32 index into names of each edge's road name, -1 for none.
+    - names, types (list): The distinct road names and road types.
+    - indptr, indices, edge_ids (numpy.ndarray): CSR adjacency. The neighbors of node i are
+      indices[indptr[i]:indptr[i + 1]], sorted, reached through the edges edge_ids[indptr[i]:indptr[i + 1]].
+    - directed (bool): Whether edges only lead from source to target.
+    - graph (dict): Graph attributes such as 'total_distance'.
+    """
+
+    def __init__(self, coordinates, sources, targets, lengths, type_codes=None, multiplicity=None,
+                 name_index=None, names=(), types=(), directed=False, graph=None):
+        self.coordinates = np.asarray(coordinates, dtype=np.float64)
+        self.sources = np.asarray(sources, dtype=np.int32)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        edge_count = len(self.sources)
+        self.type_codes = np.full(edge_count, -1, dtype=np.int32) if type_codes is None \
+            else np.asarray(type_codes, dtype=np.int32)
+        self.multiplicity = np.ones(edge_count, dtype=np.int32) if multiplicity is None \
+            else np.asarray(multiplicity, dtype=np.int32)
+        self.name_index = np.full(edge_count, -1, dtype=np.int32) if name_index is None \
+            else np.asarray(name_index, dtype=np.int32)
+        self.names = list(names)
+        self.types = list(types)
+        self.directed = directed
+        self.graph = dict(graph or {})
+        self._build_adjacency()
+
+    def _build_adjacency(self):
+        node_count = len(self.coordinates)
+        edge_ids = np.arange(len(self.sources), dtype=np.int32)
+        if self.directed:
+            rows, columns = self.sources, self.targets
+        else:
+            # an undirected edge is listed under both end nodes, a self loop only once
+            loops = self.sources == self.targets
+            rows = np.concatenate([self.sources, self.targets[~loops]])
+            columns = np.concatenate([self.targets, self.sources[~loops]])
+            edge_ids = np.concatenate([edge_ids, edge_ids[~loops]])
+        order = np.lexsort((edge_ids, columns, rows))
+        self.indptr = np.zeros(node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=node_count), out=self.indptr[1:])
+        self.indices = columns[order]
+        self.edge_ids = edge_ids[order]
+
+    @property
+    def number_of_nodes(self):
+        return len(self.coordinates)
+
+    @property
+    def number_of_edges(self):
+        """Number of edges counting each multiplicity, like a networkx MultiGraph would."""
+        return int(self.multiplicity.sum())
+
+    def copy(self):
+        return RoadGraph(self.coordinates.copy(), self.sources.copy(), self.targets.copy(), self.lengths.copy(),
+                         type_codes=self.type_codes.copy(), multiplicity=self.multiplicity.copy(),
+                         name_index=self.name_index.copy(), names=self.names, types=self.types,
+                         directed=self.directed, graph=self.graph)
+
+    def degree(self):
+        """
+        Returns:
+        numpy.ndarray: The degree of every node, counting multiplicity; for directed graphs the out-degree.
+        """
+        degree = np.bincount(self.sources, weights=self.multiplicity, minlength=self.number_of_nodes)
+        if not self.directed:
+            degree += np.bincount(self.targets, weights=self.multiplicity, minlength=self.number_of_nodes)
+        return degree.astype(np.int64)
+
+    def in_degree(self):
+        """
+        Returns:
+        numpy.ndarray: The in-degree of every node of a directed graph, counting multiplicity.
+        """
+        return np.bincount(self.targets, weights=self.multiplicity,
+                           minlength=self.number_of_nodes).astype(np.int64)
+
+    def odd_nodes(self):
+        """
+        Returns:
+        numpy.ndarray: The ids of the nodes with odd degree.
+        """
+        return np.flatnonzero(self.degree() % 2 == 1)
+
+    def is_connected(self):
+        """
+        Returns:
+        bool: Whether all nodes that have edges are connected to each other.
+        """
+        node_count = self.number_of_nodes
+        adjacency = csr_matrix((np.ones(len(self.sources)), (self.sources, self.targets)),
+                               shape=(node_count, node_count))
+        _, labels = connected_components(adjacency, directed=False)
+        used = np.zeros(node_count, dtype=bool)
+        used[self.sources] = used[self.targets] = True
+        return len(np.unique(labels[used])) <= 1
+
+    def node_labels(self, string_labels=True):
+        """
+        Parameters:
+        - string_labels (bool): Return labels as GraphML writes them, e.g. "(-84.1, 34.2, 0.0)", instead of
+          coordinate tuples.
+
+        Returns:
+        list: The networkx label of every node.
+        """
+        coordinates = self.coordinates
+        labels = list(map(tuple, coordinates.tolist()))
+        if coordinates.shape[1] == 3:
+            flat = np.isnan(coordinates[:, 2])
+            if flat.any():
+                labels = [label[:2] if is_flat else label for label, is_flat in zip(labels, flat.tolist())]
+        if string_labels:
+            return [str(label) for label in labels]
+        return labels
+
+    def neighbors(self, weighted=True):
+        """
+        Builds the neighbors function used by the shortest path searches in find_euler_path.
+
+        Parameters:
+        - weighted (bool): Use edge lengths, otherwise every edge counts as 1. Edges without length count as 1.
+
+        Returns:
+        function: Maps a node id to a list of (neighbor id, edge length) pairs.
+        """
+        if weighted:
+            lengths = np.where(np.isnan(self.lengths), 1.0, self.lengths)[self.edge_ids].tolist()
+        else:
+            lengths = [1] * len(self.edge_ids)
+        indices = self.indices.tolist()
+        indptr = self.indptr.tolist()
+
+        def neighbors(node):
+            start, end = indptr[node], indptr[node + 1]
+            return zip(indices[start:end], lengths[start:end])
+
+        return neighbors
+
+    def edge_between(self, u, v):
+        """
+        Parameters:
+        - u, v (int): Node ids.
+
+        Returns:
+        int: The id of the shortest edge leading from u to v.
+        """
+        start, end = self.indptr[u], self.indptr[u + 1]
+        first = start + np.searchsorted(self.indices[start:end], v, side='left')
+        last = start + np.searchsorted(self.indices[start:end], v, side='right')
+        if first == last:
+            raise KeyError((u, v))
+        candidates = self.edge_ids[first:last]
+        return int(candidates[np.argmin(self.lengths[candidates])])
+
+    def with_added_edges(self, edge_ids, counts):
+        """
+        Returns a copy with extra, unnamed copies of existing edges, as added when eulerizing.
+
+        Parameters:
+        - edge_ids (array-like): The edges to copy.
+        - counts (array-like): How many copies of each edge to add, stored as the new edge's multiplicity.
+
+        Returns:
+        RoadGraph: The new graph.
+        """
+        edge_ids = np.asarray(edge_ids, dtype=np.int64)
+        added = len(edge_ids)
+        return RoadGraph(self.coordinates,
+                         np.concatenate([self.sources, self.sources[edge_ids]]),
+                         np.concatenate([self.targets, self.targets[edge_ids]]),
+                         np.concatenate([self.lengths, self.lengths[edge_ids]]),
+                         type_codes=np.concatenate([self.type_codes, np.full(added, -1)]),
+                         multiplicity=np.concatenate([self.multiplicity, counts]),
+                         name_index=np.concatenate([self.name_index, np.full(added, -1)]),
+                         names=self.names, types=self.types, directed=self.directed, graph=self.graph)
+
+    def eulerize(self, method="built_in_weighted", k_nearest=10, cutoff=None, distance_index=None):
+        """
+        Eulerizes the graph without converting it to networkx, see eulerize_road_graph().
+        """
+        return eulerize_road_graph(self, method=method, k_nearest=k_nearest, cutoff=cutoff,
+                                   distance_index=distance_index)
+
+    def euler_circuit(self):
+        """
+        Orders the Euler circuit without converting the graph to networkx, see road_graph_circuit().
+        """
+        return road_graph_circuit(self)
+
+    def save(self, path):
+        """
+        Saves the graph as an uncompressed .npz file that load() reads back without any parsing.
+
+        Parameters:
+        - path (str): Destination path.
+        """
+        np.savez(path,
+                 coordinates=self.coordinates,
+                 sources=self.sources,
+                 targets=self.targets,
+                 lengths=self.lengths,
+                 type_codes=self.type_codes,
+                 multiplicity=self.multiplicity,
+                 name_index=self.name_index,
+                 attributes=np.array(json.dumps({'names': self.names,
+                                                 'types': self.types,
+                                                 'directed': self.directed,
+                                                 'graph': self.graph})))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a graph written by save().
+
+        Parameters:
+        - path (str): Path of the .npz file.
+
+        Returns:
+        RoadGraph: The loaded graph.
+        """
+        with np.load(path) as arrays:
+            attributes = json.loads(str(arrays['attributes']))
+            return cls(arrays['coordinates'], arrays['sources'], arrays['targets'], arrays['lengths'],
+                       type_codes=arrays['type_codes'], multiplicity=arrays['multiplicity'],
+                       name_index=arrays['name_index'], names=attributes['names'], types=attributes['types'],
+                       directed=attributes['directed'], graph=attributes['graph'])
+
+    @classmethod
+    def from_networkx(cls, G):
+        """
+        Builds a RoadGraph from a networkx graph whose nodes are coordinate tuples or their GraphML strings.
+
+        Parallel edges with the same name, type and length are merged into one edge with a multiplicity.
+        Only the name, type, length and multiplicity edge attributes are kept.
+
+        Parameters:
+        - G (networkx.Graph): The input graph.
+
+        Returns:
+        RoadGraph: The converted graph.
+        """
+        node_ids = {node: i for i, node in enumerate(G)}
+        points = [parse_node(node) for node in G]
+        dimensions = max((len(point) for point in points), default=2)
+        coordinates = np.full((len(points), dimensions), np.nan)
+        for i, point in enumerate(points):
+            coordinates[i, :len(point)] = point
+
+        names, name_ids = [], {}
+        types, type_ids = [], {}
+
+        def intern(value, values, ids):
+            if value is None:
+                return -1
+            if value not in ids:
+                ids[value] = len(values)
+                values.append(value)
+            return ids[value]
+
+        edge_ids = {}
+        sources, targets, lengths, type_codes, multiplicity, name_index = [], [], [], [], [], []
+        for u, v, data in G.edges(data=True):
+            name = intern(data.get('name'), names, name_ids)
+            road_type = intern(data.get('type'), types, type_ids)
+            length = data.get('length', np.nan)
+            key = (node_ids[u], node_ids[v], name, road_type, length)
+            if key in edge_ids:
+                multiplicity[edge_ids[key]] += data.get('multiplicity', 1)
+                continue
+            edge_ids[key] = len(sources)
+            sources.append(node_ids[u])
+            targets.append(node_ids[v])
+            lengths.append(length)
+            type_codes.append(road_type)
+            multiplicity.append(data.get('multiplicity', 1))
+            name_index.append(name)
+        graph = {key: value for key, value in G.graph.items() if key not in ('node_default', 'edge_default')}
+        return cls(coordinates, sources, targets, lengths, type_codes=type_codes, multiplicity=multiplicity,
+                   name_index=name_index, names=names, types=types, directed=G.is_directed(), graph=graph)
+
+    def to_networkx(self, string_labels=True):
+        """
+        Converts the graph back to a networkx MultiGraph (MultiDiGraph if directed) so existing methods keep
+        working. Each edge keeps its multiplicity as the 'multiplicity' attribute.
+
+        Parameters:
+        - string_labels (bool): Label nodes as GraphML strings instead of coordinate tuples (default: True).
+
+        Returns:
+        networkx.MultiGraph: The converted graph.
+        """
+        G = nx.MultiDiGraph() if self.directed else nx.MultiGraph()
+        G.graph.update(self.graph)
+        labels = self.node_labels(string_labels=string_labels)
+        G.add_nodes_from(labels)
+        names = self.names
+        types = self.types
+        for u, v, length, type_code, count, name in zip(self.sources.tolist(), self.targets.tolist(),
+                                                         self.lengths.tolist(), self.type_codes.tolist(),
+                                                         self.multiplicity.tolist(), self.name_index.tolist()):
+            data = {'multiplicity': count}
+            if name >= 0:
+                data['name'] = names[name]
+            if type_code >= 0:
+                data['type'] = types[type_code]
+            if length == length:
+                data['length'] = length
+            G.add_edge(labels[u], labels[v], **data)
+        return G
+
+
+def eulerize_road_graph(road_graph, method="built_in_weighted", k_nearest=10, cutoff=None, distance_index=None):
+    """
+    Eulerizes a RoadGraph by duplicating the edges along shortest paths between its odd-degree nodes, the same
+    way the eulerize functions in find_euler_path do for networkx graphs.
+
+    Parameters:
+    - road_graph (RoadGraph): The input graph, undirected and connected.
+    - method (str): "built_in_weighted" or "dijkstra" pair odd-degree nodes by road length, "built_in" and
+      "min_weights" by number of edges. "built_in" and "built_in_weighted" use a minimum-weight perfect
+      matching, "dijkstra" and "min_weights" greedily match the closest remaining pair.
+    - k_nearest (int): Number of nearest odd-degree neighbours considered per odd-degree node (default: 10).
+    - cutoff (float): Distance limit for the greedy methods' first rounds (default: None).
+    - distance_index (DistanceIndex): An index built from this graph with DistanceIndex.from_road_graph(),
+      measuring what the method pairs nodes by, whose adjacency is searched instead (default: None).
+
+    Returns:
+    RoadGraph: The Eulerized graph. Added copies are stored as unnamed edges with a multiplicity.
+    """
+    if road_graph.directed:
+        raise nx.NetworkXNotImplemented("not implemented for directed type")
+    if road_graph.number_of_nodes == 0:
+        raise nx.NetworkXPointlessConcept("Cannot Eulerize null graph")
+    if not road_graph.is_connected():
+        raise nx.NetworkXError("G is not connected")
+    odd_degree_nodes = road_graph.odd_nodes().tolist()
+    if not odd_degree_nodes:
+        return road_graph.copy()
+
+    weighted = method in ("built_in_weighted", "dijkstra")
+    if distance_index is None:
+        neighbors = road_graph.neighbors(weighted=weighted)
+    else:
+        if distance_index.weight != ('length' if weighted else None):
+            raise ValueError(f'The distance index does not measure distance the way "{method}" does')
+        if distance_index.labels != road_graph.node_labels():
+            raise ValueError("The distance index was built for a different road graph")
+        # the index numbers nodes like the graph it was built from
+        neighbors = distance_index.neighbors()
+    if method in ("dijkstra", "min_weights"):
+        paths = match_odd_nodes_greedily(neighbors, odd_degree_nodes, cutoff=cutoff, k_nearest=k_nearest)
+    else:
+        paths = match_odd_nodes_min_weight(neighbors, odd_degree_nodes, k_nearest=k_nearest)
+
+    copies = {}
+    for path in paths:
+        for u, v in zip(path[:-1], path[1:]):
+            edge = road_graph.edge_between(u, v)
+            copies[edge] = copies.get(edge, 0) + 1
+    return road_graph.with_added_edges(list(copies), list(copies.values()))
+
+
+def road_graph_circuit(road_graph):
+    """
+    Orders the Euler circuit of a RoadGraph with the same Hierholzer walk as find_euler_path.hierholzer(),
+    traversing every edge as many times as its multiplicity.
+
+    Parameters:
+    - road_graph (RoadGraph): An Eulerian graph.
+
+    Returns:
+    tuple: (nodes, edges) arrays, where nodes holds the node ids of the closed circuit and edges[i] is the
+    id of the edge walked from nodes[i] to nodes[i + 1].
+    """
+    degree = road_graph.degree()
+    if road_graph.directed:
+        if (degree != road_graph.in_degree()).any():
+            raise nx.NetworkXError("G is not Eulerian.")
+    elif (degree % 2 == 1).any():
+        raise nx.NetworkXError("G is not Eulerian.")
+    if not len(road_graph.sources):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    indptr = road_graph.indptr.tolist()
+    indices = road_graph.indices.tolist()
+    edge_ids = road_graph.edge_ids.tolist()
+    adjacency = [list(zip(indices[indptr[node]:indptr[node + 1]], edge_ids[indptr[node]:indptr[node + 1]]))
+                 for node in range(road_graph.number_of_nodes)]
+    start = int(np.flatnonzero(np.diff(road_graph.indptr))[0])
+    steps = list(euler_circuit_nodes(start, adjacency, road_graph.multiplicity.tolist()))
+    nodes = np.fromiter((node for node, _ in steps), dtype=np.int64, count=len(steps))
+    edges = np.fromiter((edge for _, edge in steps[1:]), dtype=np.int64, count=len(steps) - 1)
+    return nodes, edges
+
+
+def circuit_to_networkx(road_graph, nodes, edges, string_labels=True):
+    """
+    Builds the ordered circuit graph that find_euler_path.modify_graph() writes to its dest file, with one
+    edge per step of the circuit carrying the traversed edge's name, length and type.
+
+    Parameters:
+    - road_graph (RoadGraph): The Eulerized graph the circuit was ordered on.
+    - nodes, edges (numpy.ndarray): The circuit as returned by road_graph_circuit().
+    - string_labels (bool): Label nodes as GraphML strings instead of coordinate tuples (default: True).
+
+    Returns:
+    networkx.MultiDiGraph: The circuit.
+    """
+    labels = road_graph.node_labels(string_labels=string_labels)
+    names = road_graph.names + ["unnamed"]
+    types = road_graph.types + ['no_type']
+    circuit = nx.MultiDiGraph()
+    nodes = nodes.tolist()
+    circuit.add_edges_from(
+        (labels[source], labels[target], {'name': names[name], 'length': length, 'type': types[road_type]})
+        for source, target, name, length, road_type in zip(nodes[:-1], nodes[1:],
+                                                           road_graph.name_index[edges].tolist(),
+                                                           road_graph.lengths[edges].tolist(),
+                                                           road_graph.type_codes[edges].tolist()))
+    return circuit
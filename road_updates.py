@@ -0,0 +1,244 @@
+import networkx as nx
+from collections import Counter
+from networkx.utils import pairwise
+from find_euler_path import add_edge_copy, calculate_distance, match_odd_nodes_min_weight, weighted_neighbors
+
+
+def update_euler_circuit(euler_G, circuit, closed_roads=(), opened_roads=(), length_unit="miles", k_nearest=10):
+    """
+    Updates an eulerized graph and its circuit after roads close or open, without eulerizing and ordering the
+    whole network again.
+
+    Only the nodes at the ends of the changed roads can change parity, so only those are paired up again,
+    with shortest path searches that stop at their k_nearest nearest odd-degree neighbours. The old circuit is
+    cut where removed traversals were and spliced back together with the new ones.
+
+    Parameters:
+    - euler_G (networkx.MultiGraph): The eulerized graph, as returned by eulerize_graph(). Updated in place.
+    - circuit (list): The circuit ordered from euler_G, as (source, target) tuples.
+    - closed_roads (iterable): (u, v) node pairs. Every road and every added copy between them is removed.
+    - opened_roads (iterable): (u, v) node pairs or (u, v, data) tuples for new roads. data may hold 'name',
+      'type', 'length' and 'multiplicity'; a missing length is measured between the two nodes.
+    - length_unit (str): Unit of length for measuring new roads.
+    - k_nearest (int): Number of nearest odd-degree neighbours searched when pairing nodes, None for all.
+
+    Returns:
+    - list: The updated circuit as (source, target) tuples.
+    """
+    removed, added = update_eulerized_graph(euler_G, closed_roads, opened_roads, length_unit, k_nearest)
+    start = circuit[0][0] if circuit else None
+    return patch_circuit(circuit, removed, added, start=start)
+
+
+def update_eulerized_graph(euler_G, closed_roads=(), opened_roads=(), length_unit="miles", k_nearest=10):
+    """
+    Removes closed roads from an eulerized graph and adds opened ones, in place, then makes it eulerian again
+    by pairing up the nodes at the ends of the changed roads that became odd.
+
+    Added copies that end up traversed two or more times beyond need are taken back in pairs, which keeps
+    every degree even.
+
+    Parameters:
+    - euler_G (networkx.MultiGraph): The eulerized graph, updated in place.
+    - closed_roads (iterable): (u, v) node pairs to close.
+    - opened_roads (iterable): (u, v) node pairs or (u, v, data) tuples to open.
+    - length_unit (str): Unit of length for measuring new roads.
+    - k_nearest (int): Number of nearest odd-degree neighbours searched when pairing nodes, None for all.
+
+    Returns:
+    - tuple: (removed, added) lists of the (source, target) traversals taken out of and put into the graph.
+    """
+    closed = [(node_label(euler_G, u), node_label(euler_G, v)) for u, v in closed_roads]
+    for u, v in closed:
+        if not euler_G.has_edge(u, v):
+            raise ValueError(f"There is no road between {u} and {v}")
+    # check before changing anything; a dead end whose last road closes simply drops out of the circuit
+    remaining = nx.restricted_view(euler_G, [], [(u, v, key) for u, v in closed for key in euler_G[u][v]])
+    for u, v in closed:
+        if remaining.degree(u) and remaining.degree(v) and not nx.has_path(remaining, u, v):
+            raise nx.NetworkXError(f"Closing the road between {u} and {v} disconnects the road graph")
+
+    removed = []
+    added = []
+    touched = set()
+    for u, v in closed:
+        for key, data in list(euler_G[u][v].items()):
+            removed.extend([(u, v)] * data.get('multiplicity', 1))
+            if 'name' in data:
+                euler_G.graph['total_distance'] = euler_G.graph.get('total_distance', 0) - data.get('length', 0)
+            euler_G.remove_edge(u, v, key)
+        touched.update((u, v))
+
+    for road in opened_roads:
+        u, v = node_label(euler_G, road[0]), node_label(euler_G, road[1])
+        data = {'name': "unnamed", 'type': 'no_type', 'multiplicity': 1, **(road[2] if len(road) > 2 else {})}
+        if 'length' not in data:
+            data['length'] = calculate_distance(u, v, init_length_unit=length_unit)
+        euler_G.add_edge(u, v, **data)
+        euler_G.graph['total_distance'] = euler_G.graph.get('total_distance', 0) + data['length']
+        added.extend([(u, v)] * data['multiplicity'])
+        touched.update((u, v))
+
+    euler_G.remove_nodes_from([node for node in touched if euler_G.degree(node) == 0])
+
+    odd_degree_nodes = [node for node in touched if node in euler_G
+                        and euler_G.degree(node, weight='multiplicity') % 2 == 1]
+    repaired = set()
+    for path in match_odd_nodes_min_weight(weighted_neighbors(euler_G, 'length'), odd_degree_nodes, k_nearest):
+        for u, v in pairwise(path):
+            add_edge_copy(euler_G, u, v, length=min(data.get('length', 1) for data in euler_G[u][v].values()))
+            added.append((u, v))
+            repaired.add((u, v))
+
+    taken_back = []
+    for u, v in repaired:
+        for key, data in list(euler_G[u][v].items()):
+            if 'name' not in data and data.get('multiplicity', 1) >= 2:
+                pairs = data['multiplicity'] // 2
+                taken_back.extend([(u, v)] * (2 * pairs))
+                data['multiplicity'] -= 2 * pairs
+                if data['multiplicity'] == 0:
+                    euler_G.remove_edge(u, v, key)
+    # copies added a moment ago are simply not added, older ones are cut out of the circuit
+    pending = Counter(frozenset(edge) for edge in taken_back)
+    kept = []
+    for edge in added:
+        if pending[frozenset(edge)] > 0:
+            pending[frozenset(edge)] -= 1
+        else:
+            kept.append(edge)
+    for edge, count in pending.items():
+        u, v = tuple(edge) if len(edge) == 2 else (*edge, *edge)
+        removed.extend([(u, v)] * count)
+    return removed, kept
+
+
+def patch_circuit(circuit, removed=(), added=(), start=None):
+    """
+    Patches an Euler circuit after traversals were taken out of and put into its graph.
+
+    The circuit is cut into walks wherever a removed traversal was. Each walk and each added traversal becomes
+    a single edge of a small graph, whose Euler circuit gives the order to splice the walks back together in.
+    Walks are also cut where added traversals start or end, and where two walks cross if that is what keeps
+    them connected.
+
+    Parameters:
+    - circuit (list): The circuit as (source, target) tuples.
+    - removed (iterable): (source, target) traversals to take out, in either direction.
+    - added (iterable): (source, target) traversals to put in.
+    - start: The node the new circuit should start from if it still has roads, defaults to any node.
+
+    Returns:
+    - list: The patched circuit as (source, target) tuples.
+    """
+    pending = Counter(frozenset(edge) for edge in removed)
+    walks = []
+    walk = []
+    for edge in circuit:
+        key = frozenset(edge)
+        if pending[key] > 0:
+            pending[key] -= 1
+            walks.append(walk)
+            walk = []
+        else:
+            walk.append(edge)
+    if any(pending.values()):
+        raise ValueError("Not every removed traversal is in the circuit")
+    # the circuit is closed, so the walk after the last cut carries on into the one before the first
+    if walks:
+        walks[0] = walk + walks[0]
+    else:
+        walks = [walk]
+    added = list(added)
+    walks = split_walks([walk for walk in walks if walk], {node for edge in added for node in edge})
+
+    while True:
+        H = nx.MultiGraph()
+        for index, walk in enumerate(walks):
+            H.add_edge(walk[0][0], walk[-1][1], key=('walk', index))
+        for index, (u, v) in enumerate(added):
+            H.add_edge(u, v, key=('added', index))
+        if H.number_of_edges() == 0:
+            return []
+        components = list(nx.connected_components(H))
+        if len(components) == 1:
+            break
+        walks = join_components(walks, components)
+
+    if start not in H:
+        start = next(iter(H))
+    patched = []
+    for u, v, (kind, index) in nx.eulerian_circuit(H, source=start, keys=True):
+        if kind == 'added':
+            patched.append((u, v))
+        elif walks[index][0][0] == u:
+            patched.extend(walks[index])
+        else:
+            patched.extend((target, source) for source, target in reversed(walks[index]))
+    return patched
+
+
+def split_walks(walks, nodes):
+    """
+    Cuts walks at every visit to one of the given nodes.
+
+    Parameters:
+    - walks (list): Walks as lists of (source, target) tuples.
+    - nodes (set): The nodes to cut at.
+
+    Returns:
+    - list: The shorter walks.
+    """
+    if not nodes:
+        return walks
+    pieces = []
+    for walk in walks:
+        piece = []
+        for edge in walk:
+            piece.append(edge)
+            if edge[1] in nodes:
+                pieces.append(piece)
+                piece = []
+        if piece:
+            pieces.append(piece)
+    return pieces
+
+
+def join_components(walks, components):
+    """
+    Finds a node that walks from different components of the splice graph both pass through and cuts those
+    walks there, which joins the components.
+
+    Parameters:
+    - walks (list): Walks as lists of (source, target) tuples.
+    - components (list): The node sets of the splice graph's connected components.
+
+    Returns:
+    - list: The walks, with the crossing walks cut at the shared node.
+    """
+    component_of = {node: index for index, component in enumerate(components) for node in component}
+    passed = {}
+    for walk in walks:
+        component = component_of[walk[0][0]]
+        for _, node in walk[:-1]:
+            other = component_of.get(node, passed.get(node, component))
+            if other != component:
+                return split_walks(walks, {node})
+            passed.setdefault(node, component)
+    raise nx.NetworkXError("G is not connected.")
+
+
+def node_label(G, node):
+    """
+    Matches a node given as a coordinate tuple to the string labels of a graph read back from GraphML.
+
+    Parameters:
+    - G (networkx.Graph): The graph.
+    - node: The node, either as labelled in G or as a coordinate tuple.
+
+    Returns:
+    - The node as labelled in G.
+    """
+    if node in G or not isinstance(next(iter(G), None), str):
+        return node
+    return str(node)
@@ -0,0 +1,348 @@
+import argparse
+import asyncio
+import hashlib
+import inspect
+import json
+import numbers
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import networkx as nx
+import numpy as np
+import shapely
+from shapely.errors import ShapelyError
+from shapely.geometry import box, shape
+import find_euler_path
+from conversions import circuit_features
+from find_euler_path import annotate_circuit_edges, eulerize_graph, order_circuit, parse_node
+
+# the function behind each euler_form_method, whose keyword arguments are the options a request may pass
+EULERIZERS = {"built_in": find_euler_path.eulerize_built_in,
+              "built_in_weighted": find_euler_path.eulerize_built_in_weighted,
+              "min_weights": find_euler_path.eulerize_minimize_weights,
+              "dijkstra": find_euler_path.eulerize_minimize_weights_dijkistra,
+              "min_cost_flow": find_euler_path.eulerize_min_cost_flow}
+ORDER_METHODS = ("built_in", "trotter", "hierholzer")
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+# the eulerization options a request may set, with what their values must be. distance_index is left out: a
+# county index never matches the subgraph of an area, and its path would be loaded from the server's disk
+FORM_OPTION_CHECKS = {
+    'k_nearest': ("null or an integer of at least 1",
+                  lambda value: value is None or (isinstance(value, int) and not isinstance(value, bool)
+                                                  and value >= 1)),
+    'cutoff': ("null or a positive number", lambda value: value is None or (_is_number(value) and value > 0)),
+    'odd_nodes_only': ("true or false", lambda value: isinstance(value, bool)),
+    'exact': ("true or false", lambda value: isinstance(value, bool)),
+}
+
+
+class LRUCache:
+    """
+    Bounded mapping that drops the least recently used entry once it holds more than maxsize entries.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RouteService:
+    """
+    Long-running route planner that keeps a county road graph in memory and answers route requests for
+    ad-hoc areas without re-reading or re-converting anything.
+
+    Each request names an area (a bounding box or a polygon) and the eulerization and ordering methods. The
+    roads lying inside the area are cut out of the county graph with a vectorized point-in-polygon test,
+    eulerized and ordered like modify_graph() does, on a worker thread so the event loop keeps serving other
+    requests, and returned as a GeoJSON FeatureCollection.
+
+    Results are kept in a bounded LRU cache keyed by the selected roads and the parameters, so a repeated
+    request, or a different area that selects the same roads, is answered from memory. Identical requests
+    that arrive while the first is still being planned wait for its result instead of planning it again.
+
+    Parameters:
+    - G (networkx.MultiGraph): The road graph, as written by convert_to_graph_road_edges(). Directed graphs
+      need the "min_cost_flow" method.
+    - cache_size (int): Number of routes kept in the cache.
+    - max_workers (int, optional): Number of planning threads. Defaults to ThreadPoolExecutor's default.
+    - length_unit (str): Unit of length for measuring artificial edges.
+    - formatted_road_name (str): Property name for the road name in the returned features.
+    """
+
+    def __init__(self, G, cache_size=128, max_workers=None, length_unit="miles", formatted_road_name='FullStName'):
+        self.G = G
+        self.length_unit = length_unit
+        self.formatted_road_name = formatted_road_name
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.routes = LRUCache(cache_size)
+        # areas only map to the roads they select, which are small, so more of them are kept
+        self.areas = LRUCache(cache_size * 8)
+        self.in_flight = {}
+
+        self.nodes = list(G.nodes)
+        node_ids = {node: i for i, node in enumerate(self.nodes)}
+        points = np.array([parse_node(node)[:2] for node in self.nodes], dtype=np.float64).reshape(-1, 2)
+        self.x, self.y = points[:, 0], points[:, 1]
+        self.edges = list(G.edges(keys=True))
+        self.edge_nodes = np.array([(node_ids[u], node_ids[v]) for u, v, _ in self.edges],
+                                   dtype=np.int64).reshape(-1, 2)
+
+    @classmethod
+    def from_graphml(cls, graphml_input, **options):
+        """
+        Starts a service on a GraphML road graph, such as one written by convert_to_graph_road_edges().
+        """
+        return cls(nx.read_graphml(graphml_input, force_multigraph=True), **options)
+
+    def select_edges(self, area):
+        """
+        Finds the roads that lie inside an area, keeping only the largest connected group of them so the area
+        can be patrolled in one circuit.
+
+        Parameters:
+        - area (shapely geometry): The area, in the graph's coordinate system.
+
+        Returns:
+        - numpy.ndarray: Sorted positions in self.edges of the selected roads.
+        """
+        shapely.prepare(area)
+        inside = shapely.intersects_xy(area, self.x, self.y)
+        selected = np.flatnonzero(inside[self.edge_nodes[:, 0]] & inside[self.edge_nodes[:, 1]])
+        if not len(selected):
+            return selected
+        H = nx.MultiGraph()
+        H.add_edges_from((int(u), int(v), {'index': int(index)})
+                         for index, (u, v) in zip(selected, self.edge_nodes[selected]))
+        largest = max(nx.connected_components(H), key=len)
+        return np.sort(np.array([index for u, v, index in H.edges(largest, data='index')], dtype=np.int64))
+
+    def subgraph(self, selected):
+        """
+        Copies the selected roads out of the county graph, with 'total_distance' set to their length.
+        """
+        G = self.G.edge_subgraph([self.edges[index] for index in selected.tolist()]).copy()
+        G.graph['total_distance'] = sum(length for _, _, length in G.edges(data='length', default=0))
+        return G
+
+    def plan(self, selected, euler_form_method, euler_order_method, euler_form_options):
+        """
+        Eulerizes and orders the selected roads, like modify_graph() but without writing any files. Runs on a
+        worker thread.
+
+        Returns:
+        - dict: The circuit as a GeoJSON FeatureCollection with 'total_distance', 'original_distance',
+          'circuit_length_multiplier', 'artificial_edges' and 'planning_time_s' members added.
+        """
+        start = time.perf_counter()
+        G = self.subgraph(selected)
+        euler_G = eulerize_graph(G, euler_form_method, euler_form_options)
+        circuit = order_circuit(euler_G, euler_order_method)
+        edges, artificial_edges = annotate_circuit_edges(euler_G, circuit, self.length_unit)
+        total_distance = 0
+        for _, _, data in edges:
+            total_distance += data['length']
+        old_length = G.graph['total_distance']
+        return {
+            'type': 'FeatureCollection',
+            'features': list(circuit_features(edges, formatted_road_name=self.formatted_road_name)),
+            'total_distance': total_distance,
+            'original_distance': old_length,
+            'circuit_length_multiplier': total_distance / old_length if old_length else None,
+            'artificial_edges': artificial_edges,
+            'planning_time_s': time.perf_counter() - start,
+        }
+
+    def parse_request(self, bbox=None, polygon=None, euler_form_method="built_in_weighted",
+                      euler_order_method="hierholzer", euler_form_options=None):
+        """
+        Checks the arguments of a route() call before anything is looked up or planned.
+
+        Returns:
+        - tuple: (area key, area as a shapely geometry).
+
+        Raises:
+        - ValueError: If the area is not a bbox of four numbers or a polygon, a method is unknown, or an
+          option is not accepted by the eulerization method or has a value out of range, see
+          FORM_OPTION_CHECKS.
+        """
+        if euler_form_method not in EULERIZERS:
+            raise ValueError(f"Unknown euler_form_method {euler_form_method!r}, expected one of {list(EULERIZERS)}")
+        if euler_order_method not in ORDER_METHODS:
+            raise ValueError(f"Unknown euler_order_method {euler_order_method!r}, "
+                             f"expected one of {list(ORDER_METHODS)}")
+        if euler_form_options is not None:
+            if not isinstance(euler_form_options, dict):
+                raise ValueError("euler_form_options must be an object")
+            accepted = [name for name in list(inspect.signature(EULERIZERS[euler_form_method]).parameters)[1:]
+                        if name in FORM_OPTION_CHECKS]
+            unknown = sorted(set(euler_form_options) - set(accepted))
+            if unknown:
+                raise ValueError(f"{euler_form_method!r} does not accept {unknown}, expected some of {accepted}")
+            for name, value in euler_form_options.items():
+                expected, check = FORM_OPTION_CHECKS[name]
+                if not check(value):
+                    raise ValueError(f"{name} must be {expected}, got {value!r}")
+
+        if (bbox is None) == (polygon is None):
+            raise ValueError("Give either bbox or polygon")
+        if bbox is not None:
+            if not isinstance(bbox, (list, tuple)) or len(bbox) != 4 or not all(map(_is_number, bbox)):
+                raise ValueError("bbox must be four numbers: [minx, miny, maxx, maxy]")
+            return ('bbox', tuple(float(value) for value in bbox)), box(*bbox)
+        try:
+            area = polygon if isinstance(polygon, shapely.Geometry) else shape(polygon)
+        except (AttributeError, KeyError, TypeError, ValueError, ShapelyError) as error:
+            raise ValueError(f"polygon is not a GeoJSON geometry: {error!r}") from error
+        area = shapely.normalize(area)
+        return ('polygon', shapely.to_wkb(area, hex=True)), area
+
+    async def route(self, bbox=None, polygon=None, euler_form_method="built_in_weighted",
+                    euler_order_method="hierholzer", euler_form_options=None):
+        """
+        Plans a patrol circuit for an area, answering from the cache when it can.
+
+        Parameters:
+        - bbox (tuple, optional): The area as (minx, miny, maxx, maxy).
+        - polygon (shapely geometry or GeoJSON dict, optional): The area as a polygon.
+        - euler_form_method (str): Eulerization method, as in modify_graph().
+        - euler_order_method (str): Circuit ordering method, as in modify_graph().
+        - euler_form_options (dict): Extra keyword arguments for the eulerization method.
+
+        Returns:
+        - dict: The circuit as a GeoJSON FeatureCollection, see plan(). It is shared with the cache, so it
+          must not be modified.
+
+        Raises:
+        - ValueError: If the request is invalid, see parse_request(), or the area contains no roads.
+        """
+        area_key, area = self.parse_request(bbox, polygon, euler_form_method, euler_order_method,
+                                            euler_form_options)
+        selected = self.areas.get(area_key)
+        if selected is None:
+            selected = self.select_edges(area)
+            self.areas.put(area_key, selected)
+        if not len(selected):
+            raise ValueError("The area contains no roads")
+
+        # areas that select the same roads share their routes
+        fingerprint = hashlib.sha1(selected.tobytes()).hexdigest()
+        key = (fingerprint, euler_form_method, euler_order_method,
+               json.dumps(euler_form_options or {}, sort_keys=True))
+        result = self.routes.get(key)
+        if result is not None:
+            return result
+        if key in self.in_flight:
+            return await asyncio.shield(self.in_flight[key])
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self.plan, selected, euler_form_method, euler_order_method,
+                                      euler_form_options)
+        self.in_flight[key] = future
+        try:
+            result = await asyncio.shield(future)
+        finally:
+            del self.in_flight[key]
+        self.routes.put(key, result)
+        return result
+
+    def stats(self):
+        """
+        Returns the cache sizes and hit counts.
+        """
+        return {'routes_cached': len(self.routes), 'route_hits': self.routes.hits,
+                'route_misses': self.routes.misses, 'areas_cached': len(self.areas),
+                'area_hits': self.areas.hits, 'area_misses': self.areas.misses,
+                'in_flight': len(self.in_flight)}
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answers one HTTP request: POST /route with a JSON body holding "bbox" or "polygon" (a GeoJSON
+        geometry) and optionally "euler_form_method", "euler_order_method" and "euler_form_options", or
+        GET /stats. Invalid requests are answered with 400 and failures while planning with 500.
+        """
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            method, path = request_line[:2] if len(request_line) >= 2 else ('', '')
+            if method == 'GET' and path == '/stats':
+                status, payload = 200, self.stats()
+            elif method == 'POST' and path == '/route':
+                request = json.loads(body or b'{}')
+                if not isinstance(request, dict):
+                    raise ValueError("The request body must be a JSON object")
+                try:
+                    status, payload = 200, await self.route(
+                        bbox=request.get('bbox'), polygon=request.get('polygon'),
+                        euler_form_method=request.get('euler_form_method', "built_in_weighted"),
+                        euler_order_method=request.get('euler_order_method', "hierholzer"),
+                        euler_form_options=request.get('euler_form_options'))
+                except (ValueError, nx.NetworkXException) as error:
+                    status, payload = 400, {'error': str(error)}
+            else:
+                status, payload = 404, {'error': "Use POST /route or GET /stats"}
+        except (ValueError, asyncio.IncompleteReadError) as error:
+            status, payload = 400, {'error': str(error)}
+        except Exception as error:
+            status, payload = 500, {'error': f"{type(error).__name__}: {error}"}
+        try:
+            data = json.dumps(payload).encode()
+            reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}[status]
+            writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        """
+        Serves route requests over HTTP until cancelled.
+        """
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve patrol routes for areas of a road graph kept in memory.")
+    parser.add_argument('graphml_input', help="GraphML road graph written by convert_to_graph_road_edges()")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-size', type=int, default=128, help="number of routes kept in memory")
+    parser.add_argument('--workers', type=int, default=None, help="number of planning threads")
+    parser.add_argument('--length-unit', default="miles")
+    args = parser.parse_args()
+    service = RouteService.from_graphml(args.graphml_input, cache_size=args.cache_size, max_workers=args.workers,
+                                        length_unit=args.length_unit)
+    print(f"Serving routes on http://{args.host}:{args.port}")
+    asyncio.run(service.serve(args.host, args.port))
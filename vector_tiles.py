@@ -0,0 +1,482 @@
+import argparse
+import gzip
+import json
+import math
+import os
+import sqlite3
+import struct
+import numpy as np
+import shapely
+import instrumentation
+
+# Web Mercator stops short of the poles
+MAX_LATITUDE = 85.0511287798
+
+# Mapbox Vector Tile geometry commands
+MOVE_TO = 1
+LINE_TO = 2
+LINESTRING = 2
+
+
+def write_circuit_tiles(circuit, dest='circuit.mbtiles', min_zoom=10, max_zoom=16, formatted_road_name='FullStName',
+                        layer='circuit', extent=4096, buffer=64, tolerance=16, name=None):
+    """
+    Writes a circuit as a pyramid of vector tiles in an MBTiles SQLite file, so map viewers only load the
+    tiles on screen instead of the whole circuit GeoJSON.
+
+    The highest zoom level has one feature per road segment, carrying its position in the circuit, leaving
+    out only segments too short to span a tile coordinate. Lower zoom levels merge the consecutive segments
+    sharing an order label into one line and simplify it to the resolution of that zoom level, so a
+    county-wide circuit stays light when zoomed out. Tiles are encoded as Mapbox Vector Tiles by
+    encode_tile() and gzipped, as the MBTiles spec asks.
+
+    Next to the tiles the file holds a circuit_segments table indexed by position and order label and a
+    circuit_rtree R*Tree of the segment bounds, which CircuitTiles uses to find a circuit position, an order
+    label or the segments in an area without decoding any tiles.
+
+    Parameters:
+    - circuit (str or geopandas.GeoDataFrame): The circuit, such as the GeoJSON file written by
+      convert_to_geojson() or PatrolPlan.geodataframe(), with one row per road segment in circuit order and
+      longitude/latitude coordinates.
+    - dest (str): Path of the MBTiles file. An existing file is replaced.
+    - min_zoom (int): Lowest zoom level written.
+    - max_zoom (int): Highest zoom level written, the only one with every segment as its own feature.
+    - formatted_road_name (str): The column name for the road name in the circuit.
+    - layer (str): Name of the vector tile layer.
+    - extent (int): Size of a tile in tile coordinates.
+    - buffer (int): How far, in tile coordinates, lines are kept past the tile edge so they join up.
+    - tolerance (float): Simplification tolerance in tile coordinates. The default of 16 is one pixel of a
+      256 pixel tile.
+    - name (str, optional): Name of the tileset. Defaults to the file name.
+
+    Returns:
+    - int: The number of tiles written.
+    """
+    if not 0 <= min_zoom <= max_zoom:
+        raise ValueError("min_zoom must be between 0 and max_zoom")
+    if isinstance(circuit, str):
+        # only reading a GeoJSON circuit needs geopandas
+        import geopandas as gpd
+        circuit = gpd.read_file(circuit)
+
+    with instrumentation.stage('export', dest=dest, min_zoom=min_zoom, max_zoom=max_zoom):
+        geometries = shapely.force_2d(np.asarray(circuit.geometry.values, dtype=object))
+        segments = circuit_segments(circuit, formatted_road_name)
+        runs, run_geometries = order_runs(segments, geometries)
+
+        if os.path.exists(dest):
+            os.remove(dest)
+        connection = sqlite3.connect(dest)
+        try:
+            create_tables(connection)
+            tile_count = 0
+            for zoom in range(min_zoom, max_zoom + 1):
+                if zoom == max_zoom:
+                    tiles = zoom_tiles(geometries, segments, zoom, layer, extent, buffer, None)
+                else:
+                    tiles = zoom_tiles(run_geometries, runs, zoom, layer, extent, buffer, tolerance)
+                for x, y, data in tiles:
+                    # MBTiles numbers rows from the bottom
+                    connection.execute("INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                                       (zoom, x, (1 << zoom) - 1 - y, gzip.compress(data, mtime=0)))
+                    tile_count += 1
+            write_indexes(connection, segments, geometries)
+            bounds = shapely.total_bounds(geometries)
+            write_metadata(connection, name or os.path.splitext(os.path.basename(dest))[0], layer, bounds,
+                           min_zoom, max_zoom, list(segments))
+            connection.commit()
+        finally:
+            connection.close()
+        instrumentation.annotate(segments=len(geometries), runs=len(run_geometries), tiles=tile_count)
+    return tile_count
+
+
+def circuit_segments(circuit, formatted_road_name='FullStName'):
+    """
+    Pulls the attribute columns of a circuit GeoDataFrame out as plain lists.
+
+    Returns:
+    - dict: 'position', 'order', 'name', 'road_type', 'heading', 'length' and 'distance' (the length of the
+      circuit before the segment) columns, one entry per segment.
+    """
+    lengths = circuit['length'].astype(float).tolist() if 'length' in circuit else [math.nan] * len(circuit)
+    distances = np.r_[0, np.nancumsum(lengths)[:-1]] if len(lengths) else np.zeros(0)
+    return {
+        'position': list(range(len(circuit))),
+        'order': [parse_order(label) for label in circuit['order']],
+        'name': circuit[formatted_road_name].tolist() if formatted_road_name in circuit else [None] * len(circuit),
+        'road_type': circuit['road_type'].tolist() if 'road_type' in circuit else [None] * len(circuit),
+        'heading': circuit['heading'].astype(float).tolist() if 'heading' in circuit else [None] * len(circuit),
+        'length': lengths,
+        'distance': distances.tolist(),
+    }
+
+
+def parse_order(label):
+    """
+    Reads an order label as written by convert_to_geojson(), like "12, ", as an int.
+    """
+    return int(str(label).split(',')[0])
+
+
+def order_runs(segments, geometries):
+    """
+    Merges the consecutive segments sharing an order label into one line each, for the lower zoom levels.
+
+    Returns:
+    - tuple: The run columns ('position' of the first segment, 'order', 'name', 'road_type', 'length',
+      'distance' and 'segments') and a line per run.
+    """
+    orders = np.asarray(segments['order'], dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, orders[1:] != orders[:-1]]) if len(orders) else np.zeros(0, dtype=np.int64)
+    counts = np.diff(np.r_[starts, len(orders)])
+    run_of_segment = np.repeat(np.arange(len(starts)), counts)
+
+    coords, index = shapely.get_coordinates(geometries, return_index=True)
+    run_index = run_of_segment[index] if len(index) else index
+    # consecutive segments share their end points, which are kept once
+    keep = np.r_[True, (run_index[1:] != run_index[:-1]) | np.any(coords[1:] != coords[:-1], axis=1)] \
+        if len(coords) else np.zeros(0, dtype=bool)
+    coords, run_index = coords[keep], run_index[keep]
+    point_counts = np.bincount(run_index, minlength=len(starts))
+    lines = point_counts >= 2
+    run_geometries = np.full(len(starts), None, dtype=object)
+    if lines.any():
+        has_line = lines[run_index]
+        run_geometries[lines] = shapely.linestrings(coords[has_line],
+                                                    indices=np.cumsum(lines)[run_index[has_line]] - 1)
+    lengths = np.add.reduceat(np.nan_to_num(np.asarray(segments['length'], dtype=np.float64)), starts) \
+        if len(starts) else np.zeros(0)
+
+    first = starts.tolist()
+    runs = {
+        'position': first,
+        'order': [segments['order'][i] for i in first],
+        'name': [segments['name'][i] for i in first],
+        'road_type': [segments['road_type'][i] for i in first],
+        'length': lengths.tolist(),
+        'distance': [segments['distance'][i] for i in first],
+        'segments': counts.tolist(),
+    }
+    return {key: [value for value, line in zip(values, lines.tolist()) if line] for key, values in runs.items()}, \
+        run_geometries[lines]
+
+
+def zoom_tiles(geometries, columns, zoom, layer, extent, buffer, tolerance):
+    """
+    Cuts lines into the tiles of one zoom level.
+
+    Parameters:
+    - geometries (numpy.ndarray): Lines in longitude/latitude.
+    - columns (dict): Attribute columns, one entry per line.
+    - zoom (int): The zoom level.
+    - layer (str): Name of the vector tile layer.
+    - extent (int): Size of a tile in tile coordinates.
+    - buffer (int): How far lines are kept past the tile edge.
+    - tolerance (float, optional): Simplification tolerance in tile coordinates, None to keep every point.
+
+    Yields:
+    - tuple: (x, y, data) for every tile with any lines in it, with y counted from the top and data the
+      encoded tile.
+    """
+    scale = float(extent << zoom)
+    pixels = shapely.transform(geometries, lambda coords: mercator(coords) * scale)
+    if tolerance:
+        pixels = shapely.simplify(pixels, tolerance, preserve_topology=False)
+    bounds = shapely.bounds(pixels)
+    usable = ~np.isnan(bounds[:, 0])
+    last_tile = (1 << zoom) - 1
+    x0 = np.clip(np.floor((bounds[:, 0] - buffer) / extent), 0, last_tile)
+    y0 = np.clip(np.floor((bounds[:, 1] - buffer) / extent), 0, last_tile)
+    x1 = np.clip(np.floor((bounds[:, 2] + buffer) / extent), 0, last_tile)
+    y1 = np.clip(np.floor((bounds[:, 3] + buffer) / extent), 0, last_tile)
+    widths = np.where(usable, x1 - x0 + 1, 0).astype(np.int64)
+    heights = np.where(usable, y1 - y0 + 1, 0).astype(np.int64)
+
+    # every line is listed once for every tile its bounds touch
+    counts = widths * heights
+    features = np.repeat(np.arange(len(pixels)), counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    tile_x = x0[features].astype(np.int64) + within % widths[features]
+    tile_y = y0[features].astype(np.int64) + within // widths[features]
+    order = np.lexsort((features, tile_y, tile_x))
+    features, tile_x, tile_y = features[order], tile_x[order], tile_y[order]
+    breaks = np.flatnonzero((np.diff(tile_x) != 0) | (np.diff(tile_y) != 0)) + 1
+
+    for group in np.split(np.arange(len(features)), breaks):
+        if not len(group):
+            continue
+        x, y = int(tile_x[group[0]]), int(tile_y[group[0]])
+        members = features[group]
+        left, top = x * extent, y * extent
+        clipped = shapely.clip_by_rect(pixels[members], left - buffer, top - buffer, left + extent + buffer,
+                                       top + extent + buffer)
+        tile_features = []
+        for feature, geometry in zip(members.tolist(), clipped.tolist()):
+            lines = [np.rint(shapely.get_coordinates(part) - (left, top)).astype(np.int64)
+                     for part in shapely.get_parts(geometry).tolist()]
+            if lines:
+                tile_features.append((feature, lines))
+        data = encode_tile(layer, tile_features, columns, extent)
+        if data:
+            yield x, y, data
+
+
+def mercator(coords):
+    """
+    Projects longitude/latitude to Web Mercator, scaled so the world spans 0 to 1 with y pointing down.
+    """
+    lon = coords[:, 0]
+    lat = np.radians(np.clip(coords[:, 1], -MAX_LATITUDE, MAX_LATITUDE))
+    return np.column_stack([(lon + 180) / 360, 0.5 - np.arcsinh(np.tan(lat)) / (2 * math.pi)])
+
+
+def encode_tile(layer, features, columns, extent=4096):
+    """
+    Encodes lines as a Mapbox Vector Tile with a single layer.
+
+    Parameters:
+    - layer (str): Name of the layer.
+    - features (list): (row, lines) pairs, where row picks the feature's attributes out of columns and lines
+      holds an (n, 2) integer array of tile coordinates per line.
+    - columns (dict): Attribute columns. Missing values (None or NaN) are left out of the feature.
+    - extent (int): Size of the tile in tile coordinates.
+
+    Returns:
+    - bytes: The encoded tile, empty if no feature has a line left after rounding.
+    """
+    keys = list(columns)
+    values = {}
+    encoded_features = []
+    for row, lines in features:
+        geometry = line_geometry(lines)
+        if not geometry:
+            continue
+        tags = []
+        for key_index, key in enumerate(keys):
+            value = columns[key][row]
+            if value is None or isinstance(value, float) and math.isnan(value):
+                continue
+            if isinstance(value, np.generic):
+                value = value.item()
+            tags += [key_index, values.setdefault((type(value), value), len(values))]
+        encoded_features.append(_varint_field(1, row) + _field(2, _packed(tags)) + _varint_field(3, LINESTRING)
+                                + _field(4, _packed(geometry)))
+    if not encoded_features:
+        return b''
+    encoded_layer = _varint_field(15, 2) + _field(1, layer.encode())
+    encoded_layer += b''.join(_field(2, feature) for feature in encoded_features)
+    encoded_layer += b''.join(_field(3, key.encode()) for key in keys)
+    encoded_layer += b''.join(_field(4, _value(value)) for _, value in values)
+    encoded_layer += _varint_field(5, extent)
+    return _field(3, encoded_layer)
+
+
+def line_geometry(lines):
+    """
+    Encodes lines as vector tile geometry commands, dropping points that round onto the previous one and
+    lines left with a single point.
+
+    Returns:
+    - list: The command and parameter integers.
+    """
+    commands = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for points in lines:
+        if len(points) > 1:
+            points = points[np.r_[True, np.any(points[1:] != points[:-1], axis=1)]]
+        if len(points) < 2:
+            continue
+        deltas = np.diff(np.vstack([cursor, points]), axis=0)
+        zigzag = ((deltas << 1) ^ (deltas >> 63)).tolist()
+        commands += [MOVE_TO | 1 << 3, *zigzag[0], LINE_TO | (len(points) - 1) << 3]
+        for dx, dy in zigzag[1:]:
+            commands += [dx, dy]
+        cursor = points[-1]
+    return commands
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _packed(values):
+    return b''.join(map(_varint, values))
+
+
+def _field(number, payload):
+    # length delimited field
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _varint_field(number, value):
+    return _varint(number << 3) + _varint(value)
+
+
+def _value(value):
+    if isinstance(value, str):
+        return _field(1, value.encode())
+    if isinstance(value, bool):
+        return _varint_field(7, int(value))
+    if isinstance(value, int):
+        if value >= 0:
+            return _varint_field(5, value)
+        return _varint_field(6, (value << 1) ^ (value >> 63))
+    if isinstance(value, float):
+        return _varint(3 << 3 | 1) + struct.pack('<d', value)
+    return _field(1, str(value).encode())
+
+
+def create_tables(connection):
+    connection.executescript("""
+        CREATE TABLE metadata (name TEXT, value TEXT);
+        CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+        CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+        CREATE TABLE circuit_segments (position INTEGER PRIMARY KEY, order_label INTEGER, name TEXT,
+                                       road_type TEXT, heading REAL, length REAL, distance REAL);
+        CREATE INDEX circuit_segments_order ON circuit_segments (order_label);
+        CREATE VIRTUAL TABLE circuit_rtree USING rtree(id, minx, maxx, miny, maxy);
+    """)
+
+
+def write_indexes(connection, segments, geometries):
+    def clean(value):
+        return None if isinstance(value, float) and math.isnan(value) else value
+
+    rows = zip(segments['position'], segments['order'], segments['name'], segments['road_type'],
+               segments['heading'], segments['length'], segments['distance'])
+    connection.executemany("INSERT INTO circuit_segments VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           ([clean(value) for value in row] for row in rows))
+    bounds = shapely.bounds(geometries)
+    usable = ~np.isnan(bounds[:, 0])
+    connection.executemany("INSERT INTO circuit_rtree VALUES (?, ?, ?, ?, ?)",
+                           ((position, minx, maxx, miny, maxy) for position, (minx, miny, maxx, maxy)
+                            in zip(np.flatnonzero(usable).tolist(), bounds[usable].tolist())))
+
+
+def write_metadata(connection, name, layer, bounds, min_zoom, max_zoom, fields):
+    minx, miny, maxx, maxy = bounds.tolist()
+    fields = {field: "Number" if field in ('position', 'order', 'heading', 'length', 'distance', 'segments')
+              else "String" for field in fields + ['segments']}
+    metadata = {
+        'name': name,
+        'format': 'pbf',
+        'type': 'overlay',
+        'version': '1',
+        'description': "Patrol circuit, one feature per road segment at the highest zoom level",
+        'minzoom': str(min_zoom),
+        'maxzoom': str(max_zoom),
+        'bounds': f"{minx},{miny},{maxx},{maxy}",
+        'center': f"{(minx + maxx) / 2},{(miny + maxy) / 2},{max_zoom}",
+        'json': json.dumps({'vector_layers': [{'id': layer, 'fields': fields, 'minzoom': min_zoom,
+                                               'maxzoom': max_zoom}]}),
+    }
+    connection.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+
+
+class CircuitTiles:
+    """
+    Reads an MBTiles file written by write_circuit_tiles(): its tiles, and the circuit positions through the
+    order and spatial indexes it holds.
+
+    Parameters:
+    - path (str): Path of the MBTiles file.
+    """
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.connection = sqlite3.connect(path)
+        self.metadata = dict(self.connection.execute("SELECT name, value FROM metadata"))
+        self.max_zoom = int(self.metadata['maxzoom'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def tile(self, zoom, x, y):
+        """
+        Returns the decompressed vector tile at zoom/x/y, with y counted from the top as web maps do, or None
+        if the circuit does not reach it.
+        """
+        row = self.connection.execute("SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? "
+                                      "AND tile_row = ?", (zoom, x, (1 << zoom) - 1 - y)).fetchone()
+        return None if row is None else gzip.decompress(row[0])
+
+    def position(self, position, zoom=None):
+        """
+        Finds a circuit position.
+
+        Parameters:
+        - position (int): Index of the segment in the circuit.
+        - zoom (int, optional): Zoom level of the tile to return. Defaults to the highest one.
+
+        Returns:
+        - dict: The segment's 'position', 'order', 'name', 'road_type', 'heading', 'length' and 'distance'
+          along the circuit, its 'bounds' as (minx, miny, maxx, maxy), rounded outwards to the 32-bit floats
+          the R*Tree keeps, and the (zoom, x, y) 'tile' its middle lies in, or None if there is no such
+          position.
+        """
+        rows = self._segments("s.position = ?", (position,))
+        if not rows:
+            return None
+        segment = rows[0]
+        minx, miny, maxx, maxy = segment['bounds']
+        segment['tile'] = tile_of((minx + maxx) / 2, (miny + maxy) / 2, self.max_zoom if zoom is None else zoom)
+        return segment
+
+    def order(self, order):
+        """
+        Returns the segments with an order label, as position() describes them without 'tile', in circuit
+        order.
+        """
+        return self._segments("s.order_label = ?", (order,))
+
+    def within(self, bbox):
+        """
+        Returns the segments whose bounds meet a (minx, miny, maxx, maxy) box, as position() describes them
+        without 'tile', in circuit order.
+        """
+        minx, miny, maxx, maxy = bbox
+        return self._segments("r.maxx >= ? AND r.minx <= ? AND r.maxy >= ? AND r.miny <= ?",
+                              (minx, maxx, miny, maxy))
+
+    def _segments(self, where, parameters):
+        rows = self.connection.execute(
+            "SELECT s.position, s.order_label, s.name, s.road_type, s.heading, s.length, s.distance, "
+            "r.minx, r.miny, r.maxx, r.maxy FROM circuit_segments s JOIN circuit_rtree r ON r.id = s.position "
+            f"WHERE {where} ORDER BY s.position", parameters)
+        return [{'position': row[0], 'order': row[1], 'name': row[2], 'road_type': row[3], 'heading': row[4],
+                 'length': row[5], 'distance': row[6], 'bounds': tuple(row[7:])} for row in rows]
+
+
+def tile_of(lon, lat, zoom):
+    """
+    Returns the (zoom, x, y) of the tile a point lies in, with y counted from the top.
+    """
+    x, y = mercator(np.array([[lon, lat]], dtype=np.float64))[0] * (1 << zoom)
+    last_tile = (1 << zoom) - 1
+    return zoom, min(max(int(x), 0), last_tile), min(max(int(y), 0), last_tile)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a circuit GeoJSON file as MBTiles vector tiles.")
+    parser.add_argument('circuit', help="circuit GeoJSON written by convert_to_geojson()")
+    parser.add_argument('dest', help="destination .mbtiles file")
+    parser.add_argument('--min-zoom', type=int, default=10)
+    parser.add_argument('--max-zoom', type=int, default=16)
+    parser.add_argument('--road-name', default='FullStName', help="road name column of the circuit")
+    args = parser.parse_args()
+    count = write_circuit_tiles(args.circuit, args.dest, min_zoom=args.min_zoom, max_zoom=args.max_zoom,
+                                formatted_road_name=args.road_name)
+    print(f"wrote {count} tiles to {args.dest}")